@@ -0,0 +1 @@
+"""Benchmarks for rhasspy-speech decoding and training."""
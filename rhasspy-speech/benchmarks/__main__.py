@@ -0,0 +1,189 @@
+"""Run decode and training benchmarks.
+
+From the rhasspy-speech directory:
+
+    PYTHONPATH=src python3 -m benchmarks
+
+Stub executables are used unless --tools-dir is given.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import wave
+from pathlib import Path
+from typing import Any, Dict
+
+from rhasspy_speech.const import LangSuffix
+from rhasspy_speech.tools import KaldiTools
+
+from .pipeline import benchmark_pipeline
+from .stubs import (
+    STUB_LOG_ENV,
+    create_stub_model,
+    create_stub_tools,
+    write_stub_lattice,
+)
+from .timing import print_timings
+from .training import benchmark_training, sample_sentence
+from .transcribe import benchmark_transcribe
+
+_LOGGER = logging.getLogger("benchmarks")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(prog="benchmarks")
+    parser.add_argument(
+        "--tools-dir", help="Directory with real Kaldi/OpenFST tools (default: stubs)"
+    )
+    parser.add_argument(
+        "--model-dir", help="Directory with downloaded model (default: stub)"
+    )
+    parser.add_argument(
+        "--wav", help="WAV file to transcribe (default: 2 seconds of silence)"
+    )
+    parser.add_argument(
+        "--entities",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 10000],
+        help="Number of entities in synthetic intents for training",
+    )
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument(
+        "--max-parallel-stages",
+        type=int,
+        help="Maximum number of training stages at once (default: CPU count)",
+    )
+    parser.add_argument(
+        "--dynamic-list",
+        action="append",
+        default=[],
+        help="Slot list to compile separately when training (e.g., name)",
+    )
+    parser.add_argument(
+        "--skip",
+        action="append",
+        default=[],
+        choices=("pipeline", "transcribe", "training"),
+        help="Skip a benchmark",
+    )
+    parser.add_argument("--json", help="Write results to a JSON file")
+    parser.add_argument("--work-dir", help="Keep files here instead of a temp dir")
+    parser.add_argument("--debug", action="store_true", help="Log DEBUG messages")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    if args.work_dir:
+        work_dir = Path(args.work_dir).absolute()
+        work_dir.mkdir(parents=True, exist_ok=True)
+        temp_dir = None
+    else:
+        temp_dir = tempfile.mkdtemp(prefix="rhasspy_speech_bench_")
+        work_dir = Path(temp_dir)
+
+    try:
+        results = await _run_benchmarks(args, work_dir)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+async def _run_benchmarks(args: argparse.Namespace, work_dir: Path) -> Dict[str, Any]:
+    use_stubs = not args.tools_dir
+    if use_stubs:
+        _LOGGER.info("Using stub tools")
+        tools_dir = work_dir / "tools"
+        tools = create_stub_tools(tools_dir)
+        os.environ[STUB_LOG_ENV] = str(work_dir / "stub_runs.log")
+    else:
+        tools_dir = Path(args.tools_dir)
+        tools = KaldiTools.from_tools_dir(tools_dir)
+
+    if args.model_dir:
+        model_dir = Path(args.model_dir).absolute()
+    else:
+        model_dir = create_stub_model(work_dir / "model")
+
+    results: Dict[str, Any] = {"stubs": use_stubs}
+
+    if "pipeline" not in args.skip:
+        results["pipeline"] = await benchmark_pipeline(
+            tools, work_dir, iterations=args.iterations
+        )
+        print_timings("async_run_pipeline", results["pipeline"])
+        for name, stats in results["pipeline"].items():
+            print(
+                f"  {name:<32} tool runs/call={stats['tool_runs_per_call']}, "
+                f"spawn={stats['spawn_seconds_per_call'] * 1000:0.2f} ms/call, "
+                f"user={stats['user_seconds_per_call'] * 1000:0.2f} ms/call, "
+                f"sys={stats['system_seconds_per_call'] * 1000:0.2f} ms/call"
+            )
+
+    train_dir = work_dir / "train"
+    if "training" not in args.skip:
+        results["training"] = []
+        for num_entities in args.entities:
+            training_results = await benchmark_training(
+                tools,
+                model_dir,
+                train_dir,
+                num_entities,
+                max_parallel_stages=args.max_parallel_stages,
+                dynamic_lists=args.dynamic_list,
+            )
+            results["training"].append(training_results)
+            print_timings(
+                f"train: {num_entities} entities, "
+                f"{training_results['vocab_size']} words",
+                training_results["stages"],
+            )
+
+    if ("transcribe" not in args.skip) and train_dir.is_dir():
+        if args.wav:
+            with wave.open(args.wav, "rb") as wav_file:
+                audio = wav_file.readframes(wav_file.getnframes())
+        else:
+            audio = bytes(2 * 16000 * 2)
+
+        if use_stubs:
+            write_stub_lattice(
+                tools_dir,
+                train_dir / f"graph_{LangSuffix.GRAMMAR.value}" / "words.txt",
+                sample_sentence(),
+            )
+
+        results["transcribe"] = await benchmark_transcribe(
+            tools, model_dir, train_dir, audio, iterations=args.iterations
+        )
+        for lang_suffix, timings in results["transcribe"].items():
+            print_timings(f"transcribe: {lang_suffix}", timings)
+
+    # Totals for every tool run above
+    results["tools"] = tools.stats.get_stats()
+    print("tools")
+    for program, stats in results["tools"].items():
+        # Unknown if the tool never used more memory than this process
+        max_rss = f"{stats['max_rss_kb']} kB" if stats["max_rss_kb"] else "?"
+        print(
+            f"  {program:<32} n={stats['count']:<4} "
+            f"wall={stats['total_wall_seconds']:8.3f} s  "
+            f"user={stats['total_user_seconds']:8.3f} s  "
+            f"sys={stats['total_system_seconds']:8.3f} s  "
+            f"max_rss={max_rss}"
+        )
+
+    return results
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""Wall time and process count of KaldiTools.async_run_pipeline."""
+
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+from rhasspy_speech.tools import KaldiTools
+
+from .stubs import STUB_LOG_ENV, count_stub_runs
+from .timing import Timings
+
+# Filters that copy stdin to stdout (real or stub)
+_FILTERS = ("fstarcsort", "fstproject", "fstdeterminize", "fstminimize")
+
+_TOTAL_KEYS = ("spawn_seconds", "user_seconds", "system_seconds")
+
+
+async def benchmark_pipeline(
+    tools: KaldiTools,
+    work_dir: Path,
+    stage_counts: Sequence[int] = (1, 2, 4, 8),
+    input_bytes: int = 1024 * 1024,
+    iterations: int = 10,
+) -> Dict[str, Any]:
+    input_path = work_dir / "pipeline_input.txt"
+    with open(input_path, "w", encoding="utf-8") as input_file:
+        line_idx = 0
+        while input_file.tell() < input_bytes:
+            print(line_idx, line_idx + 1, "word", "word", file=input_file)
+            line_idx += 1
+
+    results: Dict[str, Any] = {}
+    for num_stages in stage_counts:
+        commands: List[List[str]] = [["fstprint", str(input_path)]]
+        for stage_idx in range(num_stages - 1):
+            commands.append([_FILTERS[stage_idx % len(_FILTERS)]])
+
+        timings = Timings()
+        stub_log = os.environ.get(STUB_LOG_ENV)
+        stub_runs_before = count_stub_runs(stub_log) if stub_log else 0
+        totals_before = _get_totals(tools)
+
+        for _ in range(iterations):
+            with timings.measure("pipeline"):
+                await tools.async_run_pipeline(*commands)
+
+        stub_runs = (count_stub_runs(stub_log) if stub_log else 0) - stub_runs_before
+        totals_after = _get_totals(tools)
+        results[f"{num_stages}_stages"] = {
+            **timings.to_dict()["pipeline"],
+            "tool_runs_per_call": stub_runs / iterations if stub_log else None,
+            **{
+                f"{key}_per_call": (totals_after[key] - totals_before[key]) / iterations
+                for key in _TOTAL_KEYS
+            },
+        }
+
+    return results
+
+
+def _get_totals(tools: KaldiTools) -> Dict[str, float]:
+    """Sum of recorded costs over all programs."""
+    totals = {key: 0.0 for key in _TOTAL_KEYS}
+    for program_stats in tools.stats.get_stats().values():
+        for key in _TOTAL_KEYS:
+            totals[key] += program_stats[f"total_{key}"]
+
+    return totals
@@ -0,0 +1,267 @@
+"""Stand-in Kaldi/OpenFST/OpenGRM executables for machines without them.
+
+Stubs copy their input to their output instead of doing real work, so the
+benchmarks measure process spawning, piping, and the Python side of each
+stage. Every stub appends its name to $RHASSPY_STUB_LOG when it is set.
+"""
+
+import os
+import stat
+from pathlib import Path
+from typing import Dict, Union
+
+from rhasspy_speech.tools import KaldiTools
+
+# Set to a file path to log every stub execution
+STUB_LOG_ENV = "RHASSPY_STUB_LOG"
+
+# Lattice body (without utterance id) printed by stub decoders
+STUB_LATTICE_FILENAME = "stub_lattice.txt"
+
+_HEADER = """#!/bin/sh
+if [ -n "${RHASSPY_STUB_LOG}" ]; then
+    echo "$(basename "$0")" >> "${RHASSPY_STUB_LOG}"
+fi
+TOOLS_DIR="$(cd "$(dirname "$0")/../.." && pwd)"
+"""
+
+# fstcompile, fstarcsort, ngramcount, etc.
+# The last two positional arguments are input/output ("-" for stdin/stdout).
+_FST_FILTER = """
+count=0
+for arg in "$@"; do
+    case "${arg}" in
+        --*) ;;
+        *) previous="${last}"; last="${arg}"; count=$((count + 1)) ;;
+    esac
+done
+in_file='-'
+out_file='-'
+if [ "${count}" -ge 2 ]; then
+    in_file="${previous}"
+    out_file="${last}"
+elif [ "${count}" -eq 1 ]; then
+    in_file="${last}"
+fi
+if [ "${in_file}" = '-' ]; then in_file='/dev/stdin'; fi
+if [ "${out_file}" = '-' ]; then out_file='/dev/stdout'; fi
+cat "${in_file}" > "${out_file}"
+"""
+
+# fstreplace [--flags] <root.fst> <root label> [<fst> <label> ...] [<out.fst>]
+# Copies the root FST to the output.
+_FST_REPLACE = """
+count=0
+for arg in "$@"; do
+    case "${arg}" in
+        --*) ;;
+        *)
+            count=$((count + 1))
+            if [ "${count}" -eq 1 ]; then root_file="${arg}"; fi
+            last="${arg}"
+            ;;
+    esac
+done
+out_file='/dev/stdout'
+if [ $((count % 2)) -eq 1 ]; then out_file="${last}"; fi
+cat "${root_file}" > "${out_file}"
+"""
+
+# lattice-scale, lattice-compose, etc. always read and write archives on stdio
+_LATTICE_FILTER = """
+cat
+"""
+
+_PRINT_LATTICE = """
+print_lattice() {
+    printf '%s\\n' "$1"
+    if [ -f "${TOOLS_DIR}/stub_lattice.txt" ]; then
+        cat "${TOOLS_DIR}/stub_lattice.txt"
+    else
+        printf '0 1 1 0,0,\\n1\\n'
+    fi
+    printf '\\n'
+}
+"""
+
+# Arguments: ... <spk2utt-rspecifier> <wav-rspecifier> <lattice-wspecifier>
+_WAV_DECODER = _PRINT_LATTICE + """
+eval spk2utt="\\${$(($# - 2))}"
+eval wav="\\${$(($# - 1))}"
+eval lattice="\\${$#}"
+utt_ids="$(cut -d' ' -f1 "${spk2utt#ark:}")"
+if [ "${wav}" = 'ark:-' ]; then
+    cat > /dev/null
+fi
+lattice="${lattice#ark:}"
+if [ "${lattice}" = '-' ]; then lattice='/dev/stdout'; fi
+for utt_id in ${utt_ids}; do
+    print_lattice "${utt_id}"
+done > "${lattice}"
+"""
+
+# Arguments: ... <lattice-wspecifier>
+# Reads raw audio on stdin until it is closed.
+_STREAM_DECODER = _PRINT_LATTICE + """
+eval lattice="\\${$#}"
+cat > /dev/null
+printf 'final\\n'
+print_lattice 'utt' > "${lattice#ark:}"
+"""
+
+# prepare_lang.sh <dict-dir> <unk> <lang-local-dir> <lang-dir>
+_PREPARE_LANG = """
+mkdir -p "$3" "$4/phones"
+{
+    echo '<eps> 0'
+    cut -d' ' -f1 "$1/lexicon.txt" | sort -u | awk '{ print $1, NR }'
+} > "$4/words.txt"
+next_id="$(wc -l < "$4/words.txt")"
+echo "#0 ${next_id}" >> "$4/words.txt"
+echo "${next_id}" > "$4/phones/disambig.int"
+echo '0 0 1 1' > "$4/L_disambig.fst"
+cp "$4/L_disambig.fst" "$4/L.fst"
+"""
+
+# format_lm.sh <lang-dir> <arpa-gz> <lexicon> <out-dir>
+_FORMAT_LM = """
+gunzip -c "$2" > "$4/G.fst"
+"""
+
+# mkgraph.sh [--self-loop-scale <scale>] <lang-dir> <model-dir> <graph-dir>
+_MKGRAPH = """
+if [ "$1" = '--self-loop-scale' ]; then shift 2; fi
+mkdir -p "$3"
+cp "$1/words.txt" "$3/words.txt"
+cat "$1/G.fst" > "$3/HCLG.fst"
+"""
+
+# prepare_online_decoding.sh --mfcc-config <conf> <lang> <extractor> <model> <out>
+_PREPARE_ONLINE = """
+mkdir -p "$6/conf"
+echo "--mfcc-config=$2" > "$6/conf/online.conf"
+"""
+
+# ngramprint --ARPA - <out.arpa>
+# Writes an empty text ARPA model (the input FST is binary).
+_NGRAM_PRINT = """
+for arg in "$@"; do out_file="${arg}"; done
+cat > /dev/null
+printf '\\data\\\n\\end\\\n' > "${out_file}"
+"""
+
+# phonetisaurus --model=<g2p.fst> --wordlist=<words.txt>
+_PHONETISAURUS = """
+for arg in "$@"; do
+    case "${arg}" in
+        --wordlist=*) awk '{ print $1, 0, "a" }' "${arg#--wordlist=}" ;;
+    esac
+done
+"""
+
+_STUBS: Dict[str, str] = {
+    **{
+        f"openfst/bin/{name}": _FST_FILTER
+        for name in (
+            "fstcompile",
+            "fstarcsort",
+            "fstproject",
+            "fstdeterminize",
+            "fstdeterminizestar",
+            "fstminimize",
+            "fstprint",
+            "fstrmsymbols",
+        )
+    },
+    "openfst/bin/fstreplace": _FST_REPLACE,
+    **{f"opengrm/bin/{name}": _FST_FILTER for name in ("ngramcount", "ngrammake")},
+    "opengrm/bin/ngramprint": _NGRAM_PRINT,
+    **{
+        f"kaldi/bin/{name}": _LATTICE_FILTER
+        for name in (
+            "lattice-scale",
+            "lattice-to-phone-lattice",
+            "lattice-compose",
+            "lattice-determinize",
+            "lattice-add-trans-probs",
+        )
+    },
+    "kaldi/bin/online2-wav-nnet3-latgen-faster": _WAV_DECODER,
+    "kaldi/bin/online2-cli-nnet3-decode-faster": _STREAM_DECODER,
+    "kaldi/utils/prepare_lang.sh": _PREPARE_LANG,
+    "kaldi/utils/format_lm.sh": _FORMAT_LM,
+    "kaldi/utils/mkgraph.sh": _MKGRAPH,
+    "kaldi/steps/online/nnet3/prepare_online_decoding.sh": _PREPARE_ONLINE,
+    "phonetisaurus": _PHONETISAURUS,
+}
+
+
+def create_stub_tools(tools_dir: Union[str, Path]) -> KaldiTools:
+    """Write stub executables in the same layout as a real tools dir."""
+    tools_dir = Path(tools_dir).absolute()
+    for stub_path, stub_body in _STUBS.items():
+        path = tools_dir / stub_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(_HEADER + stub_body, encoding="utf-8")
+        path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    return KaldiTools.from_tools_dir(tools_dir)
+
+
+def create_stub_model(model_dir: Union[str, Path]) -> Path:
+    """Write the files training and decoding expect from a downloaded model."""
+    model_dir = Path(model_dir).absolute()
+    kaldi_dir = model_dir / "model"
+
+    for dir_path in (
+        kaldi_dir / "conf",
+        kaldi_dir / "phones",
+        kaldi_dir / "model",
+        kaldi_dir / "extractor",
+        kaldi_dir / "online" / "conf",
+    ):
+        dir_path.mkdir(parents=True, exist_ok=True)
+
+    (kaldi_dir / "conf" / "mfcc_hires.conf").write_text("", encoding="utf-8")
+    (kaldi_dir / "phones" / "nonsilence_phones.txt").write_text("a\n", encoding="utf-8")
+    (kaldi_dir / "phones" / "silence_phones.txt").write_text(
+        "SIL\nSPN\n", encoding="utf-8"
+    )
+    (kaldi_dir / "phones" / "optional_silence.txt").write_text(
+        "SIL\n", encoding="utf-8"
+    )
+    (kaldi_dir / "model" / "final.mdl").write_text("", encoding="utf-8")
+    (kaldi_dir / "online" / "conf" / "online.conf").write_text("", encoding="utf-8")
+
+    return model_dir
+
+
+def write_stub_lattice(
+    tools_dir: Union[str, Path], words_txt: Union[str, Path], text: str
+) -> None:
+    """Make stub decoders output a single path with the words of text."""
+    word_ids: Dict[str, int] = {}
+    with open(words_txt, "r", encoding="utf-8") as words_file:
+        for line in words_file:
+            parts = line.split()
+            if len(parts) == 2:
+                word_ids[parts[0]] = int(parts[1])
+
+    lines = []
+    words = text.split()
+    for word_idx, word in enumerate(words):
+        lines.append(f"{word_idx} {word_idx + 1} {word_ids[word]} 0,0,")
+
+    lines.append(str(len(words)))
+    (Path(tools_dir) / STUB_LATTICE_FILENAME).write_text(
+        "\n".join(lines) + "\n", encoding="utf-8"
+    )
+
+
+def count_stub_runs(log_path: Union[str, Path]) -> int:
+    """Number of stub executions logged so far."""
+    if not os.path.exists(log_path):
+        return 0
+
+    with open(log_path, "r", encoding="utf-8") as log_file:
+        return sum(1 for _ in log_file)
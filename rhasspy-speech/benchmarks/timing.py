@@ -0,0 +1,47 @@
+"""Timing helpers."""
+
+import statistics
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+
+@dataclass
+class Timings:
+    """Durations in seconds grouped by stage name."""
+
+    stages: Dict[str, List[float]] = field(default_factory=lambda: defaultdict(list))
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage].append(time.perf_counter() - start_time)
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            stage: {
+                "count": len(durations),
+                "min_ms": min(durations) * 1000,
+                "median_ms": statistics.median(durations) * 1000,
+                "mean_ms": statistics.fmean(durations) * 1000,
+                "max_ms": max(durations) * 1000,
+            }
+            for stage, durations in self.stages.items()
+            if durations
+        }
+
+
+def print_timings(title: str, timings: Dict[str, Dict[str, Any]]) -> None:
+    print(title)
+    for stage, stats in timings.items():
+        print(
+            f"  {stage:<32} n={stats['count']:<4} "
+            f"median={stats['median_ms']:9.2f} ms  "
+            f"min={stats['min_ms']:9.2f} ms  max={stats['max_ms']:9.2f} ms"
+        )
@@ -0,0 +1,183 @@
+"""Stage times of KaldiTrainer.train for synthetic intents."""
+
+import io
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any, Collection, Dict, List, Optional
+
+from hassil.intents import Intents
+
+from rhasspy_speech.const import LangSuffix
+from rhasspy_speech.g2p import LexiconDatabase
+from rhasspy_speech.intent_fst import intents_to_fst
+from rhasspy_speech.kaldi import KaldiTrainer
+from rhasspy_speech.tools import KaldiTools
+
+from .timing import Timings
+
+# Trainer methods timed as separate stages
+_TRAINER_STAGES = (
+    "_create_lexicon",
+    "_prepare_lang",
+    "_compile_nonterminal",
+    "_create_grammar",
+    "_create_arpa",
+    "_create_fuzzy_fst",
+    "_mkgraph",
+    "_prepare_online_decoding",
+)
+
+_FIXED_WORDS = (
+    "turn",
+    "switch",
+    "on",
+    "off",
+    "the",
+    "set",
+    "brightness",
+    "to",
+    "low",
+    "medium",
+    "high",
+)
+
+_SYLLABLES = ("ba", "ke", "di", "fo", "gu", "la", "me", "ni", "po", "ru", "sa", "to")
+
+
+def entity_name(entity_idx: int) -> str:
+    """Unique, pronounceable name made only of letters."""
+    syllables: List[str] = []
+    while True:
+        entity_idx, syllable_idx = divmod(entity_idx, len(_SYLLABLES))
+        syllables.append(_SYLLABLES[syllable_idx])
+        if entity_idx == 0:
+            break
+
+    return "".join(syllables) + " light"
+
+
+def sample_sentence() -> str:
+    """Sentence that the trained grammar accepts."""
+    return f"turn on the {entity_name(0)}"
+
+
+def synthetic_intents(num_entities: int) -> Intents:
+    """Turn on/off and brightness intents for a list of entities."""
+    return Intents.from_dict(
+        {
+            "language": "en",
+            "intents": {
+                "HassTurnOn": {
+                    "data": [{"sentences": ["(turn | switch) on [the] {name}"]}]
+                },
+                "HassTurnOff": {
+                    "data": [{"sentences": ["(turn | switch) off [the] {name}"]}]
+                },
+                "HassLightSet": {
+                    "data": [
+                        {
+                            "sentences": [
+                                "set [the] {name} [brightness] to (low | medium | high)"
+                            ]
+                        }
+                    ]
+                },
+            },
+            "lists": {
+                "name": {
+                    "values": [
+                        entity_name(entity_idx) for entity_idx in range(num_entities)
+                    ]
+                }
+            },
+        }
+    )
+
+
+async def benchmark_training(
+    tools: KaldiTools,
+    model_dir: Path,
+    train_dir: Path,
+    num_entities: int,
+    lang_suffixes=(LangSuffix.GRAMMAR, LangSuffix.ARPA, LangSuffix.ARPA_RESCORE),
+    max_parallel_stages: Optional[int] = None,
+    dynamic_lists: Optional[Collection[str]] = None,
+) -> Dict[str, Any]:
+    """Train with num_entities and time each stage.
+
+    Then time an unchanged retrain, and a retrain with one more entity.
+    """
+    timings = Timings()
+    intents = synthetic_intents(num_entities)
+
+    # Fake pronunciations so phonetisaurus isn't needed.
+    # Includes the added entity, so retraining doesn't need new words.
+    lexicon = LexiconDatabase()
+    for word in _FIXED_WORDS:
+        lexicon.add(word, [["a"]])
+
+    for entity_idx in range(num_entities + 1):
+        for word in entity_name(entity_idx).split():
+            lexicon.add(word, [["a"]])
+
+    with io.StringIO() as fst_file, io.StringIO() as changed_fst_file:
+        with timings.measure("intents_to_fst"):
+            fst_context = intents_to_fst(
+                intents=intents,
+                fst_file=fst_file,
+                lexicon=lexicon,
+                number_language="en",
+                nonterminal_lists=dynamic_lists,
+            )
+
+        trainer = KaldiTrainer(
+            train_dir=train_dir,
+            model_dir=model_dir / "model",
+            tools=tools,
+            fst_context=fst_context,
+        )
+        for method_name in _TRAINER_STAGES:
+            setattr(
+                trainer,
+                method_name,
+                _timed(timings, method_name, getattr(trainer, method_name)),
+            )
+
+        with timings.measure("train (total)"):
+            await trainer.train(
+                lang_suffixes=lang_suffixes,
+                use_cache=False,
+                max_parallel_stages=max_parallel_stages,
+            )
+
+        # Nothing changed, so every stage should be reused
+        with timings.measure("retrain unchanged (total)"):
+            await trainer.train(lang_suffixes=lang_suffixes)
+
+        with timings.measure("retrain one more entity (total)"):
+            trainer.fst_context = intents_to_fst(
+                intents=synthetic_intents(num_entities + 1),
+                fst_file=changed_fst_file,
+                lexicon=lexicon,
+                number_language="en",
+                nonterminal_lists=dynamic_lists,
+            )
+            await trainer.train(
+                lang_suffixes=lang_suffixes, max_parallel_stages=max_parallel_stages
+            )
+
+    return {
+        "num_entities": num_entities,
+        "vocab_size": len(fst_context.vocab),
+        "stages": timings.to_dict(),
+    }
+
+
+def _timed(
+    timings: Timings, stage: str, method: Callable[..., Awaitable[Any]]
+) -> Callable[..., Awaitable[Any]]:
+    async def timed_method(*args, **kwargs):
+        with timings.measure(stage):
+            return await method(*args, **kwargs)
+
+    return timed_method
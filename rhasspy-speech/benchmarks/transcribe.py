@@ -0,0 +1,132 @@
+"""Per-stage latency of WAV/stream transcription and fuzzy matching."""
+
+import os
+from collections.abc import AsyncIterator
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from rhasspy_speech.const import LangSuffix
+from rhasspy_speech.decoder_pool import KaldiDecoderPool
+from rhasspy_speech.lattice import lattice_nbest
+from rhasspy_speech.tools import KaldiTools
+from rhasspy_speech.transcribe_stream import (
+    AUDIO_WRITE_BYTES,
+    KaldiNnet3StreamTranscriber,
+)
+from rhasspy_speech.transcribe_util import get_fuzzy_text
+from rhasspy_speech.transcribe_wav import (
+    KaldiNnet3WavTranscriber,
+    _get_spk2utt_fd,
+    _get_wav_ark,
+)
+
+from .timing import Timings
+
+
+async def benchmark_transcribe(
+    tools: KaldiTools,
+    model_dir: Path,
+    train_dir: Path,
+    audio: bytes,
+    iterations: int = 10,
+    nbest: int = 3,
+    max_fuzzy_cost: float = 3.0,
+) -> Dict[str, Any]:
+    """Time transcription of the same audio with each decode mode."""
+    rescore_lang_dir = train_dir / "data" / f"lang_{LangSuffix.ARPA_RESCORE.value}"
+    results: Dict[str, Any] = {}
+
+    for lang_suffix in (LangSuffix.GRAMMAR, LangSuffix.ARPA):
+        graph_dir = train_dir / f"graph_{lang_suffix.value}"
+        lang_dir = train_dir / "data" / f"lang_{lang_suffix.value}"
+        if not graph_dir.is_dir():
+            continue
+
+        timings = Timings()
+        wav_transcriber = KaldiNnet3WavTranscriber(model_dir, graph_dir, tools)
+        pool = KaldiDecoderPool(tools)
+        stream_transcriber = KaldiNnet3StreamTranscriber(model_dir, graph_dir, tools)
+        pooled_transcriber = KaldiNnet3StreamTranscriber(
+            model_dir, graph_dir, tools, decoder_pool=pool
+        )
+
+        try:
+            for _ in range(iterations):
+                # Break down the WAV transcription into its stages
+                with timings.measure("wav.decode"):
+                    lattice_bytes = await _decode_wav(wav_transcriber, audio)
+
+                with timings.measure("wav.nbest"):
+                    nbest_paths = lattice_nbest(
+                        lattice_bytes,
+                        nbest,
+                        acoustic_scale=wav_transcriber.acoustic_scale,
+                    )
+
+                with timings.measure("fuzzy"):
+                    get_fuzzy_text([path.word_ids for path in nbest_paths], lang_dir)
+
+                with timings.measure("wav.async_transcribe"):
+                    await wav_transcriber.async_transcribe(
+                        audio, lang_dir, nbest=nbest, max_fuzzy_cost=max_fuzzy_cost
+                    )
+
+                with timings.measure("stream.async_transcribe"):
+                    await stream_transcriber.async_transcribe(
+                        _audio_stream(audio),
+                        lang_dir,
+                        nbest=nbest,
+                        max_fuzzy_cost=max_fuzzy_cost,
+                    )
+
+                with timings.measure("stream.async_transcribe (pooled)"):
+                    await pooled_transcriber.async_transcribe(
+                        _audio_stream(audio),
+                        lang_dir,
+                        nbest=nbest,
+                        max_fuzzy_cost=max_fuzzy_cost,
+                    )
+
+                if (lang_suffix == LangSuffix.ARPA) and rescore_lang_dir.is_dir():
+                    with timings.measure("wav.async_transcribe_rescore"):
+                        await wav_transcriber.async_transcribe_rescore(
+                            audio,
+                            lang_dir,
+                            rescore_lang_dir,
+                            nbest=nbest,
+                            max_fuzzy_cost=max_fuzzy_cost,
+                        )
+
+                    with timings.measure("stream.async_transcribe_rescore"):
+                        await stream_transcriber.async_transcribe_rescore(
+                            _audio_stream(audio),
+                            lang_dir,
+                            rescore_lang_dir,
+                            nbest=nbest,
+                            max_fuzzy_cost=max_fuzzy_cost,
+                        )
+        finally:
+            pool.close()
+
+        results[lang_suffix.value] = timings.to_dict()
+
+    return results
+
+
+async def _decode_wav(transcriber: KaldiNnet3WavTranscriber, audio: bytes) -> bytes:
+    spk2utt_fd = _get_spk2utt_fd()
+    try:
+        return await transcriber.tools.async_run(
+            "online2-wav-nnet3-latgen-faster",
+            transcriber.get_decode_args(f"ark:/dev/fd/{spk2utt_fd}"),
+            input=_get_wav_ark(audio),
+            pass_fds=(spk2utt_fd,),
+        )
+    finally:
+        os.close(spk2utt_fd)
+
+
+async def _audio_stream(audio: bytes) -> AsyncIterator[Optional[bytes]]:
+    for offset in range(0, len(audio), AUDIO_WRITE_BYTES):
+        chunk_end = offset + AUDIO_WRITE_BYTES
+        yield audio[offset:chunk_end]
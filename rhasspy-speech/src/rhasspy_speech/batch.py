@@ -0,0 +1,322 @@
+"""Transcribe many WAV files with one decoder per shard."""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+from collections.abc import AsyncIterator, Iterable
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from .const import LangSuffix
+from .hassil_fst import decode_meta
+from .lattice import LatticePath, ids_to_words, load_symbol_table, read_lattice
+from .tools import KaldiTools
+from .transcribe_util import get_fuzzy_text
+from .transcribe_wav import KaldiNnet3WavTranscriber
+
+_LOGGER = logging.getLogger(__name__)
+
+# Only keep the end of decoder logs for error messages
+_MAX_STDERR_BYTES = 64 * 1024
+
+
+@dataclass
+class BatchResult:
+    wav_path: Path
+    text: str = ""
+    nbest: List[Tuple[str, LatticePath]] = field(default_factory=list)
+    fuzzy: Optional[Tuple[str, float]] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "wav": str(self.wav_path),
+            "text": self.text,
+            "nbest": [
+                {
+                    "text": text,
+                    "graph_cost": path.graph_cost,
+                    "acoustic_cost": path.acoustic_cost,
+                }
+                for text, path in self.nbest
+            ],
+            "fuzzy": (
+                {"text": decode_meta(self.fuzzy[0]), "cost": self.fuzzy[1]}
+                if self.fuzzy is not None
+                else None
+            ),
+            "error": self.error,
+        }
+
+
+async def transcribe_many(
+    wav_paths: Iterable[Union[str, Path]],
+    transcriber: KaldiNnet3WavTranscriber,
+    lang_dir: Union[str, Path],
+    num_workers: Optional[int] = None,
+    nbest: int = 1,
+    max_fuzzy_cost: Optional[float] = None,
+) -> AsyncIterator[BatchResult]:
+    """Transcribe WAV files, yielding results as they are decoded.
+
+    WAV files are split into one shard per worker, and each shard is decoded
+    by a single online2-wav-nnet3-latgen-faster process so the model and graph
+    are only loaded once per worker.
+    """
+    wav_paths = [Path(p).absolute() for p in wav_paths]
+    if not wav_paths:
+        return
+
+    lang_dir = Path(lang_dir)
+    num_workers = max(1, min(num_workers or os.cpu_count() or 1, len(wav_paths)))
+
+    # utterance id -> WAV path
+    shards: List[Dict[str, Path]] = [{} for _ in range(num_workers)]
+    for wav_idx, wav_path in enumerate(wav_paths):
+        shards[wav_idx % num_workers][f"utt{wav_idx:08d}"] = wav_path
+
+    results: "asyncio.Queue[Optional[BatchResult]]" = asyncio.Queue()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tasks = [
+            asyncio.create_task(
+                _decode_shard(
+                    shard,
+                    Path(temp_dir) / f"shard_{shard_idx}",
+                    transcriber,
+                    lang_dir,
+                    nbest,
+                    max_fuzzy_cost,
+                    results,
+                )
+            )
+            for shard_idx, shard in enumerate(shards)
+        ]
+
+        try:
+            num_finished = 0
+            while num_finished < len(tasks):
+                result = await results.get()
+                if result is None:
+                    # Shard finished
+                    num_finished += 1
+                    continue
+
+                yield result
+
+            # Raise errors from shards
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+async def _decode_shard(
+    shard: Dict[str, Path],
+    shard_dir: Path,
+    transcriber: KaldiNnet3WavTranscriber,
+    lang_dir: Path,
+    nbest: int,
+    max_fuzzy_cost: Optional[float],
+    results: "asyncio.Queue[Optional[BatchResult]]",
+) -> None:
+    try:
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        wav_scp = shard_dir / "wav.scp"
+        spk2utt = shard_dir / "spk2utt"
+        with open(wav_scp, "w", encoding="utf-8") as wav_scp_file, open(
+            spk2utt, "w", encoding="utf-8"
+        ) as spk2utt_file:
+            for utt_id, wav_path in shard.items():
+                print(utt_id, wav_path, file=wav_scp_file)
+
+                # Each utterance is its own speaker, like single transcriptions
+                print(utt_id, utt_id, file=spk2utt_file)
+
+        program = "online2-wav-nnet3-latgen-faster"
+        args = transcriber.get_decode_args(f"ark:{spk2utt}", f"scp:{wav_scp}")
+        _LOGGER.debug("%s %s", program, args)
+
+        proc = await asyncio.create_subprocess_exec(
+            program,
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=transcriber.tools.extended_env,
+        )
+        assert proc.stdout is not None
+        assert proc.stderr is not None
+
+        stderr_task = asyncio.create_task(_read_stderr_tail(proc.stderr))
+        symbols = load_symbol_table(transcriber.graph_dir / "words.txt")
+        remaining = dict(shard)
+
+        try:
+            # Parse lattices as soon as each one is complete
+            buffer = bytes()
+            while True:
+                data = await proc.stdout.read(4096)
+                if not data:
+                    break
+
+                buffer += data
+                while buffer:
+                    try:
+                        utt_id, lattice, offset = read_lattice(buffer)
+                    except EOFError:
+                        break
+
+                    buffer = buffer[offset:].lstrip()
+                    wav_path = remaining.pop(utt_id, None)
+                    if wav_path is None:
+                        _LOGGER.warning("Unexpected utterance id: %s", utt_id)
+                        continue
+
+                    nbest_paths = lattice.nbest(
+                        nbest, acoustic_scale=transcriber.acoustic_scale
+                    )
+                    results.put_nowait(
+                        _get_result(
+                            wav_path,
+                            nbest_paths,
+                            symbols,
+                            lang_dir,
+                            max_fuzzy_cost,
+                        )
+                    )
+
+            await proc.wait()
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+
+        stderr = await stderr_task
+        if proc.returncode != 0:
+            raise RuntimeError(
+                f"Unexpected error running command {program} {args}: "
+                + stderr.decode(errors="ignore")
+            )
+
+        # Utterances the decoder skipped (e.g., unreadable WAV)
+        for wav_path in remaining.values():
+            results.put_nowait(BatchResult(wav_path, error="No lattice"))
+    finally:
+        results.put_nowait(None)
+
+
+def _get_result(
+    wav_path: Path,
+    nbest_paths: List[LatticePath],
+    symbols: Dict[int, str],
+    lang_dir: Path,
+    max_fuzzy_cost: Optional[float],
+) -> BatchResult:
+    result = BatchResult(wav_path)
+    result.nbest = [
+        (decode_meta(" ".join(ids_to_words(path.word_ids, symbols))), path)
+        for path in nbest_paths
+    ]
+    result.fuzzy = get_fuzzy_text([path.word_ids for path in nbest_paths], lang_dir)
+
+    if (result.fuzzy is not None) and (
+        (max_fuzzy_cost is None) or (result.fuzzy[1] <= max_fuzzy_cost)
+    ):
+        result.text = decode_meta(result.fuzzy[0])
+    elif result.nbest:
+        result.text = result.nbest[0][0]
+
+    return result
+
+
+async def _read_stderr_tail(stderr: asyncio.StreamReader) -> bytes:
+    tail = bytes()
+    while True:
+        data = await stderr.read(4096)
+        if not data:
+            break
+
+        tail = (tail + data)[-_MAX_STDERR_BYTES:]
+
+    return tail
+
+
+# -----------------------------------------------------------------------------
+
+
+def get_wav_paths(paths: Iterable[Union[str, Path]]) -> List[Path]:
+    """Expand directories into sorted WAV files."""
+    wav_paths: List[Path] = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            wav_paths.extend(sorted(path.rglob("*.wav")))
+        else:
+            wav_paths.append(path)
+
+    return wav_paths
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(prog="rhasspy_speech.batch")
+    parser.add_argument("wav", nargs="+", help="WAV file or directory of WAV files")
+    parser.add_argument(
+        "--model-dir", required=True, help="Directory with downloaded model"
+    )
+    parser.add_argument(
+        "--train-dir", required=True, help="Directory with trained model"
+    )
+    parser.add_argument(
+        "--tools-dir", required=True, help="Directory with Kaldi/OpenFST tools"
+    )
+    parser.add_argument(
+        "--decode-mode",
+        choices=(LangSuffix.GRAMMAR.value, LangSuffix.ARPA.value),
+        default=LangSuffix.ARPA.value,
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Number of decoders (default: CPU count)"
+    )
+    parser.add_argument("--nbest", type=int, default=3)
+    parser.add_argument("--max-fuzzy-cost", type=float, default=3.0)
+    parser.add_argument("--max-active", type=int, default=7000)
+    parser.add_argument("--lattice-beam", type=float, default=8.0)
+    parser.add_argument("--acoustic-scale", type=float, default=0.5)
+    parser.add_argument("--beam", type=float, default=24.0)
+    parser.add_argument("--debug", action="store_true", help="Log DEBUG messages")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    train_dir = Path(args.train_dir)
+    transcriber = KaldiNnet3WavTranscriber(
+        model_dir=args.model_dir,
+        graph_dir=train_dir / f"graph_{args.decode_mode}",
+        tools=KaldiTools.from_tools_dir(args.tools_dir),
+        max_active=args.max_active,
+        lattice_beam=args.lattice_beam,
+        acoustic_scale=args.acoustic_scale,
+        beam=args.beam,
+    )
+
+    async for result in transcribe_many(
+        get_wav_paths(args.wav),
+        transcriber,
+        lang_dir=train_dir / "data" / f"lang_{args.decode_mode}",
+        num_workers=args.workers,
+        nbest=args.nbest,
+        max_fuzzy_cost=args.max_fuzzy_cost,
+    ):
+        json.dump(result.to_dict(), sys.stdout, ensure_ascii=False)
+        print("", flush=True)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -10,7 +10,6 @@ import asyncio.subprocess
 import itertools
 import logging
 import math
-import shlex
 import shutil
 import struct
 import tempfile
@@ -182,25 +181,25 @@ class CoquiSttTranscriber:
             stdout = await self.tools.async_run_pipeline(
                 [
                     "fstcompile",
-                    shlex.quote(f"--isymbols={tokens_txt}"),
-                    shlex.quote(f"--osymbols={tokens_txt}"),
+                    f"--isymbols={tokens_txt}",
+                    f"--osymbols={tokens_txt}",
                     "--acceptor",
-                    shlex.quote(str(logits_txt)),
+                    str(logits_txt),
                 ],
                 ["fstdeterminize"],
                 ["fstminimize"],
                 ["fstpush", "--push_weights"],
                 ["fstarcsort", "--sort_type=olabel"],
                 ["fstprune", f"--weight={prune_threshold}"],  # prune logits
-                ["fstcompose", "-", shlex.quote(str(token2sen_fst))],
+                ["fstcompose", "-", str(token2sen_fst)],
                 ["fstshortestpath"],
                 ["fstproject", "--project_type=output"],
                 ["fstrmepsilon"],
                 ["fsttopsort"],
                 [
                     "fstprint",
-                    shlex.quote(f"--isymbols={output_txt}"),
-                    shlex.quote(f"--osymbols={output_txt}"),
+                    f"--isymbols={output_txt}",
+                    f"--osymbols={output_txt}",
                 ],
                 ["awk", "{print $4}"],  # output label
             )
@@ -381,39 +380,39 @@ class CoquiSttTrainer:
         await self.tools.async_run_pipeline(
             [
                 "fstcompile",
-                shlex.quote(f"--isymbols={tokens_with_blank}"),
-                shlex.quote(f"--osymbols={tokens_without_blank}"),
-                shlex.quote(str(token2char_txt)),
+                f"--isymbols={tokens_with_blank}",
+                f"--osymbols={tokens_without_blank}",
+                str(token2char_txt),
             ],
             ["fstdeterminize"],
             ["fstminimize"],
             ["fstpush", "--push_weights"],
-            ["fstarcsort", "--sort_type=ilabel", "-", shlex.quote(str(token2char_fst))],
+            ["fstarcsort", "--sort_type=ilabel", "-", str(token2char_fst)],
         )
 
         char2word_fst = train_dir / "char2word.fst"
         await self.tools.async_run_pipeline(
             [
                 "fstcompile",
-                shlex.quote(f"--isymbols={tokens_without_blank}"),
-                shlex.quote(f"--osymbols={words_txt}"),
-                shlex.quote(str(char2word_txt)),
+                f"--isymbols={tokens_without_blank}",
+                f"--osymbols={words_txt}",
+                str(char2word_txt),
             ],
             # ["fstdeterminize"],
             # ["fstminimize"],
             ["fstpush", "--push_weights"],
-            ["fstarcsort", "--sort_type=ilabel", "-", shlex.quote(str(char2word_fst))],
+            ["fstarcsort", "--sort_type=ilabel", "-", str(char2word_fst)],
         )
 
         word2sen_fst = train_dir / "word2sen.fst"
         await self.tools.async_run_pipeline(
             [
                 "fstcompile",
-                shlex.quote(f"--isymbols={words_txt}"),
-                shlex.quote(f"--osymbols={output_txt}"),
-                shlex.quote(str(word2sen_txt)),
+                f"--isymbols={words_txt}",
+                f"--osymbols={output_txt}",
+                str(word2sen_txt),
             ],
-            ["fstarcsort", "--sort_type=ilabel", "-", shlex.quote(str(word2sen_fst))],
+            ["fstarcsort", "--sort_type=ilabel", "-", str(word2sen_fst)],
         )
 
         # token -> char -> word
@@ -421,10 +420,10 @@ class CoquiSttTrainer:
         await self.tools.async_run_pipeline(
             [
                 "fstcompose",
-                shlex.quote(str(token2char_fst)),
-                shlex.quote(str(char2word_fst)),
+                str(token2char_fst),
+                str(char2word_fst),
             ],
-            ["fstarcsort", "--sort_type=ilabel", "-", shlex.quote(str(token2word_fst))],
+            ["fstarcsort", "--sort_type=ilabel", "-", str(token2word_fst)],
         )
 
         # token -> char -> word -> sentence
@@ -432,10 +431,10 @@ class CoquiSttTrainer:
         await self.tools.async_run_pipeline(
             [
                 "fstcompose",
-                shlex.quote(str(token2word_fst)),
-                shlex.quote(str(word2sen_fst)),
+                str(token2word_fst),
+                str(word2sen_fst),
             ],
             ["fstrmepsilon"],
             ["fstpush", "--push_weights"],
-            ["fstarcsort", "--sort_type=ilabel", "-", shlex.quote(str(token2sen_fst))],
+            ["fstarcsort", "--sort_type=ilabel", "-", str(token2sen_fst)],
         )
@@ -0,0 +1,238 @@
+"""Pool of warm Kaldi decoder processes."""
+
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from .tools import KaldiTools
+
+_LOGGER = logging.getLogger(__name__)
+
+# (program, args)
+DecoderKey = Tuple[str, Tuple[str, ...]]
+
+
+@dataclass
+class KaldiDecoderProcess:
+    """Decoder process that writes its lattice to a pipe."""
+
+    proc: asyncio.subprocess.Process
+    lattice_fd: int
+    watch_paths: Tuple[Path, ...]
+    watch_mtimes: Tuple[int, ...]
+
+    @staticmethod
+    async def start(
+        tools: KaldiTools,
+        program: str,
+        args: List[str],
+        watch_paths: Iterable[Path] = (),
+    ) -> "KaldiDecoderProcess":
+        watch_paths = tuple(watch_paths)
+        watch_mtimes = _get_mtimes(watch_paths)
+
+        # Lattice is written to the pipe instead of a file
+        lattice_read_fd, lattice_write_fd = os.pipe()
+        proc_args = [*args, f"ark:/dev/fd/{lattice_write_fd}"]
+        _LOGGER.debug("%s %s", program, proc_args)
+
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                program,
+                *proc_args,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                env=tools.extended_env,
+                pass_fds=(lattice_write_fd,),
+            )
+        except Exception:
+            os.close(lattice_read_fd)
+            raise
+        finally:
+            os.close(lattice_write_fd)
+
+        return KaldiDecoderProcess(
+            proc=proc,
+            lattice_fd=lattice_read_fd,
+            watch_paths=watch_paths,
+            watch_mtimes=watch_mtimes,
+        )
+
+    @property
+    def is_alive(self) -> bool:
+        return self.proc.returncode is None
+
+    @property
+    def is_stale(self) -> bool:
+        """True if the model or graph changed since the decoder was started."""
+        return _get_mtimes(self.watch_paths) != self.watch_mtimes
+
+    async def read_lattice(self) -> bytes:
+        """Read lattice archive until the decoder closes the pipe."""
+        if self.lattice_fd < 0:
+            raise ValueError("Lattice was already read")
+
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        lattice_file = os.fdopen(self.lattice_fd, "rb", buffering=0)
+        self.lattice_fd = -1  # owned by transport
+
+        transport, _protocol = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), lattice_file
+        )
+        try:
+            return await reader.read()
+        finally:
+            transport.close()
+
+    def close(self) -> None:
+        """Stop the decoder (if still running) and close its lattice pipe."""
+        if self.is_alive:
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+
+        if self.lattice_fd >= 0:
+            os.close(self.lattice_fd)
+            self.lattice_fd = -1
+
+
+class KaldiDecoderPool:
+    """Keeps started decoders waiting for audio.
+
+    Loading the acoustic model and HCLG.fst happens while the decoder is idle,
+    so it is off the request path. Each decoder reads a single utterance until
+    EOF, so a replacement is started in the background as soon as one is
+    handed out. Decoders are keyed by their command line, which includes the
+    model and graph paths; decoders whose model or graph files have changed
+    (e.g., after re-training) are discarded.
+
+    At most max_idle decoders (default: 2 * size) are kept across all command
+    lines, so decoders for models that are no longer used are stopped,
+    starting with the least recently acquired.
+    """
+
+    def __init__(
+        self, tools: KaldiTools, size: int = 1, max_idle: Optional[int] = None
+    ) -> None:
+        self.tools = tools
+        self.size = size
+        self.max_idle = max_idle if max_idle is not None else (2 * size)
+
+        self._idle: Dict[DecoderKey, List[KaldiDecoderProcess]] = defaultdict(list)
+        self._pending: Dict[DecoderKey, int] = defaultdict(int)
+        self._refill_tasks: Set[asyncio.Task] = set()
+        self._is_closed = False
+
+    async def acquire(
+        self, program: str, args: List[str], watch_paths: Iterable[Path] = ()
+    ) -> KaldiDecoderProcess:
+        """Get a started decoder for a command line."""
+        key: DecoderKey = (program, tuple(args))
+        watch_paths = tuple(watch_paths)
+
+        # Most recently acquired command line is last
+        self._idle[key] = self._idle.pop(key, [])
+        self._discard_unusable()
+
+        decoder: Optional[KaldiDecoderProcess] = None
+        idle = self._idle[key]
+        if idle:
+            decoder = idle.pop(0)
+
+        if decoder is None:
+            # Cold start
+            decoder = await KaldiDecoderProcess.start(
+                self.tools, program, args, watch_paths
+            )
+
+        self._refill(key, watch_paths)
+
+        return decoder
+
+    def close(self) -> None:
+        """Stop all idle decoders."""
+        self._is_closed = True
+
+        for task in self._refill_tasks:
+            task.cancel()
+
+        for idle in self._idle.values():
+            for decoder in idle:
+                decoder.close()
+
+        self._idle.clear()
+
+    def _discard_unusable(self) -> None:
+        """Stop idle decoders that died or whose model/graph changed."""
+        for key, idle in self._idle.items():
+            usable: List[KaldiDecoderProcess] = []
+            for decoder in idle:
+                if decoder.is_alive and (not decoder.is_stale):
+                    usable.append(decoder)
+                    continue
+
+                _LOGGER.debug("Discarding decoder: %s", decoder.proc.pid)
+                decoder.close()
+
+            self._idle[key] = usable
+
+    def _discard_oldest(self) -> None:
+        """Stop idle decoders over max_idle, least recently acquired first."""
+        num_extra = sum(len(idle) for idle in self._idle.values()) - self.max_idle
+        for idle in self._idle.values():
+            while idle and (num_extra > 0):
+                decoder = idle.pop(0)
+                _LOGGER.debug("Discarding unused decoder: %s", decoder.proc.pid)
+                decoder.close()
+                num_extra -= 1
+
+            if num_extra <= 0:
+                break
+
+    def _refill(self, key: DecoderKey, watch_paths: Tuple[Path, ...]) -> None:
+        if self._is_closed:
+            return
+
+        num_missing = self.size - len(self._idle[key]) - self._pending[key]
+        for _ in range(num_missing):
+            self._pending[key] += 1
+            task = asyncio.create_task(self._start_idle(key, watch_paths))
+            self._refill_tasks.add(task)
+            task.add_done_callback(self._refill_tasks.discard)
+
+    async def _start_idle(self, key: DecoderKey, watch_paths: Tuple[Path, ...]) -> None:
+        program, args = key
+        try:
+            decoder = await KaldiDecoderProcess.start(
+                self.tools, program, list(args), watch_paths
+            )
+        except Exception:
+            _LOGGER.exception("Unexpected error starting decoder")
+            return
+        finally:
+            self._pending[key] -= 1
+
+        if self._is_closed:
+            decoder.close()
+            return
+
+        self._idle[key].append(decoder)
+        self._discard_oldest()
+
+
+def _get_mtimes(paths: Iterable[Path]) -> Tuple[int, ...]:
+    mtimes: List[int] = []
+    for path in paths:
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            mtimes.append(-1)
+
+    return tuple(mtimes)
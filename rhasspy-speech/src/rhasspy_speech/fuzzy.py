@@ -0,0 +1,314 @@
+"""In-process fuzzy matching of transcripts against the training FST."""
+
+import heapq
+import itertools
+import logging
+import os
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from .const import EPS
+from .hassil_fst import NONTERM_PREFIX, is_nonterminal
+
+# Each lower nbest candidate is penalized this much more per word
+NBEST_PENALTY = 0.1
+
+# Text FST in the lang dir
+FUZZY_FST_FILENAME = "G.fuzzy.fst.txt"
+
+# Lines of "word cost" for skipping words, which applies on every state
+DELETIONS_FILENAME = "G.fuzzy.deletions.txt"
+
+# Directory in the lang dir with a text FST for each nonterminal label
+NONTERMINALS_DIRNAME = "nonterm"
+_NONTERMINAL_SUFFIX = ".fst.txt"
+
+_LOGGER = logging.getLogger(__name__)
+
+# path -> (mtime_ns of each file, matcher)
+_MATCHERS: Dict[Path, Tuple[Tuple[int, ...], "FuzzyMatcher"]] = {}
+
+# (FST label, state to return to)
+_ReturnStack = Tuple[Tuple[str, int], ...]
+
+# (nbest candidate, input position, FST label, FST state, return stack)
+# The FST label is empty for the top-level FST.
+_SearchState = Tuple[int, int, str, int, _ReturnStack]
+
+
+@dataclass
+class FuzzyArc:
+    out_label: str
+    cost: float
+    to_state: int
+
+
+@dataclass
+class FuzzyMatcher:
+    """Text FST with word deletions, searched in memory.
+
+    Equivalent to composing an nbest acceptor with G plus a word deletion
+    self-loop on every state, and taking the shortest path. Deletions are
+    kept once in deletion_costs instead of on every state.
+
+    Arcs with a nonterminal label are replaced on the fly by the FST in
+    nonterminals, like fstreplace.
+    """
+
+    start: int = 0
+
+    # state -> input label -> arcs
+    arcs: Dict[int, Dict[str, List[FuzzyArc]]] = field(
+        default_factory=lambda: defaultdict(lambda: defaultdict(list))
+    )
+
+    # state -> cost
+    final_costs: Dict[int, float] = field(default_factory=dict)
+
+    # word -> cost of skipping it
+    deletion_costs: Dict[str, float] = field(default_factory=dict)
+
+    # state -> arcs whose output label is the nonterminal to enter
+    nonterminal_arcs: Dict[int, List[FuzzyArc]] = field(
+        default_factory=lambda: defaultdict(list)
+    )
+
+    # label -> FST that replaces it
+    nonterminals: Dict[str, "FuzzyMatcher"] = field(default_factory=dict)
+
+    @staticmethod
+    def load(
+        fst_path: Union[str, Path], deletions_path: Optional[Union[str, Path]] = None
+    ) -> "FuzzyMatcher":
+        """Load from a text FST (fstprint format with words as labels).
+
+        Deletion costs are read from deletions_path if given. Self loops that
+        delete words are also accepted in the FST itself.
+        """
+        matcher = FuzzyMatcher()
+        is_first_line = True
+        with open(fst_path, "r", encoding="utf-8") as fst_file:
+            for line in fst_file:
+                parts = line.split()
+                if not parts:
+                    continue
+
+                from_state = int(parts[0])
+                if is_first_line:
+                    matcher.start = from_state
+                    is_first_line = False
+
+                if len(parts) < 4:
+                    # Final state
+                    matcher.final_costs[from_state] = (
+                        float(parts[1]) if len(parts) > 1 else 0.0
+                    )
+                    continue
+
+                to_state = int(parts[1])
+                in_label, out_label = parts[2], parts[3]
+                cost = float(parts[4]) if len(parts) > 4 else 0.0
+
+                if from_state == to_state:
+                    if in_label == EPS:
+                        # No-op loop
+                        continue
+
+                    if out_label == EPS:
+                        # Word removal (same on every state)
+                        matcher.deletion_costs[in_label] = cost
+                        continue
+
+                if is_nonterminal(in_label):
+                    matcher.nonterminal_arcs[from_state].append(
+                        FuzzyArc(in_label, cost, to_state)
+                    )
+                    continue
+
+                matcher.arcs[from_state][in_label].append(
+                    FuzzyArc(out_label, cost, to_state)
+                )
+
+        if deletions_path is not None:
+            with open(deletions_path, "r", encoding="utf-8") as deletions_file:
+                for line in deletions_file:
+                    parts = line.split()
+                    if len(parts) == 2:
+                        matcher.deletion_costs[parts[0]] = float(parts[1])
+
+        return matcher
+
+    def match(self, nbest_words: List[List[str]]) -> Optional[Tuple[str, float]]:
+        """Find the lowest-cost FST path for any nbest candidate.
+
+        Returns the output text and its cost.
+        """
+        counter = itertools.count()
+        queue: List[Tuple[float, int, _SearchState]] = []
+        best_costs: Dict[_SearchState, float] = {}
+        previous: Dict[_SearchState, Tuple[Optional[_SearchState], str]] = {}
+
+        def push(
+            cost: float,
+            search_state: _SearchState,
+            from_state: Optional[_SearchState],
+            out_label: str,
+        ) -> None:
+            best_cost = best_costs.get(search_state)
+            if (best_cost is not None) and (best_cost <= cost):
+                return
+
+            best_costs[search_state] = cost
+            previous[search_state] = (from_state, out_label)
+            heapq.heappush(queue, (cost, next(counter), search_state))
+
+        for candidate_idx in range(len(nbest_words)):
+            push(0.0, (candidate_idx, 0, "", self.start, ()), None, EPS)
+
+        done: Set[_SearchState] = set()
+        best_final: Optional[Tuple[float, _SearchState]] = None
+        while queue:
+            cost, _, search_state = heapq.heappop(queue)
+            if search_state in done:
+                continue
+
+            done.add(search_state)
+            if (best_final is not None) and (cost >= best_final[0]):
+                # Everything left is more expensive
+                break
+
+            candidate_idx, word_idx, fst_label, state, stack = search_state
+            words = nbest_words[candidate_idx]
+            fst = self.nonterminals[fst_label] if fst_label else self
+            state_arcs = fst.arcs.get(state, {})
+
+            final_cost = fst.final_costs.get(state)
+            if (final_cost is not None) and stack:
+                # Return from nonterminal
+                return_label, return_state = stack[-1]
+                push(
+                    cost + final_cost,
+                    (candidate_idx, word_idx, return_label, return_state, stack[:-1]),
+                    search_state,
+                    EPS,
+                )
+
+            if word_idx >= len(words):
+                if (final_cost is not None) and (not stack):
+                    total_cost = cost + final_cost
+                    if (best_final is None) or (total_cost < best_final[0]):
+                        best_final = (total_cost, search_state)
+            else:
+                word = words[word_idx]
+                word_cost = cost + (NBEST_PENALTY * candidate_idx)
+
+                for arc in state_arcs.get(word, []):
+                    push(
+                        word_cost + arc.cost,
+                        (candidate_idx, word_idx + 1, fst_label, arc.to_state, stack),
+                        search_state,
+                        arc.out_label,
+                    )
+
+                deletion_cost = self.deletion_costs.get(word)
+                if deletion_cost is not None:
+                    push(
+                        word_cost + deletion_cost,
+                        (candidate_idx, word_idx + 1, fst_label, state, stack),
+                        search_state,
+                        EPS,
+                    )
+
+            # Arcs that don't consume input
+            for arc in state_arcs.get(EPS, []):
+                push(
+                    cost + arc.cost,
+                    (candidate_idx, word_idx, fst_label, arc.to_state, stack),
+                    search_state,
+                    arc.out_label,
+                )
+
+            # Enter nonterminals
+            for arc in fst.nonterminal_arcs.get(state, []):
+                nonterminal = self.nonterminals.get(arc.out_label)
+                if nonterminal is None:
+                    continue
+
+                push(
+                    cost + arc.cost,
+                    (
+                        candidate_idx,
+                        word_idx,
+                        arc.out_label,
+                        nonterminal.start,
+                        stack + ((fst_label, arc.to_state),),
+                    ),
+                    search_state,
+                    EPS,
+                )
+
+        if best_final is None:
+            return None
+
+        total_cost, final_state = best_final
+        output_words: List[str] = []
+        maybe_state: Optional[_SearchState] = final_state
+        while maybe_state is not None:
+            maybe_state, out_label = previous[maybe_state]
+            if out_label != EPS:
+                output_words.append(out_label)
+
+        if not output_words:
+            return None
+
+        output_words.reverse()
+        return (" ".join(output_words), total_cost)
+
+
+def get_fuzzy_matcher(lang_dir: Union[str, Path]) -> Optional[FuzzyMatcher]:
+    """Load fuzzy matcher for a lang dir (cached until the FST changes)."""
+    lang_dir = Path(lang_dir).absolute()
+    fst_path = lang_dir / FUZZY_FST_FILENAME
+    deletions_path: Optional[Path] = lang_dir / DELETIONS_FILENAME
+    try:
+        mtime_ns = os.stat(fst_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    try:
+        deletions_mtime_ns = os.stat(deletions_path).st_mtime_ns
+    except FileNotFoundError:
+        # Trained before deletions were split out of the FST
+        deletions_path = None
+        deletions_mtime_ns = 0
+
+    nonterminal_paths = sorted(
+        (lang_dir / NONTERMINALS_DIRNAME).glob(f"*{_NONTERMINAL_SUFFIX}")
+    )
+    mtimes = (
+        mtime_ns,
+        deletions_mtime_ns,
+        *(os.stat(path).st_mtime_ns for path in nonterminal_paths),
+    )
+
+    cached = _MATCHERS.get(fst_path)
+    if (cached is not None) and (cached[0] == mtimes):
+        return cached[1]
+
+    _LOGGER.debug("Loading fuzzy FST: %s", fst_path)
+    matcher = FuzzyMatcher.load(fst_path, deletions_path)
+    for path in nonterminal_paths:
+        label = NONTERM_PREFIX + path.name[: -len(_NONTERMINAL_SUFFIX)]
+        matcher.nonterminals[label] = FuzzyMatcher.load(path)
+
+    _MATCHERS[fst_path] = (mtimes, matcher)
+
+    return matcher
+
+
+def get_nonterminal_path(lang_dir: Union[str, Path], label: str) -> Path:
+    """Path of the text FST for a nonterminal label."""
+    name = label[len(NONTERM_PREFIX) :]
+    return Path(lang_dir) / NONTERMINALS_DIRNAME / f"{name}{_NONTERMINAL_SUFFIX}"
@@ -4,9 +4,9 @@ import itertools
 import sqlite3
 import subprocess
 import tempfile
-from collections.abc import Iterable
+from collections.abc import Collection, Iterable
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 import regex as re
 from unicode_rbnf import RbnfEngine
@@ -17,6 +17,9 @@ _INITIALISM_DOTS = re.compile(r"^(?:\p{L}\.){2,}$")
 _NUMBER_SPLIT = re.compile(r"(\d+(?:\.\d+)?)")
 _NUMBER = re.compile(r"^\d+(\.\d+)?$")
 
+# Below SQLite's default limit on query parameters
+_MAX_QUERY_WORDS = 900
+
 # -----------------------------------------------------------------------------
 
 
@@ -26,6 +29,9 @@ class LexiconDatabase:
         self._conn = sqlite3.Connection(str(self.db_path)) if self.db_path else None
         self._cache: Dict[str, Optional[List[List[str]]]] = {}
 
+        # Word variations that aren't in the database
+        self._missing: Set[str] = set()
+
     def add(self, word: str, pronunciations: List[List[str]]) -> None:
         cached_prons = self._cache.get(word)
         if cached_prons is None:
@@ -34,47 +40,118 @@ class LexiconDatabase:
             cached_prons.extend(pronunciations)
 
     def exists(self, word: str) -> bool:
-        if (not self._cache) and (self._conn is not None):
-            # Load word list and add placeholders
-            cur = self._conn.execute("SELECT DISTINCT word FROM word_phonemes")
-            for row in cur:
-                self._cache[row[0]] = None
+        return word in self.exists_many([word])
+
+    def exists_many(self, words: Iterable[str]) -> Set[str]:
+        """Get the words that are in the lexicon (in any case variation).
 
-        word_vars = tuple(self._word_variations(word))
-        for word_var in word_vars:
-            if word_var in self._cache:
-                return True
+        Words that aren't cached are checked with a few queries, and the
+        results are cached.
+        """
+        found_words: Set[str] = set()
+        unknown_words: Dict[str, Tuple[str, ...]] = {}
+        for word in words:
+            if (word in found_words) or (word in unknown_words):
+                continue
 
-        return False
+            word_vars = tuple(self._word_variations(word))
+            if any(word_var in self._cache for word_var in word_vars):
+                found_words.add(word)
+            elif (self._conn is not None) and any(
+                word_var not in self._missing for word_var in word_vars
+            ):
+                unknown_words[word] = word_vars
+
+        if not unknown_words:
+            return found_words
+
+        query_vars = {
+            word_var
+            for word_vars in unknown_words.values()
+            for word_var in word_vars
+            if word_var not in self._missing
+        }
+        db_vars = {
+            row[0]
+            for row in self._select(
+                "SELECT DISTINCT word FROM word_phonemes WHERE word IN ({})",
+                query_vars,
+            )
+        }
+
+        for word_var in query_vars:
+            if word_var in db_vars:
+                # Placeholder until pronunciations are looked up
+                self._cache.setdefault(word_var, None)
+            else:
+                self._missing.add(word_var)
+
+        for word, word_vars in unknown_words.items():
+            if any(word_var in db_vars for word_var in word_vars):
+                found_words.add(word)
+
+        return found_words
 
     def lookup(self, word: str) -> List[List[str]]:
-        word_vars = list(self._word_variations(word))
-        for word_var in word_vars:
-            cached_prons = self._cache.get(word_var)
-            if cached_prons is not None:
-                return cached_prons
+        return self.lookup_many([word])[word]
 
-        if self._conn is None:
-            return []
+    def lookup_many(self, words: Iterable[str]) -> Dict[str, List[List[str]]]:
+        """Get pronunciations for words.
 
-        db_prons: List[List[str]] = []
-        for word_var in word_vars:
-            cur = self._conn.execute(
-                "SELECT phonemes FROM word_phonemes WHERE word = ? ORDER by pron_order",
-                (word_var,),
-            )
-            for row in cur:
-                db_prons.append(row[0].split())
+        Words that aren't cached are looked up with a few queries, and the
+        results are cached.
+        """
+        word_prons: Dict[str, List[List[str]]] = {}
+        unknown_words: Dict[str, List[str]] = {}
+        for word in words:
+            if (word in word_prons) or (word in unknown_words):
+                continue
 
-            if db_prons:
-                # Only return pronunciation for first variation
-                self._cache[word_var] = db_prons
-                break
+            word_vars = list(self._word_variations(word))
+            for word_var in word_vars:
+                cached_prons = self._cache.get(word_var)
+                if cached_prons is not None:
+                    word_prons[word] = cached_prons
+                    break
+            else:
+                if self._conn is None:
+                    word_prons[word] = []
+                else:
+                    unknown_words[word] = word_vars
+
+        if not unknown_words:
+            return word_prons
+
+        query_vars = {
+            word_var
+            for word_vars in unknown_words.values()
+            for word_var in word_vars
+            if word_var not in self._missing
+        }
+        db_prons: Dict[str, List[List[str]]] = {}
+        for row in self._select(
+            "SELECT word, phonemes FROM word_phonemes WHERE word IN ({}) "
+            "ORDER BY pron_order",
+            query_vars,
+        ):
+            db_prons.setdefault(row[0], []).append(row[1].split())
+
+        self._missing.update(query_vars - db_prons.keys())
+
+        for word, word_vars in unknown_words.items():
+            prons: List[List[str]] = []
+            for word_var in word_vars:
+                if word_var in db_prons:
+                    # Only return pronunciation for first variation
+                    prons = db_prons[word_var]
+                    self._cache[word_var] = prons
+                    break
 
-        # Update cache
-        self._cache[word] = db_prons
+            # Update cache
+            self._cache[word] = prons
+            word_prons[word] = prons
 
-        return db_prons
+        return word_prons
 
     def alignments(self, word: str) -> List[str]:
         if self._conn is None:
@@ -95,6 +172,14 @@ class LexiconDatabase:
 
         return alignments
 
+    def _select(self, sql: str, words: Collection[str]) -> Iterable[Tuple[Any, ...]]:
+        """Run a query with "IN ({})" over batches of words."""
+        assert self._conn is not None
+        words = list(words)
+        for batch_start in range(0, len(words), _MAX_QUERY_WORDS):
+            batch = words[batch_start : batch_start + _MAX_QUERY_WORDS]
+            yield from self._conn.execute(sql.format(",".join("?" * len(batch))), batch)
+
     def _word_variations(self, word: str) -> Iterable[str]:
         yield word
         word_lower = word.lower()
@@ -117,8 +202,9 @@ def split_words(
     text: str, lexicon: LexiconDatabase, number_engine: Optional[RbnfEngine] = None
 ) -> List[Union[str, Tuple[str, Optional[str]]]]:
     words: List[Union[str, Tuple[str, Optional[str]]]] = []
+    existing_words = lexicon.exists_many(get_split_candidates(text))
     for word in text.split():
-        if lexicon.exists(word):
+        if word in existing_words:
             words.append(word)
             continue
 
@@ -127,7 +213,7 @@ def split_words(
             if not sub_word:
                 continue
 
-            if lexicon.exists(sub_word):
+            if sub_word in existing_words:
                 words.append(sub_word)
                 continue
 
@@ -153,6 +239,16 @@ def split_words(
     return words
 
 
+def get_split_candidates(text: str) -> Iterable[str]:
+    """Words and sub-words that split_words may check in the lexicon."""
+    for word in text.split():
+        yield word
+
+        for sub_word in _NUMBER_SPLIT.split(word):
+            if sub_word and (sub_word != word):
+                yield sub_word
+
+
 # -----------------------------------------------------------------------------
 
 
@@ -1,14 +1,28 @@
 import base64
+import itertools
 import json
 import logging
 import math
 import re
-from collections import defaultdict
-from collections.abc import Callable
+import struct
+from array import array
+from collections import Counter
+from collections.abc import Callable, Collection, Iterable, Iterator
 from dataclasses import dataclass, field
 from enum import Enum, auto
 from functools import reduce
-from typing import Dict, List, Optional, Set, TextIO, Tuple, Union
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 from hassil.expression import (
     Expression,
@@ -19,11 +33,18 @@ from hassil.expression import (
     SequenceType,
     TextChunk,
 )
-from hassil.intents import IntentData, Intents, RangeSlotList, SlotList, TextSlotList
+from hassil.intents import (
+    Intent,
+    IntentData,
+    Intents,
+    RangeSlotList,
+    SlotList,
+    TextSlotList,
+)
 from hassil.util import check_excluded_context, check_required_context
 from unicode_rbnf import RbnfEngine
 
-from .g2p import LexiconDatabase, split_words
+from .g2p import LexiconDatabase, get_split_candidates, split_words
 
 EPS = "<eps>"
 SPACE = "<space>"
@@ -31,8 +52,31 @@ BEGIN_OUTPUT = "__begin_output:"
 END_OUTPUT = "__end_output"
 SENTENCE_OUTPUT = "__sentence_output:"
 OUTPUT_PREFIX = "__output:"
+
+# Output value is added to the number output before it
+ADD_OUTPUT_PREFIX = OUTPUT_PREFIX + "+"
+NONTERM_PREFIX = "#nonterm:"
+SUBGRAPH_PREFIX = "#subgraph:"
 WORD_PENALTY = 0.03
 
+# End of a state's arc list
+NO_ARC = -1
+
+# OpenFST binary format (VectorFst with standard arcs)
+FST_MAGIC = 2125659606
+SYMBOL_TABLE_MAGIC = 2125658996
+VECTOR_FST_VERSION = 2
+FST_HAS_ISYMBOLS = 0x1
+FST_HAS_OSYMBOLS = 0x2
+
+# kExpanded | kMutable (other properties are unknown)
+VECTOR_FST_PROPERTIES = 0x3
+
+_ARC_STRUCT = struct.Struct("<iifi")
+
+# Numbers are split into head + tail at these scales (3042 = 3000 + 42)
+NUMBER_SCALES = (10**12, 10**9, 10**6, 1000, 100, 10)
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -42,6 +86,10 @@ class SuppressOutput(Enum):
     UNTIL_SPACE = auto()
 
 
+# (state, partial word, pending output word, output state, suppress mode)
+_RemoveSpacesContext = Tuple[int, str, Optional[str], int, SuppressOutput]
+
+
 @dataclass
 class FstArc:
     to_state: int
@@ -50,19 +98,73 @@ class FstArc:
     log_prob: Optional[float] = None
 
 
+def _weight_key(log_prob: float) -> Optional[float]:
+    """Hashable arc weight (NaN is not equal to itself)."""
+    return None if math.isnan(log_prob) else log_prob
+
+
+def _int_array() -> "array[int]":
+    return array("i")
+
+
+def _state_array() -> "array[int]":
+    # Start state has no arcs yet
+    return array("i", [NO_ARC])
+
+
 @dataclass
 class Fst:
-    arcs: Dict[int, List[FstArc]] = field(default_factory=lambda: defaultdict(list))
-    states: Set[int] = field(default_factory=lambda: {0})
+    """Mutable FST with interned labels and arcs stored in array columns.
+
+    Arcs leaving a state form a linked list (state_first_arc -> arc_next), so
+    they stay in the order they were added.
+    """
+
     final_states: Set[int] = field(default_factory=set)
     words: Set[str] = field(default_factory=set)
     output_words: Set[str] = field(default_factory=set)
     start: int = 0
     current_state: int = 0
 
+    # label id -> label (id 0 is <eps>)
+    symbols: List[str] = field(default_factory=lambda: [EPS])
+    symbol_ids: Dict[str, int] = field(default_factory=lambda: {EPS: 0})
+
+    # Arc columns (log_prob is NaN when not set)
+    arc_from: "array[int]" = field(default_factory=_int_array)
+    arc_to: "array[int]" = field(default_factory=_int_array)
+    arc_ilabel: "array[int]" = field(default_factory=_int_array)
+    arc_olabel: "array[int]" = field(default_factory=_int_array)
+    arc_log_prob: "array[float]" = field(default_factory=lambda: array("d"))
+    arc_next: "array[int]" = field(default_factory=_int_array)
+
+    # state -> first/last arc leaving it
+    state_first_arc: "array[int]" = field(default_factory=_state_array)
+    state_last_arc: "array[int]" = field(default_factory=_state_array)
+
+    # label -> FST that replaces arcs with that input label
+    nonterminals: Dict[str, "Fst"] = field(default_factory=dict)
+
+    # label -> FST that is spliced in place of arcs with that input label
+    # when writing
+    subgraphs: Dict[str, "Fst"] = field(default_factory=dict)
+
+    @property
+    def num_states(self) -> int:
+        return len(self.state_first_arc)
+
+    @property
+    def num_arcs(self) -> int:
+        return len(self.arc_to)
+
     def next_state(self) -> int:
-        self.states.add(self.current_state)
         self.current_state += 1
+        if self.current_state == len(self.state_first_arc):
+            self.state_first_arc.append(NO_ARC)
+            self.state_last_arc.append(NO_ARC)
+        elif self.current_state > len(self.state_first_arc):
+            self._add_states(self.current_state)
+
         return self.current_state
 
     def next_edge(
@@ -104,88 +206,422 @@ class Fst:
         if out_label != EPS:
             self.output_words.add(out_label)
 
-        self.states.add(from_state)
-        self.states.add(to_state)
-        self.arcs[from_state].append(FstArc(to_state, in_label, out_label, log_prob))
+        if max(from_state, to_state) >= len(self.state_first_arc):
+            self._add_states(max(from_state, to_state))
+
+        self._append_arc(
+            from_state,
+            to_state,
+            self.symbol_id(in_label),
+            self.symbol_id(out_label),
+            math.nan if log_prob is None else log_prob,
+        )
 
     def accept(self, state: int) -> None:
-        self.states.add(state)
+        self._add_states(state)
         self.final_states.add(state)
 
-    def write(self, fst_file: TextIO, symbols_file: Optional[TextIO] = None) -> None:
-        symbols = {EPS: 0}
+    def symbol_id(self, label: str) -> int:
+        """Get id of a label, interning it if necessary."""
+        label_id = self.symbol_ids.get(label)
+        if label_id is None:
+            label_id = len(self.symbols)
+            self.symbols.append(label)
+            self.symbol_ids[label] = label_id
+
+        return label_id
+
+    def arcs_from(self, state: int) -> Iterator[int]:
+        """Indexes of arcs leaving a state."""
+        arc_idx = self.state_first_arc[state]
+        while arc_idx != NO_ARC:
+            yield arc_idx
+            arc_idx = self.arc_next[arc_idx]
+
+    def get_arc(self, arc_idx: int) -> FstArc:
+        log_prob = self.arc_log_prob[arc_idx]
+        return FstArc(
+            self.arc_to[arc_idx],
+            self.symbols[self.arc_ilabel[arc_idx]],
+            self.symbols[self.arc_olabel[arc_idx]],
+            None if math.isnan(log_prob) else log_prob,
+        )
 
-        for state, arcs in self.arcs.items():
-            for arc in arcs:
-                if arc.in_label not in symbols:
-                    symbols[arc.in_label] = len(symbols)
+    def write(
+        self,
+        fst_file: TextIO,
+        symbols_file: Optional[TextIO] = None,
+        subgraphs: Optional[Dict[str, "Fst"]] = None,
+    ) -> None:
+        """Write FST in text format.
 
-                if arc.out_label not in symbols:
-                    symbols[arc.out_label] = len(symbols)
+        Arcs with a subgraph label are replaced by a copy of that subgraph
+        (from self.subgraphs by default).
+        """
+        if subgraphs is None:
+            subgraphs = self.subgraphs
 
-                if arc.log_prob is None:
-                    print(
-                        state, arc.to_state, arc.in_label, arc.out_label, file=fst_file
-                    )
-                else:
-                    print(
-                        state,
-                        arc.to_state,
-                        arc.in_label,
-                        arc.out_label,
-                        arc.log_prob,
-                        file=fst_file,
-                    )
+        symbols = {EPS: 0}
+        self._write_arcs(fst_file, symbols, subgraphs, 0, [self.num_states], None)
 
         for state in self.final_states:
-            print(state, file=fst_file)
+            fst_file.write(f"{state}\n")
 
         if symbols_file is not None:
             for symbol, symbol_id in symbols.items():
                 print(symbol, symbol_id, file=symbols_file)
 
+    def _write_arcs(
+        self,
+        fst_file: TextIO,
+        symbols: Dict[str, int],
+        subgraphs: Dict[str, "Fst"],
+        state_offset: int,
+        next_offset: List[int],
+        return_state: Optional[int],
+    ) -> None:
+        """Write arcs with states shifted by state_offset.
+
+        Subgraph copies get states starting at next_offset[0]. Final states of
+        a copy go to return_state with an <eps> arc.
+        """
+        labels = self.symbols
+
+        # Start state is written first
+        states = itertools.chain(
+            (self.start,),
+            (state for state in range(self.num_states) if state != self.start),
+        )
+        for state in states:
+            from_state = state + state_offset
+            for arc_idx in self.arcs_from(state):
+                to_state = self.arc_to[arc_idx] + state_offset
+                in_label = labels[self.arc_ilabel[arc_idx]]
+                out_label = labels[self.arc_olabel[arc_idx]]
+                log_prob = self.arc_log_prob[arc_idx]
+
+                subgraph = subgraphs.get(in_label) if is_subgraph(in_label) else None
+                if subgraph is not None:
+                    sub_offset = next_offset[0]
+                    next_offset[0] += subgraph.num_states
+                    sub_start = sub_offset + subgraph.start
+                    if math.isnan(log_prob):
+                        fst_file.write(f"{from_state} {sub_start} {EPS} {EPS}\n")
+                    else:
+                        fst_file.write(
+                            f"{from_state} {sub_start} {EPS} {EPS} {log_prob}\n"
+                        )
+
+                    subgraph._write_arcs(
+                        fst_file, symbols, subgraphs, sub_offset, next_offset, to_state
+                    )
+                    continue
+
+                if in_label not in symbols:
+                    symbols[in_label] = len(symbols)
+
+                if out_label not in symbols:
+                    symbols[out_label] = len(symbols)
+
+                if math.isnan(log_prob):
+                    fst_file.write(f"{from_state} {to_state} {in_label} {out_label}\n")
+                else:
+                    fst_file.write(
+                        f"{from_state} {to_state} {in_label} {out_label} "
+                        f"{log_prob}\n"
+                    )
+
+        if return_state is not None:
+            for state in self.final_states:
+                fst_file.write(f"{state + state_offset} {return_state} {EPS} {EPS}\n")
+
+    def write_binary(
+        self,
+        fst_file: BinaryIO,
+        symbol_ids: Dict[str, int],
+        symbols_name: Optional[str] = None,
+        subgraphs: Optional[Dict[str, "Fst"]] = None,
+    ) -> None:
+        """Write FST in OpenFST's binary format, like fstcompile.
+
+        Labels are mapped with symbol_ids (see read_symbols). If symbols_name
+        is set, symbol_ids are stored as the input/output symbol tables (like
+        --keep_isymbols/--keep_osymbols).
+
+        Arcs with a subgraph label are replaced by a copy of that subgraph
+        (from self.subgraphs by default).
+        """
+        if subgraphs is None:
+            subgraphs = self.subgraphs
+
+        # (FST, state offset, state that final states return to)
+        copies: List[Tuple[Fst, int, Optional[int]]] = [(self, 0, None)]
+
+        # (copy index, arc index) -> copy index of subgraph
+        arc_copies: Dict[Tuple[int, int], int] = {}
+        num_states = self.num_states
+        num_arcs = 0
+
+        # Copies are numbered in order, so their states are too
+        for copy_idx, (copy_fst, state_offset, return_state) in enumerate(copies):
+            num_arcs += copy_fst.num_arcs
+            if return_state is not None:
+                num_arcs += len(copy_fst.final_states)
+
+            for arc_idx in range(copy_fst.num_arcs):
+                label = copy_fst.symbols[copy_fst.arc_ilabel[arc_idx]]
+                if not is_subgraph(label):
+                    continue
+
+                subgraph = subgraphs.get(label)
+                if subgraph is None:
+                    continue
+
+                arc_copies[(copy_idx, arc_idx)] = len(copies)
+                copies.append(
+                    (subgraph, num_states, copy_fst.arc_to[arc_idx] + state_offset)
+                )
+                num_states += subgraph.num_states
+
+        flags = 0
+        if symbols_name is not None:
+            flags = FST_HAS_ISYMBOLS | FST_HAS_OSYMBOLS
+
+        fst_file.write(struct.pack("<i", FST_MAGIC))
+        _write_binary_string(fst_file, "vector")
+        _write_binary_string(fst_file, "standard")
+        fst_file.write(
+            struct.pack(
+                "<iiQqqq",
+                VECTOR_FST_VERSION,
+                flags,
+                VECTOR_FST_PROPERTIES,
+                self.start,
+                num_states,
+                num_arcs,
+            )
+        )
+
+        if symbols_name is not None:
+            for _ in range(2):
+                _write_binary_symbols(fst_file, symbol_ids, symbols_name)
+
+        final_weight = struct.pack("<f", 0.0)
+        not_final_weight = struct.pack("<f", math.inf)
+        for copy_idx, (copy_fst, state_offset, return_state) in enumerate(copies):
+            labels = copy_fst.symbols
+            label_ids = [symbol_ids.get(label, -1) for label in labels]
+            for state in range(copy_fst.num_states):
+                state_arcs = bytearray()
+                num_state_arcs = 0
+                for arc_idx in copy_fst.arcs_from(state):
+                    log_prob = copy_fst.arc_log_prob[arc_idx]
+                    if math.isnan(log_prob):
+                        log_prob = 0.0
+
+                    sub_copy_idx = arc_copies.get((copy_idx, arc_idx))
+                    if sub_copy_idx is None:
+                        in_label_id = label_ids[copy_fst.arc_ilabel[arc_idx]]
+                        out_label_id = label_ids[copy_fst.arc_olabel[arc_idx]]
+                        if (in_label_id < 0) or (out_label_id < 0):
+                            missing_label = labels[
+                                (
+                                    copy_fst.arc_ilabel[arc_idx]
+                                    if in_label_id < 0
+                                    else copy_fst.arc_olabel[arc_idx]
+                                )
+                            ]
+                            raise ValueError(f"Missing symbol: {missing_label}")
+
+                        to_state = copy_fst.arc_to[arc_idx] + state_offset
+                    else:
+                        # Enter subgraph
+                        sub_fst, sub_offset, _sub_return_state = copies[sub_copy_idx]
+                        in_label_id = out_label_id = symbol_ids[EPS]
+                        to_state = sub_fst.start + sub_offset
+
+                    state_arcs += _ARC_STRUCT.pack(
+                        in_label_id, out_label_id, log_prob, to_state
+                    )
+                    num_state_arcs += 1
+
+                is_final = state in copy_fst.final_states
+                if is_final and (return_state is not None):
+                    # Leave subgraph
+                    state_arcs += _ARC_STRUCT.pack(
+                        symbol_ids[EPS], symbol_ids[EPS], 0.0, return_state
+                    )
+                    num_state_arcs += 1
+                    is_final = False
+
+                fst_file.write(final_weight if is_final else not_final_weight)
+                fst_file.write(struct.pack("<q", num_state_arcs))
+                fst_file.write(state_arcs)
+
+    def _add_states(self, max_state: int) -> None:
+        """Make room for states up to max_state."""
+        num_new_states = max_state + 1 - len(self.state_first_arc)
+        if num_new_states > 0:
+            self.state_first_arc.extend(itertools.repeat(NO_ARC, num_new_states))
+            self.state_last_arc.extend(itertools.repeat(NO_ARC, num_new_states))
+
+        self.current_state = max(self.current_state, max_state)
+
+    def _append_arc(
+        self,
+        from_state: int,
+        to_state: int,
+        in_label_id: int,
+        out_label_id: int,
+        log_prob: float,
+    ) -> None:
+        arc_idx = len(self.arc_to)
+        self.arc_from.append(from_state)
+        self.arc_to.append(to_state)
+        self.arc_ilabel.append(in_label_id)
+        self.arc_olabel.append(out_label_id)
+        self.arc_log_prob.append(log_prob)
+        self.arc_next.append(NO_ARC)
+
+        last_arc_idx = self.state_last_arc[from_state]
+        if last_arc_idx == NO_ARC:
+            self.state_first_arc[from_state] = arc_idx
+        else:
+            self.arc_next[last_arc_idx] = arc_idx
+
+        self.state_last_arc[from_state] = arc_idx
+
+    def _keep_arcs(self, keep: Callable[[int], bool]) -> None:
+        """Remove arcs where keep(arc index) is False."""
+        arc_from, arc_to, arc_ilabel, arc_olabel, arc_log_prob = (
+            self.arc_from,
+            self.arc_to,
+            self.arc_ilabel,
+            self.arc_olabel,
+            self.arc_log_prob,
+        )
+        self.arc_from = _int_array()
+        self.arc_to = _int_array()
+        self.arc_ilabel = _int_array()
+        self.arc_olabel = _int_array()
+        self.arc_log_prob = array("d")
+        self.arc_next = _int_array()
+        for state in range(self.num_states):
+            self.state_first_arc[state] = NO_ARC
+            self.state_last_arc[state] = NO_ARC
+
+        # Arcs are re-added in their original order
+        for arc_idx in range(len(arc_to)):
+            if keep(arc_idx):
+                self._append_arc(
+                    arc_from[arc_idx],
+                    arc_to[arc_idx],
+                    arc_ilabel[arc_idx],
+                    arc_olabel[arc_idx],
+                    arc_log_prob[arc_idx],
+                )
+
     def remove_spaces(self) -> "Fst":
-        """Remove <space> tokens and merge partial word labels."""
-        visited: Dict[Tuple[int, int, int], int] = dict()
+        """Remove <space> tokens and merge partial word labels.
+
+        Paths are walked with an explicit stack, in the same depth-first order
+        as a recursive walk.
+        """
+        # <space> arc -> state in output FST
+        visited: Dict[int, int] = {}
+
+        # Contexts that states with more than one incoming arc were entered with.
+        # Entering one again would only add duplicate paths.
+        join_states = self._join_states()
+        expanded: Set[_RemoveSpacesContext] = set()
+        num_expanded = 0
 
         fst_without_spaces = Fst()
-        for arc in self.arcs[self.start]:
+        for arc_idx in self.arcs_from(self.start):
             # Copy initial weighted intent arc
+            log_prob = self.arc_log_prob[arc_idx]
             output_state = fst_without_spaces.next_edge(
-                fst_without_spaces.start, log_prob=arc.log_prob
+                fst_without_spaces.start,
+                log_prob=None if math.isnan(log_prob) else log_prob,
             )
 
-            for next_arc_idx, next_arc in enumerate(self.arcs[arc.to_state]):
-                self._remove_spaces(
-                    arc.to_state,
-                    next_arc,
+            pending: List[Tuple[int, _RemoveSpacesContext]] = [
+                (
                     next_arc_idx,
-                    "",
-                    None,
-                    visited,
-                    fst_without_spaces,
-                    output_state,
+                    (
+                        self.arc_to[arc_idx],
+                        "",
+                        None,
+                        output_state,
+                        SuppressOutput.DISABLED,
+                    ),
                 )
+                for next_arc_idx in self.arcs_from(self.arc_to[arc_idx])
+            ]
+            pending.reverse()
+            num_expanded += 1
+
+            while pending:
+                next_arc_idx, context = pending.pop()
+                next_context = self._remove_spaces(
+                    next_arc_idx, context, visited, fst_without_spaces
+                )
+                if next_context is None:
+                    continue
+
+                next_state = next_context[0]
+                if next_state in join_states:
+                    if next_context in expanded:
+                        continue
+
+                    expanded.add(next_context)
+
+                num_expanded += 1
+                next_arcs = [
+                    (following_arc_idx, next_context)
+                    for following_arc_idx in self.arcs_from(next_state)
+                ]
+                next_arcs.reverse()
+                pending.extend(next_arcs)
+
+        _LOGGER.debug("Expanded %s state(s) while removing spaces", num_expanded)
+
+        fst_without_spaces.nonterminals = {
+            label: nonterminal.remove_spaces()
+            for label, nonterminal in self.nonterminals.items()
+        }
+        fst_without_spaces.subgraphs = {
+            label: subgraph.remove_spaces()
+            for label, subgraph in self.subgraphs.items()
+        }
 
         return fst_without_spaces
 
     def _remove_spaces(
         self,
-        state: int,
-        arc: FstArc,
         arc_idx: int,
-        word: str,
-        output_word: Optional[str],
-        visited: Dict[Tuple[int, int, int], int],
+        context: _RemoveSpacesContext,
+        visited: Dict[int, int],
         fst_without_spaces: "Fst",
-        output_state: int,
-        suppress_output: SuppressOutput = SuppressOutput.DISABLED,
-    ) -> None:
-        if arc.in_label == SPACE:
-            key = (state, arc.to_state, arc_idx)
-            cached_state = visited.get(key)
+    ) -> Optional[_RemoveSpacesContext]:
+        """Follow an arc and get the context for the state it enters.
+
+        Returns None if the rest of the path was already added.
+        """
+        _state, word, output_word, output_state, suppress_output = context
+        to_state = self.arc_to[arc_idx]
+        in_label = self.symbols[self.arc_ilabel[arc_idx]]
+        out_label = self.symbols[self.arc_olabel[arc_idx]]
+
+        if in_label == SPACE:
+            cached_state = visited.get(arc_idx)
             input_symbol = word or EPS
             output_symbol = input_symbol
+            log_prob = (
+                WORD_PENALTY
+                if (input_symbol != EPS) and (not is_reference(input_symbol))
+                else None
+            )
 
             if suppress_output in (
                 SuppressOutput.UNTIL_END,
@@ -200,93 +636,321 @@ class Fst:
                     cached_state,
                     input_symbol,
                     output_symbol,
-                    log_prob=WORD_PENALTY if input_symbol != EPS else None,
+                    log_prob=log_prob,
                 )
-                return
+                return None
 
             output_state = fst_without_spaces.next_edge(
                 output_state,
                 input_symbol,
                 output_symbol,
-                log_prob=WORD_PENALTY if input_symbol != EPS else None,
+                log_prob=log_prob,
             )
-            visited[key] = output_state
+            visited[arc_idx] = output_state
 
-            if arc.to_state in self.final_states:
+            if to_state in self.final_states:
                 fst_without_spaces.final_states.add(output_state)
 
             word = ""
 
             if suppress_output == SuppressOutput.UNTIL_SPACE:
                 suppress_output = SuppressOutput.DISABLED
-        elif arc.in_label != EPS:
-            word += arc.in_label
+        elif in_label != EPS:
+            word += in_label
 
             if (
                 (suppress_output == SuppressOutput.DISABLED)
-                and (arc.out_label != EPS)
-                and (arc.out_label != arc.in_label)
+                and (out_label != EPS)
+                and (out_label != in_label)
             ):
                 # Short-term output override
                 suppress_output = SuppressOutput.UNTIL_SPACE
-                output_word = arc.out_label
+                output_word = out_label
 
-        if arc.out_label.startswith(BEGIN_OUTPUT):
+        if out_label.startswith(BEGIN_OUTPUT):
             # Start suppressing output
             suppress_output = SuppressOutput.UNTIL_END
-        elif arc.out_label.startswith(END_OUTPUT):
+        elif out_label.startswith(END_OUTPUT):
             # Stop suppressing output
             suppress_output = SuppressOutput.UNTIL_SPACE
-        elif arc.out_label.startswith(SENTENCE_OUTPUT):
-            output_state = fst_without_spaces.next_edge(
-                output_state, EPS, arc.out_label
-            )
-        elif arc.out_label.startswith(OUTPUT_PREFIX):
+        elif out_label.startswith(SENTENCE_OUTPUT):
+            output_state = fst_without_spaces.next_edge(output_state, EPS, out_label)
+        elif out_label.startswith(OUTPUT_PREFIX):
             # Output on next space
-            output_word = arc.out_label
+            output_word = out_label
 
-        for next_arc_idx, next_arc in enumerate(self.arcs[arc.to_state]):
-            self._remove_spaces(
-                arc.to_state,
-                next_arc,
-                next_arc_idx,
-                word,
-                output_word,
-                visited,
-                fst_without_spaces,
-                output_state,
-                suppress_output=suppress_output,
-            )
+        return (to_state, word, output_word, output_state, suppress_output)
+
+    def _join_states(self) -> Set[int]:
+        """States with more than one incoming arc."""
+        return {
+            state for state, num_arcs in Counter(self.arc_to).items() if num_arcs > 1
+        }
 
     def prune(self) -> None:
-        """Remove paths not connected to a final state."""
-        while True:
-            states_to_prune: Set[str] = set()
+        """Remove states that aren't on a path from start to a final state.
+
+        Runs in linear time: one forward pass from start, and one backward
+        pass from the final states over incoming arcs.
+        """
+        for nonterminal in self.nonterminals.values():
+            nonterminal.prune()
+
+        for subgraph in self.subgraphs.values():
+            subgraph.prune()
+
+        arc_from, arc_to = self.arc_from, self.arc_to
+
+        # Forward
+        accessible = bytearray(self.num_states)
+        accessible[self.start] = 1
+        states_to_visit = [self.start]
+        while states_to_visit:
+            state = states_to_visit.pop()
+            for arc_idx in self.arcs_from(state):
+                to_state = arc_to[arc_idx]
+                if not accessible[to_state]:
+                    accessible[to_state] = 1
+                    states_to_visit.append(to_state)
+
+        # Backward
+        in_offsets, in_arcs = self._incoming_arcs()
+        coaccessible = bytearray(self.num_states)
+        states_to_visit = list(self.final_states)
+        for state in states_to_visit:
+            coaccessible[state] = 1
+
+        while states_to_visit:
+            state = states_to_visit.pop()
+            for arc_idx in in_arcs[in_offsets[state] : in_offsets[state + 1]]:
+                from_state = arc_from[arc_idx]
+                if not coaccessible[from_state]:
+                    coaccessible[from_state] = 1
+                    states_to_visit.append(from_state)
+
+        if not all(accessible[state] for state in self.final_states):
+            self.final_states = {
+                state for state in self.final_states if accessible[state]
+            }
+
+        # Both ends of an arc are connected if it leaves an accessible state
+        # and enters a coaccessible one.
+        if all(
+            accessible[from_state] and coaccessible[to_state]
+            for from_state, to_state in zip(arc_from, arc_to)
+        ):
+            return
+
+        self._keep_arcs(
+            lambda arc_idx: bool(
+                accessible[arc_from[arc_idx]] and coaccessible[arc_to[arc_idx]]
+            )
+        )
+
+    def _incoming_arcs(self) -> Tuple["array[int]", "array[int]"]:
+        """Index of arcs by the state they enter.
+
+        Arcs entering state are in_arcs[in_offsets[state]:in_offsets[state + 1]].
+        """
+        in_offsets = array("i", itertools.repeat(0, self.num_states + 1))
+        for to_state in self.arc_to:
+            in_offsets[to_state + 1] += 1
+
+        for state in range(self.num_states):
+            in_offsets[state + 1] += in_offsets[state]
+
+        in_arcs = array("i", itertools.repeat(0, self.num_arcs))
+        next_offsets = in_offsets[:-1]
+        for arc_idx, to_state in enumerate(self.arc_to):
+            in_arcs[next_offsets[to_state]] = arc_idx
+            next_offsets[to_state] += 1
+
+        return in_offsets, in_arcs
+
+    def minimize(self) -> None:
+        """Merge states with the same incoming arcs (shared prefixes), then
+        states with the same outgoing arcs (shared suffixes).
+
+        Paths keep their labels and weights. The FST must be acyclic, like the
+        FSTs built from sentences.
+        """
+        for nonterminal in self.nonterminals.values():
+            nonterminal.minimize()
+
+        for subgraph in self.subgraphs.values():
+            subgraph.minimize()
+
+        order = self._topological_order()
+        if order is None:
+            _LOGGER.warning("Not minimizing FST with cycles")
+            return
+
+        num_states_before = len(order)
+        num_arcs_before = self.num_arcs
+        arc_from, arc_to, arc_ilabel, arc_olabel, arc_log_prob = (
+            self.arc_from,
+            self.arc_to,
+            self.arc_ilabel,
+            self.arc_olabel,
+            self.arc_log_prob,
+        )
+
+        # Prefixes: sources are merged before the states their arcs enter
+        in_offsets, in_arcs = self._incoming_arcs()
+        merged_state = array("i", range(self.num_states))
+        states_by_key: Dict[Any, int] = {}
+        for state in order:
+            if state == self.start:
+                continue
+
+            in_key = frozenset(
+                (
+                    merged_state[arc_from[arc_idx]],
+                    arc_ilabel[arc_idx],
+                    arc_olabel[arc_idx],
+                    _weight_key(arc_log_prob[arc_idx]),
+                )
+                for arc_idx in in_arcs[in_offsets[state] : in_offsets[state + 1]]
+            )
+            merged_state[state] = states_by_key.setdefault(in_key, state)
+
+        self._merge_states(merged_state)
+
+        # Suffixes: targets are merged before the states their arcs leave
+        order = self._topological_order()
+        assert order is not None
+        arc_to, arc_ilabel, arc_olabel, arc_log_prob = (
+            self.arc_to,
+            self.arc_ilabel,
+            self.arc_olabel,
+            self.arc_log_prob,
+        )
+        merged_state = array("i", range(self.num_states))
+        states_by_key.clear()
+        for state in reversed(order):
+            if state == self.start:
+                continue
+
+            out_key = (
+                state in self.final_states,
+                frozenset(
+                    (
+                        arc_ilabel[arc_idx],
+                        arc_olabel[arc_idx],
+                        _weight_key(arc_log_prob[arc_idx]),
+                        merged_state[arc_to[arc_idx]],
+                    )
+                    for arc_idx in self.arcs_from(state)
+                ),
+            )
+
+            merged_state[state] = states_by_key.setdefault(out_key, state)
 
-            for state in self.states:
-                if (not self.arcs[state]) and (state not in self.final_states):
-                    states_to_prune.add(state)
+        self._merge_states(merged_state)
 
-            if not states_to_prune:
-                break
+        _LOGGER.debug(
+            "Minimized FST from %s state(s)/%s arc(s) to %s state(s)/%s arc(s)",
+            num_states_before,
+            num_arcs_before,
+            self.num_states,
+            self.num_arcs,
+        )
 
-            self.states.difference_update(states_to_prune)
+    def _topological_order(self) -> Optional[List[int]]:
+        """States reachable from start, ordered so that arcs go forward.
 
-            # Prune outgoing arcs
-            for state in states_to_prune:
-                self.arcs.pop(state, None)
+        Returns None if there is a cycle (or unreachable states with arcs).
+        """
+        arc_to = self.arc_to
+        in_degree = array("i", itertools.repeat(0, self.num_states))
+        for to_state in arc_to:
+            in_degree[to_state] += 1
 
-            # Prune incoming arcs
-            for state in self.states:
-                needs_pruning = any(
-                    arc.to_state in states_to_prune for arc in self.arcs[state]
-                )
-                if needs_pruning:
-                    self.arcs[state] = [
-                        arc
-                        for arc in self.arcs[state]
-                        if arc.to_state not in states_to_prune
-                    ]
+        if in_degree[self.start] > 0:
+            return None
+
+        order: List[int] = []
+        states_to_visit = [self.start]
+        while states_to_visit:
+            state = states_to_visit.pop()
+            order.append(state)
+            for arc_idx in self.arcs_from(state):
+                to_state = arc_to[arc_idx]
+                in_degree[to_state] -= 1
+                if in_degree[to_state] == 0:
+                    states_to_visit.append(to_state)
+
+        if any(in_degree):
+            return None
+
+        return order
+
+    def _merge_states(self, merged_state: "array[int]") -> None:
+        """Replace each state with merged_state[state].
+
+        Remaining states are numbered in order, and duplicate arcs are removed.
+        """
+        arc_from, arc_to, arc_ilabel, arc_olabel, arc_log_prob = (
+            self.arc_from,
+            self.arc_to,
+            self.arc_ilabel,
+            self.arc_olabel,
+            self.arc_log_prob,
+        )
+
+        is_used = bytearray(self.num_states)
+        is_used[merged_state[self.start]] = 1
+        for state in self.final_states:
+            is_used[merged_state[state]] = 1
+
+        for state in itertools.chain(arc_from, arc_to):
+            is_used[merged_state[state]] = 1
+
+        new_state = array("i", itertools.repeat(0, self.num_states))
+        num_new_states = 0
+        for state, state_is_used in enumerate(is_used):
+            if state_is_used:
+                new_state[state] = num_new_states
+                num_new_states += 1
+
+        self.arc_from = _int_array()
+        self.arc_to = _int_array()
+        self.arc_ilabel = _int_array()
+        self.arc_olabel = _int_array()
+        self.arc_log_prob = array("d")
+        self.arc_next = _int_array()
+        self.state_first_arc = array("i", itertools.repeat(NO_ARC, num_new_states))
+        self.state_last_arc = array("i", itertools.repeat(NO_ARC, num_new_states))
+
+        # Arcs are re-added in their original order
+        added_arcs: Set[Tuple[Any, ...]] = set()
+        for arc_idx in range(len(arc_to)):
+            from_state = new_state[merged_state[arc_from[arc_idx]]]
+            to_state = new_state[merged_state[arc_to[arc_idx]]]
+            arc_key = (
+                from_state,
+                to_state,
+                arc_ilabel[arc_idx],
+                arc_olabel[arc_idx],
+                _weight_key(arc_log_prob[arc_idx]),
+            )
+            if arc_key in added_arcs:
+                continue
+
+            added_arcs.add(arc_key)
+            self._append_arc(
+                from_state,
+                to_state,
+                arc_ilabel[arc_idx],
+                arc_olabel[arc_idx],
+                arc_log_prob[arc_idx],
+            )
+
+        self.start = new_state[merged_state[self.start]]
+        self.final_states = {
+            new_state[merged_state[state]] for state in self.final_states
+        }
+        self.current_state = max(0, num_new_states - 1)
 
     def to_strings(self, add_spaces: bool) -> List[str]:
         strings: List[str] = []
@@ -300,7 +964,8 @@ class Fst:
             if text_norm:
                 strings.append(text_norm)
 
-        for arc in self.arcs[state]:
+        for arc_idx in self.arcs_from(state):
+            arc = self.get_arc(arc_idx)
             if arc.in_label == SPACE:
                 arc_text = text + " "
             elif arc.in_label != EPS:
@@ -336,7 +1001,8 @@ class Fst:
             tokens.append(path)
 
         has_arcs = False
-        for arc in self.arcs[state]:
+        for arc_idx in self.arcs_from(state):
+            arc = self.get_arc(arc_idx)
             has_arcs = True
 
             # Skip <eps> and initial <space>
@@ -355,7 +1021,11 @@ class Fst:
 @dataclass
 class NumToWords:
     engine: RbnfEngine
-    cache: Dict[Tuple[int, int, int], Sequence] = field(default_factory=dict)
+
+    # (slot name, start, stop, step, split) -> number expression (None if empty)
+    cache: Dict[Tuple[str, int, int, int, bool], Optional[Sequence]] = field(
+        default_factory=dict
+    )
 
 
 @dataclass
@@ -364,12 +1034,170 @@ class G2PInfo:
     casing_func: Callable[[str], str] = field(default=lambda s: s)
 
 
+@dataclass
+class SharedFsts:
+    """Slot lists and expansion rules built once as separate FSTs.
+
+    Lists in nonterminal_lists become nonterminals (see Fst.nonterminals).
+    Other lists and rules become subgraphs (see Fst.subgraphs) if
+    share_subgraphs is set.
+    """
+
+    nonterminal_lists: Set[str] = field(default_factory=set)
+    share_subgraphs: bool = True
+
+    # key -> label (None if dead branch)
+    labels: Dict[Tuple[Any, ...], Optional[str]] = field(default_factory=dict)
+
+    # label -> FST
+    nonterminals: Dict[str, Fst] = field(default_factory=dict)
+    subgraphs: Dict[str, Fst] = field(default_factory=dict)
+
+
 @dataclass
 class ExpressionWithOutput:
     expression: Expression
     output_text: str
     list_name: Optional[str] = None
 
+    # Output is added to the number output before it (see ADD_OUTPUT_PREFIX)
+    is_number_tail: bool = False
+
+
+# (language, number) -> words for number
+_NUMBER_WORDS_CACHE: Dict[Tuple[str, int], FrozenSet[str]] = {}
+
+# (language, tail numbers) -> alternatives for tails
+_NUMBER_TAILS_CACHE: Dict[Tuple[str, Tuple[int, ...]], Sequence] = {}
+
+
+def get_number_words(engine: RbnfEngine, number: int) -> FrozenSet[str]:
+    """Get all spellings of a number (all genders, cases, etc.).
+
+    Results are cached across calls.
+    """
+    key = (engine.language, number)
+    number_words = _NUMBER_WORDS_CACHE.get(key)
+    if number_words is None:
+        number_result = engine.format_number(number)
+        number_words = frozenset(
+            w.replace("-", " ") for w in number_result.text_by_ruleset.values()
+        )
+        _NUMBER_WORDS_CACHE[key] = number_words
+
+    return number_words
+
+
+def numbers_to_expression(
+    engine: RbnfEngine, numbers: Iterable[int], list_name: str, split: bool = True
+) -> Optional[Sequence]:
+    """Get alternatives for numbers with their digits as output.
+
+    If split is set, numbers whose words are a head number followed by a tail
+    number (3042 = "three thousand" + "forty two") share alternatives for the
+    tails, so a range isn't spelled out value by value. Tail outputs are only
+    decoded when the number is a separate word, so split must not be set for a
+    range that is glued to text around it.
+
+    Returns None if there are no numbers.
+    """
+    return _numbers_to_expression(engine, numbers, list_name=list_name, split=split)
+
+
+def _numbers_to_expression(
+    engine: RbnfEngine,
+    numbers: Iterable[int],
+    list_name: Optional[str] = None,
+    split: bool = True,
+) -> Optional[Sequence]:
+    """Get alternatives for numbers.
+
+    Without list_name, numbers are tails added to the output before them.
+    """
+    whole_numbers: List[int] = []
+    tails_by_head: Dict[int, List[int]] = {}
+    for number in numbers:
+        head_tail = _split_number(engine, number) if split else None
+        if head_tail is None:
+            whole_numbers.append(number)
+        else:
+            tails_by_head.setdefault(head_tail[0], []).append(head_tail[1])
+
+    heads_by_tails: Dict[Tuple[int, ...], List[int]] = {}
+    for head, tails in tails_by_head.items():
+        heads_by_tails.setdefault(tuple(tails), []).append(head)
+
+    items: List[Union[Expression, ExpressionWithOutput]] = []
+    for number in whole_numbers:
+        items.extend(_number_values(engine, number, list_name))
+
+    for tails, heads in heads_by_tails.items():
+        tails_key = (engine.language, tails)
+        tails_sequence = _NUMBER_TAILS_CACHE.get(tails_key)
+        if tails_sequence is None:
+            tails_sequence = _numbers_to_expression(engine, tails)
+            assert tails_sequence is not None
+            _NUMBER_TAILS_CACHE[tails_key] = tails_sequence
+
+        heads_sequence = Sequence(
+            [
+                value
+                for head in heads
+                for value in _number_values(engine, head, list_name)
+            ],
+            type=SequenceType.ALTERNATIVE,
+        )
+        items.append(
+            Sequence(
+                [heads_sequence, TextChunk(" "), tails_sequence],
+                type=SequenceType.GROUP,
+            )
+        )
+
+    if not items:
+        return None
+
+    return Sequence(items, type=SequenceType.ALTERNATIVE)
+
+
+def _number_values(
+    engine: RbnfEngine, number: int, list_name: Optional[str]
+) -> List[ExpressionWithOutput]:
+    return [
+        ExpressionWithOutput(
+            TextChunk(w),
+            output_text=str(number),
+            list_name=list_name,
+            is_number_tail=(list_name is None),
+        )
+        for w in sorted(get_number_words(engine, number))
+    ]
+
+
+def _split_number(engine: RbnfEngine, number: int) -> Optional[Tuple[int, int]]:
+    """Split number into (head, tail) if its words are always the words of head
+    followed by the words of tail.
+    """
+    number_words: Optional[FrozenSet[str]] = None
+    for scale in NUMBER_SCALES:
+        tail = number % scale
+        if (number <= scale) or (tail == 0):
+            continue
+
+        if number_words is None:
+            number_words = get_number_words(engine, number)
+
+        head = number - tail
+        head_tail_words = {
+            f"{head_words} {tail_words}"
+            for head_words in get_number_words(engine, head)
+            for tail_words in get_number_words(engine, tail)
+        }
+        if head_tail_words == number_words:
+            return (head, tail)
+
+    return None
+
 
 def expression_to_fst(
     expression: Union[Expression, ExpressionWithOutput],
@@ -381,14 +1209,26 @@ def expression_to_fst(
     num_to_words: Optional[NumToWords] = None,
     g2p_info: Optional[G2PInfo] = None,
     suppress_output: bool = False,
+    shared: Optional[SharedFsts] = None,
+    word_boundaries: Tuple[bool, bool] = (False, False),
 ) -> Optional[int]:
+    """Add expression to FST, starting from state.
+
+    Lists and rules with a word boundary on both sides (word_boundaries) are
+    referenced from shared instead of being copied in.
+
+    Returns the end state, or None if expression is a dead branch.
+    """
     if isinstance(expression, ExpressionWithOutput):
         exp_output: ExpressionWithOutput = expression
         output_data = {"text": exp_output.output_text}
         if exp_output.list_name:
             output_data["list"] = exp_output.list_name
 
-        output_word = encode_meta(json.dumps(output_data))
+        if exp_output.is_number_tail:
+            output_word = f"{ADD_OUTPUT_PREFIX}{exp_output.output_text}"
+        else:
+            output_word = encode_meta(json.dumps(output_data))
 
         state = fst.next_edge(state, EPS, BEGIN_OUTPUT)
         state = fst.next_edge(state, EPS, output_word)
@@ -480,6 +1320,8 @@ def expression_to_fst(
                     slot_lists,
                     num_to_words,
                     g2p_info,
+                    shared=shared,
+                    word_boundaries=word_boundaries,
                 )
                 if state is None:
                     # Dead branch
@@ -497,7 +1339,20 @@ def expression_to_fst(
             return end
 
         if seq.type == SequenceType.GROUP:
-            for item in seq.items:
+            last_item_idx = len(seq.items) - 1
+            for item_idx, item in enumerate(seq.items):
+                item_boundaries = (
+                    (
+                        word_boundaries[0]
+                        if item_idx == 0
+                        else _has_space(seq.items[item_idx - 1], at_end=True)
+                    ),
+                    (
+                        word_boundaries[1]
+                        if item_idx == last_item_idx
+                        else _has_space(seq.items[item_idx + 1], at_end=False)
+                    ),
+                )
                 state = expression_to_fst(
                     item,
                     state,
@@ -507,6 +1362,8 @@ def expression_to_fst(
                     slot_lists,
                     num_to_words,
                     g2p_info,
+                    shared=shared,
+                    word_boundaries=item_boundaries,
                 )
 
                 if state is None:
@@ -533,6 +1390,7 @@ def expression_to_fst(
             text_list: TextSlotList = slot_list
 
             values: List[ExpressionWithOutput] = []
+            value_ids: List[int] = []
             for value in text_list.values:
                 if (intent_data.requires_context is not None) and (
                     not check_required_context(
@@ -569,12 +1427,37 @@ def expression_to_fst(
                 else:
                     values.append(value.text_in)
 
+                value_ids.append(id(value))
+
             if not values:
                 # Dead branch
                 return None
 
+            values_expression = Sequence(values, type=SequenceType.ALTERNATIVE)
+            if _can_share(shared, word_boundaries, list_ref.list_name):
+                assert shared is not None
+                key: Tuple[Any, ...] = ("list", list_ref.slot_name, tuple(value_ids))
+                if not all(isinstance(v, ExpressionWithOutput) for v in values):
+                    # Templates may depend on intent data
+                    key += _context_key(intent_data)
+
+                return _add_shared(
+                    values_expression,
+                    state,
+                    fst,
+                    key,
+                    list_ref.list_name,
+                    intent_data,
+                    intents,
+                    slot_lists,
+                    num_to_words,
+                    g2p_info,
+                    shared,
+                    nonterminal=list_ref.list_name in shared.nonterminal_lists,
+                )
+
             return expression_to_fst(
-                Sequence(values, type=SequenceType.ALTERNATIVE),
+                values_expression,
                 state,
                 fst,
                 intent_data,
@@ -582,6 +1465,8 @@ def expression_to_fst(
                 slot_lists,
                 num_to_words,
                 g2p_info,
+                shared=shared,
+                word_boundaries=word_boundaries,
             )
 
         elif isinstance(slot_list, RangeSlotList):
@@ -591,38 +1476,45 @@ def expression_to_fst(
                 # Dead branch
                 return None
 
-            num_cache_key = (range_list.start, range_list.stop + 1, range_list.step)
-            number_sequence = num_to_words.cache.get(num_cache_key)
+            # Number tails need a word boundary on both sides to be decoded
+            split_numbers = all(word_boundaries)
+            num_cache_key = (
+                list_ref.slot_name,
+                range_list.start,
+                range_list.stop,
+                range_list.step,
+                split_numbers,
+            )
+            if num_cache_key in num_to_words.cache:
+                number_sequence = num_to_words.cache[num_cache_key]
+            else:
+                number_sequence = numbers_to_expression(
+                    num_to_words.engine,
+                    range(range_list.start, range_list.stop + 1, range_list.step),
+                    list_ref.slot_name,
+                    split=split_numbers,
+                )
+                num_to_words.cache[num_cache_key] = number_sequence
 
             if number_sequence is None:
-                values: List[ExpressionWithOutput] = []
-                if num_to_words is not None:
-                    for number in range(
-                        range_list.start, range_list.stop + 1, range_list.step
-                    ):
-                        number_str = str(number)
-                        number_result = num_to_words.engine.format_number(number)
-                        number_words = {
-                            w.replace("-", " ")
-                            for w in number_result.text_by_ruleset.values()
-                        }
-                        values.extend(
-                            ExpressionWithOutput(
-                                TextChunk(w),
-                                output_text=number_str,
-                                list_name=list_ref.slot_name,
-                            )
-                            for w in number_words
-                        )
-
-                number_sequence = Sequence(values, type=SequenceType.ALTERNATIVE)
-
-                if num_to_words is not None:
-                    num_to_words.cache[num_cache_key] = number_sequence
+                # Dead branch
+                return None
 
-                if not values:
-                    # Dead branch
-                    return None
+            if _can_share(shared, word_boundaries):
+                assert shared is not None
+                return _add_shared(
+                    number_sequence,
+                    state,
+                    fst,
+                    ("range",) + num_cache_key,
+                    list_ref.list_name,
+                    intent_data,
+                    intents,
+                    slot_lists,
+                    num_to_words,
+                    g2p_info,
+                    shared,
+                )
 
             return expression_to_fst(
                 number_sequence,
@@ -653,6 +1545,22 @@ def expression_to_fst(
         if rule_body is None:
             raise ValueError(f"Missing expansion rule <{rule_ref.rule_name}>")
 
+        if _can_share(shared, word_boundaries):
+            assert shared is not None
+            return _add_shared(
+                rule_body,
+                state,
+                fst,
+                ("rule", id(rule_body)) + _context_key(intent_data),
+                rule_ref.rule_name,
+                intent_data,
+                intents,
+                slot_lists,
+                num_to_words,
+                g2p_info,
+                shared,
+            )
+
         return expression_to_fst(
             rule_body,
             state,
@@ -662,11 +1570,158 @@ def expression_to_fst(
             slot_lists,
             num_to_words,
             g2p_info,
+            shared=shared,
+            word_boundaries=word_boundaries,
         )
 
     return state
 
 
+def _has_space(expression: Expression, at_end: bool) -> bool:
+    """True if expression is text that ends (or starts) with a space."""
+    if not isinstance(expression, TextChunk):
+        return False
+
+    if at_end:
+        return expression.original_text.endswith(" ")
+
+    return expression.original_text.startswith(" ")
+
+
+def _can_share(
+    shared: Optional[SharedFsts],
+    word_boundaries: Tuple[bool, bool],
+    list_name: Optional[str] = None,
+) -> bool:
+    """True if a list or rule can be referenced from shared.
+
+    Shared FSTs are separate words, so they need a word boundary on both sides.
+    """
+    if (shared is None) or (not all(word_boundaries)):
+        return False
+
+    if (list_name is not None) and (list_name in shared.nonterminal_lists):
+        return True
+
+    return shared.share_subgraphs
+
+
+def _context_key(intent_data: IntentData) -> Tuple[Any, ...]:
+    """Parts of intent data that an expression's FST may depend on."""
+    return (
+        json.dumps(intent_data.requires_context, sort_keys=True, default=str),
+        json.dumps(intent_data.excludes_context, sort_keys=True, default=str),
+        id(intent_data.slot_lists) if intent_data.slot_lists else None,
+        id(intent_data.expansion_rules) if intent_data.expansion_rules else None,
+    )
+
+
+def _add_shared(
+    expression: Expression,
+    state: int,
+    fst: Fst,
+    key: Tuple[Any, ...],
+    name: str,
+    intent_data: IntentData,
+    intents: Intents,
+    slot_lists: Optional[Dict[str, SlotList]],
+    num_to_words: Optional[NumToWords],
+    g2p_info: Optional[G2PInfo],
+    shared: SharedFsts,
+    nonterminal: bool = False,
+) -> Optional[int]:
+    """Add an arc for a shared FST, building it the first time.
+
+    Returns None if the shared FST is a dead branch.
+    """
+    if key in shared.labels:
+        label = shared.labels[key]
+    else:
+        label = None
+        shared_fst = Fst()
+        shared_state = expression_to_fst(
+            expression,
+            shared_fst.next_edge(shared_fst.start, SPACE, SPACE),
+            shared_fst,
+            intent_data,
+            intents,
+            slot_lists,
+            num_to_words,
+            g2p_info,
+            shared=shared,
+            word_boundaries=(True, True),
+        )
+
+        if shared_state is not None:
+            final = shared_fst.next_state()
+            shared_fst.add_edge(shared_state, final, SPACE, SPACE)
+            shared_fst.accept(final)
+
+            # Labels can't have whitespace
+            name = re.sub(r"\s+", "_", name)
+            if nonterminal:
+                label = f"{NONTERM_PREFIX}{name}.{len(shared.labels)}"
+                shared.nonterminals[label] = shared_fst
+            else:
+                label = f"{SUBGRAPH_PREFIX}{name}.{len(shared.labels)}"
+                shared.subgraphs[label] = shared_fst
+
+        shared.labels[key] = label
+
+    if label is None:
+        # Dead branch
+        return None
+
+    # Shared FST is its own word
+    state = fst.next_edge(state, SPACE)
+    state = fst.next_edge(state, label, label)
+    return fst.next_edge(state, SPACE)
+
+
+def is_nonterminal(label: str) -> bool:
+    return label.startswith(NONTERM_PREFIX)
+
+
+def is_subgraph(label: str) -> bool:
+    return label.startswith(SUBGRAPH_PREFIX)
+
+
+def is_reference(label: str) -> bool:
+    """True if label is replaced by another FST."""
+    return is_nonterminal(label) or is_subgraph(label)
+
+
+def read_symbols(symbols_file: TextIO) -> Dict[str, int]:
+    """Read a symbol table in text format (e.g., words.txt)."""
+    symbol_ids: Dict[str, int] = {}
+    for line in symbols_file:
+        parts = line.split()
+        if len(parts) == 2:
+            symbol_ids[parts[0]] = int(parts[1])
+
+    return symbol_ids
+
+
+def _write_binary_string(fst_file: BinaryIO, text: str) -> None:
+    text_bytes = text.encode("utf-8")
+    fst_file.write(struct.pack("<i", len(text_bytes)))
+    fst_file.write(text_bytes)
+
+
+def _write_binary_symbols(
+    fst_file: BinaryIO, symbol_ids: Dict[str, int], name: str
+) -> None:
+    """Write symbol table in OpenFST's binary format."""
+    fst_file.write(struct.pack("<i", SYMBOL_TABLE_MAGIC))
+    _write_binary_string(fst_file, name)
+    fst_file.write(
+        struct.pack("<qq", max(symbol_ids.values(), default=-1) + 1, len(symbol_ids))
+    )
+    for symbol, symbol_id in symbol_ids.items():
+        _write_binary_string(fst_file, symbol)
+        fst_file.write(struct.pack("<q", symbol_id))
+
+
 def get_count(
     e: Expression,
     intents: Intents,
@@ -729,6 +1784,36 @@ def lcm(*nums: int) -> int:
     return 1
 
 
+def _get_text_words(
+    intents: Intents,
+    filtered_intents: List[Intent],
+    slot_lists: Optional[Dict[str, SlotList]],
+) -> Set[str]:
+    """Words and sub-words in the text of sentences, rules, and text lists."""
+    expressions: List[Expression] = list(intents.expansion_rules.values())
+    all_slot_lists: List[Dict[str, SlotList]] = [intents.slot_lists, slot_lists or {}]
+    for intent in filtered_intents:
+        for data in intent.data:
+            expressions.extend(data.sentences)
+            expressions.extend(data.expansion_rules.values())
+            all_slot_lists.append(data.slot_lists)
+
+    for lists in all_slot_lists:
+        for slot_list in lists.values():
+            if isinstance(slot_list, TextSlotList):
+                expressions.extend(value.text_in for value in slot_list.values)
+
+    words: Set[str] = set()
+    while expressions:
+        expression = expressions.pop()
+        if isinstance(expression, TextChunk):
+            words.update(get_split_candidates(expression.original_text))
+        elif isinstance(expression, Sequence):
+            expressions.extend(expression.items)
+
+    return words
+
+
 def intents_to_fst(
     intents: Intents,
     slot_lists: Optional[Dict[str, SlotList]] = None,
@@ -736,7 +1821,17 @@ def intents_to_fst(
     exclude_intents: Optional[Set[str]] = None,
     include_intents: Optional[Set[str]] = None,
     g2p_info: Optional[G2PInfo] = None,
+    nonterminal_lists: Optional[Collection[str]] = None,
+    share_subgraphs: bool = True,
 ) -> Fst:
+    """Build an FST for all intent sentences.
+
+    Lists in nonterminal_lists are built once into separate FSTs (see
+    Fst.nonterminals) that are referenced by "#nonterm:" labels.
+
+    If share_subgraphs is set, other lists and rules are also built once (see
+    Fst.subgraphs) and referenced by "#subgraph:" labels.
+    """
     num_to_words: Optional[NumToWords] = None
     if number_language:
         try:
@@ -773,6 +1868,19 @@ def intents_to_fst(
     _LOGGER.debug("Total sentences: %s", total_sentences)
     _LOGGER.debug("Sentence count by intent: %s", sentence_counts)
 
+    if g2p_info is not None:
+        # Check all words in the lexicon at once instead of per text chunk
+        g2p_info.lexicon.exists_many(
+            _get_text_words(intents, filtered_intents, slot_lists)
+        )
+
+    shared: Optional[SharedFsts] = None
+    if nonterminal_lists or share_subgraphs:
+        shared = SharedFsts(
+            nonterminal_lists=set(nonterminal_lists or []),
+            share_subgraphs=share_subgraphs,
+        )
+
     fst_with_spaces = Fst()
     final = fst_with_spaces.next_state()
 
@@ -833,6 +1941,8 @@ def intents_to_fst(
                     num_to_words,
                     g2p_info,
                     suppress_output=(sentence_output is not None),
+                    shared=shared,
+                    word_boundaries=(True, True),
                 )
 
                 if state is None:
@@ -843,6 +1953,10 @@ def intents_to_fst(
 
     fst_with_spaces.accept(final)
 
+    if shared is not None:
+        fst_with_spaces.nonterminals = shared.nonterminals
+        fst_with_spaces.subgraphs = shared.subgraphs
+
     return fst_with_spaces
 
 
@@ -853,12 +1967,28 @@ def decode_meta(text: str) -> str:
         data = json.loads(decode_meta_single(m.group(1)))
         slot_name = data.get("list")
         slot_value = data["text"]
+
+        if m.group(2):
+            # Number with tails (3000 + 42)
+            slot_value = str(
+                int(slot_value)
+                + sum(
+                    int(tail[len(ADD_OUTPUT_PREFIX) :]) for tail in m.group(2).split()
+                )
+            )
         if slot_name:
             slots[slot_name] = slot_value
 
         return slot_value
 
-    text = re.sub(re.escape(OUTPUT_PREFIX) + "([0-9A-Z=]+)", handle_match, text)
+    text = re.sub(
+        re.escape(OUTPUT_PREFIX)
+        + "([0-9A-Z=]+)((?: "
+        + re.escape(ADD_OUTPUT_PREFIX)
+        + "[0-9]+)*)",
+        handle_match,
+        text,
+    )
     match = re.search(re.escape(SENTENCE_OUTPUT) + "([0-9A-Z=]+)", text)
 
     if match is None:
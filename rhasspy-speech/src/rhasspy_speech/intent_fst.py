@@ -1,14 +1,16 @@
 """Convert sentences to FST."""
 
+import io
 import logging
+from collections.abc import Collection
 from dataclasses import dataclass, field
-from typing import Optional, Set, TextIO
+from typing import Dict, Optional, Set, TextIO
 
 from hassil.intents import Intents
 
 from .const import WordCasing
 from .g2p import LexiconDatabase
-from .hassil_fst import G2PInfo
+from .hassil_fst import Fst, G2PInfo
 from .hassil_fst import intents_to_fst as hassil_intents_to_fst
 
 _LOGGER = logging.getLogger(__name__)
@@ -22,6 +24,12 @@ class IntentsToFstContext:
     meta_labels: Set[str] = field(default_factory=set)
     word_casing: WordCasing = WordCasing.LOWER
 
+    # label -> text FST that replaces the label in fst_file
+    nonterminals: Dict[str, str] = field(default_factory=dict)
+
+    # FST in fst_file (for writing in binary format)
+    fst: Optional[Fst] = None
+
 
 def intents_to_fst(
     intents: Intents,
@@ -29,19 +37,50 @@ def intents_to_fst(
     lexicon: LexiconDatabase,
     number_language: Optional[str] = None,
     word_casing: WordCasing = WordCasing.LOWER,
+    nonterminal_lists: Optional[Collection[str]] = None,
+    minimize: bool = True,
 ) -> IntentsToFstContext:
-    """Convert YAML sentence files to an FST for Kaldi."""
+    """Convert YAML sentence files to an FST for Kaldi.
+
+    Lists in nonterminal_lists are written as separate FSTs, so changing
+    their values doesn't change the main FST.
+
+    If minimize is set, shared prefixes and suffixes of sentences are merged
+    before the FST is written.
+    """
     context = IntentsToFstContext(fst_file=fst_file, lexicon=lexicon)
     casing_func = WordCasing.get_function(word_casing)
 
     fst = hassil_intents_to_fst(
-        intents, number_language=number_language, g2p_info=G2PInfo(lexicon, casing_func)
+        intents,
+        number_language=number_language,
+        g2p_info=G2PInfo(lexicon, casing_func),
+        nonterminal_lists=nonterminal_lists,
     ).remove_spaces()
     fst.prune()
 
+    if minimize:
+        fst.minimize()
+
     fst.write(context.fst_file)
     context.fst_file.seek(0)
-    context.vocab = fst.words
-    context.meta_labels = fst.output_words - fst.words
+    context.fst = fst
+
+    words = set(fst.words)
+    output_words = set(fst.output_words)
+    for label, nonterminal in fst.nonterminals.items():
+        with io.StringIO() as nonterminal_file:
+            nonterminal.write(nonterminal_file, subgraphs=fst.subgraphs)
+            context.nonterminals[label] = nonterminal_file.getvalue()
+
+        words.update(nonterminal.words)
+        output_words.update(nonterminal.output_words)
+
+    for subgraph in fst.subgraphs.values():
+        words.update(subgraph.words)
+        output_words.update(subgraph.output_words)
+
+    context.vocab = words - context.nonterminals.keys() - fst.subgraphs.keys()
+    context.meta_labels = output_words - words
 
     return context
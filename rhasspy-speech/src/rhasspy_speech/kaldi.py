@@ -1,18 +1,34 @@
 import gzip
 import logging
-import shlex
+import os
 import shutil
 import tempfile
-from collections.abc import Collection
+from collections.abc import Awaitable, Callable, Collection
+from functools import partial
 from pathlib import Path
-from typing import Optional, Set, Union
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 from .const import EPS, SIL, SPN, UNK, LangSuffix
+from .fuzzy import (
+    DELETIONS_FILENAME,
+    FUZZY_FST_FILENAME,
+    NONTERMINALS_DIRNAME,
+    get_nonterminal_path,
+)
+from .hassil_fst import NONTERM_PREFIX, read_symbols
 from .intent_fst import IntentsToFstContext
+from .stage_cache import StageCache, StageHash, remove_path
+from .stage_scheduler import Stage, run_stages
 from .tools import KaldiTools
 
 _LOGGER = logging.getLogger(__name__)
 
+# Label id of #0 for lattice rescoring (written next to Ldet.fst)
+PHI_FILENAME = "phi.int"
+
+# Label for the top-level FST in fstreplace
+ROOT_NONTERMINAL = f"{NONTERM_PREFIX}root"
+
 
 class KaldiTrainer:
     def __init__(
@@ -59,6 +75,9 @@ class KaldiTrainer:
 
         return self.data_dir / "lang"
 
+    def nonterminals_dir(self, suffix: Optional[str] = None) -> Path:
+        return self.lang_dir(suffix) / NONTERMINALS_DIRNAME
+
     @property
     def dict_local_dir(self) -> Path:
         return self.data_local_dir / "dict"
@@ -75,7 +94,14 @@ class KaldiTrainer:
         self,
         lang_suffixes: Optional[Collection[LangSuffix]] = None,
         rescore_order: int = 5,
+        use_cache: bool = True,
+        max_parallel_stages: Optional[int] = None,
     ) -> None:
+        """Train, reusing outputs of stages whose inputs haven't changed.
+
+        Set use_cache to False to run every stage. Stages for different lang
+        types run concurrently, up to max_parallel_stages (default: CPU count).
+        """
         if lang_suffixes is None:
             lang_suffixes = (LangSuffix.GRAMMAR, LangSuffix.ARPA)
 
@@ -88,15 +114,19 @@ class KaldiTrainer:
 
         shutil.copytree(self.model_dir / "conf", self.conf_dir)
 
-        # Delete existing data/graph
-        if self.data_dir.exists():
-            shutil.rmtree(self.data_dir)
+        cache = StageCache(self.train_dir)
+        if not use_cache:
+            cache.clear()
 
-        for graph_dir in self.train_dir.glob("graph_*"):
-            if not graph_dir.is_dir():
-                continue
+        # Delete existing data/graph for lang types that aren't being trained
+        lang_suffix_values = {lang_suffix.value for lang_suffix in lang_suffixes}
+        for suffix_dir_pattern in ("graph_*", "data/lang_*", "data/local/lang_*"):
+            for suffix_dir in self.train_dir.glob(suffix_dir_pattern):
+                if not suffix_dir.is_dir():
+                    continue
 
-            shutil.rmtree(graph_dir)
+                if suffix_dir.name.split("_", maxsplit=1)[1] not in lang_suffix_values:
+                    shutil.rmtree(suffix_dir)
 
         # ---------------------------------------------------------------------
         # Kaldi Training
@@ -112,43 +142,328 @@ class KaldiTrainer:
         if not path_sh.is_file():
             path_sh.write_text("")
 
-        # Write pronunciation dictionary
-        await self._create_lexicon()
-
         # Create utils link
         model_utils_link = self.train_dir / "utils"
         model_utils_link.unlink(missing_ok=True)
         model_utils_link.symlink_to(self.tools.egs_utils_dir, target_is_directory=True)
 
-        # 1. prepare_lang.sh
+        # Write pronunciation dictionary
+        lexicon_entries, missing_words = self._get_lexicon_entries()
+        lexicon_hash = (
+            cache.hash_stage("lexicon")
+            .add(self.unk, self.spn_phone, self.sil_phone)
+            .add(lexicon_entries, sorted(missing_words))
+            .add(sorted(self.fst_context.meta_labels))
+            .add_files(self.model_dir / "phones")
+        )
+        if missing_words:
+            lexicon_hash.add_files(self._g2p_model_path)
+
+        stages: List[Stage] = [
+            self._cached_stage(
+                cache,
+                "lexicon",
+                lexicon_hash,
+                [
+                    self.dict_local_dir / "lexicon.txt",
+                    self.dict_local_dir / "lexiconp.txt",
+                ],
+                partial(self._create_lexicon, lexicon_entries, missing_words),
+                clean_paths=[self.dict_local_dir],
+            )
+        ]
+
+        text_fst_hash = (
+            cache.hash_stage("text_fst")
+            .add_text_file(self.fst_context.fst_file)
+            .hexdigest()
+        )
+        model_files = self.model_dir / "model"
+
+        # Lang types only share the lexicon (which prepare_lang.sh only reads,
+        # since lexiconp.txt is already written) and the model's online directory
+        online_stage: Optional[str] = None
         for lang_suffix in lang_suffixes:
-            await self._prepare_lang(lang_suffix)
+            lang_dir = self.lang_dir(lang_suffix.value)
+
+            # 1. prepare_lang.sh
+            lang_stage = f"prepare_lang_{lang_suffix.value}"
+            lang_hash = cache.hash_stage(lang_stage).add(lexicon_hash.hexdigest())
+            stages.append(
+                self._cached_stage(
+                    cache,
+                    lang_stage,
+                    lang_hash,
+                    [lang_dir / "L_disambig.fst", lang_dir / "words.txt"],
+                    partial(self._prepare_lang, lang_suffix),
+                    depends_on=["lexicon"],
+                    clean_paths=[lang_dir, self.lang_local_dir(lang_suffix.value)],
+                )
+            )
+
+            # 2. Generate G.fst from skill graph
+            grammar_stage = f"grammar_{lang_suffix.value}"
+            grammar_hash = (
+                cache.hash_stage(grammar_stage)
+                .add(lang_hash.hexdigest())
+                .add(text_fst_hash)
+            )
+            grammar_depends_on = [lang_stage]
+            grammar_clean_paths = [lang_dir / "G.fst"]
+            if self.fst_context.nonterminals:
+                # Lists are compiled separately and replaced into G.fst
+                nonterminal_stages = self._nonterminal_stages(
+                    cache, lang_suffix, lang_stage, lang_hash
+                )
+                for nonterminal_stage, nonterminal_hash in nonterminal_stages:
+                    grammar_depends_on.append(nonterminal_stage.name)
+                    grammar_hash.add(nonterminal_hash.hexdigest())
+                    stages.append(nonterminal_stage)
+            else:
+                grammar_clean_paths.append(self.nonterminals_dir(lang_suffix.value))
+
+            create_grammar: Callable[[], Awaitable[Any]]
+            if lang_suffix == LangSuffix.GRAMMAR:
+                create_grammar = partial(self._create_grammar, lang_suffix)
+            else:
+                order = rescore_order if lang_suffix == LangSuffix.ARPA_RESCORE else 3
+                grammar_hash.add(order)
+                create_grammar = partial(self._create_arpa, lang_suffix, order=order)
+
+            stages.append(
+                self._cached_stage(
+                    cache,
+                    grammar_stage,
+                    grammar_hash,
+                    [lang_dir / "G.fst"],
+                    create_grammar,
+                    depends_on=grammar_depends_on,
+                    clean_paths=grammar_clean_paths,
+                )
+            )
+
+            if lang_suffix == LangSuffix.ARPA_RESCORE:
+                ldet_stage = f"ldet_{lang_suffix.value}"
+                stages.append(
+                    self._cached_stage(
+                        cache,
+                        ldet_stage,
+                        cache.hash_stage(ldet_stage).add(grammar_hash.hexdigest()),
+                        [lang_dir / "Ldet.fst", lang_dir / PHI_FILENAME],
+                        partial(create_ldet_fst, lang_dir, self.tools),
+                        depends_on=[grammar_stage],
+                    )
+                )
+                continue
 
-        # 2. Generate G.fst from skill graph
-        if LangSuffix.GRAMMAR in lang_suffixes:
-            await self._create_grammar(LangSuffix.GRAMMAR)
-            await self._create_fuzzy_fst(LangSuffix.GRAMMAR, self_loops=False)
+            fuzzy_stage = f"fuzzy_{lang_suffix.value}"
+            stages.append(
+                self._cached_stage(
+                    cache,
+                    fuzzy_stage,
+                    cache.hash_stage(fuzzy_stage)
+                    .add(grammar_hash.hexdigest())
+                    .add(sorted(self.fst_context.vocab)),
+                    [lang_dir / FUZZY_FST_FILENAME, lang_dir / DELETIONS_FILENAME],
+                    partial(self._create_fuzzy_fst, lang_suffix),
+                    depends_on=[grammar_stage],
+                    # Also remove compiled FST from older versions
+                    clean_paths=[
+                        lang_dir / "G.fuzzy.fst",
+                        lang_dir / FUZZY_FST_FILENAME,
+                        lang_dir / DELETIONS_FILENAME,
+                    ],
+                )
+            )
+
+            # 3. mkgraph.sh
+            mkgraph_stage = f"mkgraph_{lang_suffix.value}"
+            graph_dir = self.graph_dir(lang_suffix.value)
+            stages.append(
+                self._cached_stage(
+                    cache,
+                    mkgraph_stage,
+                    cache.hash_stage(mkgraph_stage)
+                    .add(grammar_hash.hexdigest())
+                    .add_files(model_files),
+                    [graph_dir / "HCLG.fst"],
+                    partial(self._mkgraph, lang_suffix),
+                    depends_on=[grammar_stage],
+                    clean_paths=[graph_dir],
+                )
+            )
+
+            # 4. prepare_online_decoding.sh
+            # All lang types write to the same directory, so one at a time.
+            online_dir = self.model_dir / "online"
+            online_depends_on = [lang_stage]
+            if online_stage is not None:
+                online_depends_on.append(online_stage)
+
+            online_stage = f"online_{lang_suffix.value}"
+            stages.append(
+                self._cached_stage(
+                    cache,
+                    online_stage,
+                    cache.hash_stage(online_stage)
+                    .add(lang_hash.hexdigest())
+                    .add_files(
+                        model_files,
+                        self.model_dir / "extractor",
+                        self.model_dir / "conf",
+                    ),
+                    [online_dir / "conf" / "online.conf"],
+                    partial(self._prepare_online_decoding, lang_suffix),
+                    depends_on=online_depends_on,
+                    clean_paths=[],
+                )
+            )
+
+        await run_stages(
+            stages, max_parallel=max_parallel_stages or os.cpu_count() or 1
+        )
 
-        if LangSuffix.ARPA in lang_suffixes:
-            await self._create_arpa(LangSuffix.ARPA)
-            await self._create_fuzzy_fst(LangSuffix.ARPA)
+    def _nonterminal_stages(
+        self,
+        cache: StageCache,
+        lang_suffix: LangSuffix,
+        lang_stage: str,
+        lang_hash: StageHash,
+    ) -> List[Tuple[Stage, StageHash]]:
+        """Stages that compile each nonterminal FST.
+
+        Only nonterminals whose text changed are recompiled.
+        """
+        nonterminals_dir = self.nonterminals_dir(lang_suffix.value)
+        symbols_stage = f"nonterm_symbols_{lang_suffix.value}"
+        symbols_hash = (
+            cache.hash_stage(symbols_stage)
+            .add(lang_hash.hexdigest())
+            .add(sorted(self.fst_context.nonterminals))
+        )
+        symbols_path = nonterminals_dir / "words.txt"
+        nonterminal_stages = [
+            (
+                self._cached_stage(
+                    cache,
+                    symbols_stage,
+                    symbols_hash,
+                    [symbols_path],
+                    partial(self._create_nonterminal_symbols, lang_suffix),
+                    depends_on=[lang_stage],
+                    clean_paths=[nonterminals_dir],
+                ),
+                symbols_hash,
+            )
+        ]
+
+        lang_dir = self.lang_dir(lang_suffix.value)
+        for label, text_fst in sorted(self.fst_context.nonterminals.items()):
+            text_fst_path = get_nonterminal_path(lang_dir, label)
+            nonterminal_stage = (
+                f"nonterm_{lang_suffix.value}_{label[len(NONTERM_PREFIX):]}"
+            )
+            nonterminal_hash = (
+                cache.hash_stage(nonterminal_stage)
+                .add(symbols_hash.hexdigest())
+                .add_text(text_fst)
+            )
+            nonterminal_stages.append(
+                (
+                    self._cached_stage(
+                        cache,
+                        nonterminal_stage,
+                        nonterminal_hash,
+                        [text_fst_path, text_fst_path.with_suffix("")],
+                        partial(
+                            self._compile_nonterminal,
+                            symbols_path,
+                            text_fst_path,
+                            text_fst,
+                        ),
+                        depends_on=[symbols_stage],
+                    ),
+                    nonterminal_hash,
+                )
+            )
+
+        return nonterminal_stages
+
+    def _cached_stage(
+        self,
+        cache: StageCache,
+        stage: str,
+        stage_hash: StageHash,
+        outputs: List[Path],
+        run: Callable[[], Awaitable[Any]],
+        depends_on: Optional[List[str]] = None,
+        clean_paths: Optional[List[Path]] = None,
+    ) -> Stage:
+        return Stage(
+            name=stage,
+            run=partial(
+                self._run_stage,
+                cache,
+                stage,
+                stage_hash,
+                outputs,
+                run,
+                clean_paths=clean_paths,
+            ),
+            depends_on=depends_on or [],
+        )
 
-        if LangSuffix.ARPA_RESCORE in lang_suffixes:
-            await self._create_arpa(LangSuffix.ARPA_RESCORE, order=rescore_order)
+    async def _run_stage(
+        self,
+        cache: StageCache,
+        stage: str,
+        stage_hash: StageHash,
+        outputs: List[Path],
+        run: Callable[[], Awaitable[Any]],
+        clean_paths: Optional[List[Path]] = None,
+    ) -> None:
+        """Run a stage unless its outputs are from the same inputs.
 
-        # 3. mkgraph.sh
-        for lang_suffix in lang_suffixes:
-            if lang_suffix != LangSuffix.ARPA_RESCORE:
-                await self._mkgraph(lang_suffix)
+        Outputs (or clean_paths, if given) are deleted before running.
+        """
+        if cache.is_current(stage, stage_hash, outputs):
+            _LOGGER.debug("Reusing outputs of stage: %s", stage)
+            return
 
-        # 4. prepare_online_decoding.sh
-        for lang_suffix in lang_suffixes:
-            if lang_suffix != LangSuffix.ARPA_RESCORE:
-                await self._prepare_online_decoding(lang_suffix)
+        cache.invalidate(stage)
+        for path in outputs if clean_paths is None else clean_paths:
+            remove_path(path)
+
+        await run()
+        cache.complete(stage, stage_hash)
 
     # -------------------------------------------------------------------------
 
-    async def _create_lexicon(self) -> None:
+    @property
+    def _g2p_model_path(self) -> Path:
+        return self.model_dir.parent / "g2p.fst"
+
+    def _get_lexicon_entries(self) -> Tuple[List[Tuple[str, str]], Set[str]]:
+        """Get (word, phonemes) entries and words with no pronunciation."""
+        lexicon = self.fst_context.lexicon
+        entries: List[Tuple[str, str]] = []
+        missing_words: Set[str] = set()
+        words = sorted(self.fst_context.vocab - {self.unk})
+        word_prons = lexicon.lookup_many(words)
+        for word in words:
+            word_found = False
+            for word_pron in word_prons[word]:
+                entries.append((word, " ".join(word_pron)))
+                word_found = True
+
+            if not word_found:
+                missing_words.add(word)
+
+        return entries, missing_words
+
+    async def _create_lexicon(
+        self, entries: List[Tuple[str, str]], missing_words: Set[str]
+    ) -> None:
         _LOGGER.debug("Generating lexicon")
         dict_local_dir = self.data_local_dir / "dict"
         dict_local_dir.mkdir(parents=True, exist_ok=True)
@@ -160,27 +475,15 @@ class KaldiTrainer:
 
         # Create dictionary
         dictionary_path = dict_local_dir / "lexicon.txt"
-        lexicon = self.fst_context.lexicon
         with open(dictionary_path, "w", encoding="utf-8") as dictionary_file:
-            missing_words = set()
-            for word in sorted(self.fst_context.vocab):
-                if word in (self.unk,):
-                    continue
-
-                word_found = False
-                for word_pron in lexicon.lookup(word):
-                    phonemes_str = " ".join(word_pron)
-                    print(word, phonemes_str, file=dictionary_file)
-                    word_found = True
-
-                if not word_found:
-                    missing_words.add(word)
+            for word, phonemes_str in entries:
+                print(word, phonemes_str, file=dictionary_file)
 
             missing_words_path = self.train_dir / "missing_words_dictionary.txt"
             missing_words_path.unlink(missing_ok=True)
 
             if missing_words:
-                g2p_model_path = self.model_dir.parent / "g2p.fst"
+                g2p_model_path = self._g2p_model_path
                 with tempfile.NamedTemporaryFile(
                     mode="w+", suffix=".txt", encoding="utf-8"
                 ) as missing_words_file, open(
@@ -235,6 +538,16 @@ class KaldiTrainer:
             for label in self.fst_context.meta_labels:
                 print(label, self.sil_phone, file=dictionary_file)
 
+        # prepare_lang.sh writes this if it's missing, which would race between
+        # the prepare_lang stages of each lang type that share dict_local_dir.
+        lexiconp_path = dict_local_dir / "lexiconp.txt"
+        with open(dictionary_path, "r", encoding="utf-8") as dictionary_file, open(
+            lexiconp_path, "w", encoding="utf-8"
+        ) as lexiconp_file:
+            for line in dictionary_file:
+                word, *phonemes = line.split()
+                print(word, "1.0", *phonemes, file=lexiconp_file)
+
     async def _prepare_lang(self, lang_type: LangSuffix) -> None:
         await self.tools.async_run(
             "bash",
@@ -253,29 +566,23 @@ class KaldiTrainer:
     ) -> None:
         lang_dir = self.lang_dir(lang_type.value)
         fst_path = lang_dir / "G.arpa.fst"
-        text_fst_path = fst_path.with_suffix(".fst.txt")
         arpa_path = lang_dir / "lm.arpa"
 
-        with open(text_fst_path, "w", encoding="utf-8") as text_fst_file:
-            self.fst_context.fst_file.seek(0)
-            shutil.copyfileobj(self.fst_context.fst_file, text_fst_file)
+        if self.fst_context.nonterminals:
+            replace_command = await self._get_replace_command(
+                lang_type, keep_symbols=True
+            )
+            await self.tools.async_run(
+                replace_command[0], replace_command[1:] + [str(fst_path)]
+            )
+        else:
+            self._write_binary_fst(fst_path, lang_dir / "words.txt", keep_symbols=True)
 
-        await self.tools.async_run(
-            "fstcompile",
-            [
-                shlex.quote(f"--isymbols={lang_dir}/words.txt"),
-                shlex.quote(f"--osymbols={lang_dir}/words.txt"),
-                "--keep_isymbols=true",
-                "--keep_osymbols=true",
-                shlex.quote(str(text_fst_path)),
-                shlex.quote(str(fst_path)),
-            ],
-        )
         await self.tools.async_run_pipeline(
             [
                 "ngramcount",
                 f"--order={order}",
-                shlex.quote(str(fst_path)),
+                str(fst_path),
                 "-",
             ],
             [
@@ -286,7 +593,7 @@ class KaldiTrainer:
                 "ngramprint",
                 "--ARPA",
                 "-",
-                shlex.quote(str(arpa_path)),
+                str(arpa_path),
             ],
         )
 
@@ -309,102 +616,156 @@ class KaldiTrainer:
         )
 
     async def _create_grammar(self, lang_type: LangSuffix) -> None:
-        fst_file = self.fst_context.fst_file
         lang_dir = self.lang_dir(lang_type.value)
         fst_path = lang_dir / "G.fst"
-        text_fst_path = fst_path.with_suffix(".fst.txt")
 
-        with open(text_fst_path, "w", encoding="utf-8") as text_fst_file:
-            fst_file.seek(0)
-            shutil.copyfileobj(fst_file, text_fst_file)
+        # needed for determinization
+        project_command = ["fstproject", "--project_type=input"]
+        compile_commands: List[List[str]]
+        if self.fst_context.nonterminals:
+            # Outputs the FST with nonterminals replaced
+            compile_commands = [
+                await self._get_replace_command(lang_type, keep_symbols=False),
+                project_command,
+            ]
+        else:
+            unprojected_fst_path = lang_dir / "G.unprojected.fst"
+            self._write_binary_fst(
+                unprojected_fst_path, lang_dir / "words.txt", keep_symbols=False
+            )
+            compile_commands = [project_command + [str(unprojected_fst_path)]]
 
         await self.tools.async_run_pipeline(
-            [
-                "fstcompile",
-                shlex.quote(f"--isymbols={lang_dir}/words.txt"),
-                shlex.quote(f"--osymbols={lang_dir}/words.txt"),
-                "--keep_isymbols=false",
-                "--keep_osymbols=false",
-                "--keep_state_numbering=true",
-                shlex.quote(str(text_fst_path)),
-                "-",
-            ],
-            ["fstproject", "--project_type=input"],  # needed for determinization
+            *compile_commands,
             ["fstdeterminize"],
             ["fstminimize"],
             [
                 "fstarcsort",
                 "--sort_type=ilabel",
                 "-",
-                shlex.quote(str(fst_path)),
+                str(fst_path),
             ],
         )
 
-    async def _create_fuzzy_fst(
-        self, lang_type: LangSuffix, self_loops: bool = True
+    def _write_binary_fst(
+        self, fst_path: Path, symbols_path: Path, keep_symbols: bool
     ) -> None:
+        """Write the intent FST in OpenFST's binary format (instead of fstcompile).
+
+        If keep_symbols is set, the symbol table is stored in the FST too.
+        """
+        fst = self.fst_context.fst
+        if fst is None:
+            raise ValueError("FST context has no FST to write")
+
+        with open(symbols_path, "r", encoding="utf-8") as symbols_file:
+            symbol_ids = read_symbols(symbols_file)
+
+        with open(fst_path, "wb") as fst_file:
+            fst.write_binary(
+                fst_file,
+                symbol_ids,
+                symbols_name=str(symbols_path) if keep_symbols else None,
+            )
+
+    async def _create_nonterminal_symbols(self, lang_type: LangSuffix) -> None:
+        """Write words.txt with ids for nonterminal labels added."""
         lang_dir = self.lang_dir(lang_type.value)
-        fst_path = lang_dir / f"G.{lang_type.value}.fst"
-        if not fst_path.exists():
-            fst_path = lang_dir / "G.fst"
-
-        text_fst_path = fst_path.with_suffix(".fst.txt")
-
-        # Create a version of the FST with self loops that allow skipping words
-        fuzzy_fst_path = lang_dir / "G.fuzzy.fst"
-        text_fuzzy_fst_path = fuzzy_fst_path.with_suffix(".fst.txt")
-        _LOGGER.debug("Creating fuzzy FST at %s", fuzzy_fst_path)
-
-        states: Set[str] = set()
-
-        # Copy transitions and add self loops
-        with open(text_fst_path, "r", encoding="utf-8") as text_fst_file, open(
-            text_fuzzy_fst_path, "w", encoding="utf-8"
-        ) as text_fuzzy_fst_file:
-            for line in text_fst_file:
-                line = line.strip()
-                if not line:
-                    continue
+        nonterminals_dir = self.nonterminals_dir(lang_type.value)
+        nonterminals_dir.mkdir(parents=True, exist_ok=True)
 
-                # Copy transition
-                print(line, file=text_fuzzy_fst_file)
+        words_text = (lang_dir / "words.txt").read_text(encoding="utf-8")
+        max_id = max(
+            (int(line.split()[1]) for line in words_text.splitlines() if line.strip()),
+            default=0,
+        )
 
-                state = line.split(maxsplit=1)[0]
-                if state in states:
-                    continue
+        with open(
+            nonterminals_dir / "words.txt", "w", encoding="utf-8"
+        ) as symbols_file:
+            symbols_file.write(words_text)
+            for label_id, label in enumerate(
+                [ROOT_NONTERMINAL] + sorted(self.fst_context.nonterminals),
+                start=max_id + 1,
+            ):
+                print(label, label_id, file=symbols_file)
+
+    async def _compile_nonterminal(
+        self, symbols_path: Path, text_fst_path: Path, text_fst: str
+    ) -> None:
+        text_fst_path.write_text(text_fst, encoding="utf-8")
+        await self.tools.async_run(
+            "fstcompile",
+            [
+                f"--isymbols={symbols_path}",
+                f"--osymbols={symbols_path}",
+                "--keep_isymbols=false",
+                "--keep_osymbols=false",
+                str(text_fst_path),
+                str(text_fst_path.with_suffix("")),
+            ],
+        )
 
-                states.add(state)
+    async def _get_replace_command(
+        self, lang_type: LangSuffix, keep_symbols: bool
+    ) -> List[str]:
+        """Write the top-level FST and get the fstreplace command for it.
 
-            # Create self loops
-            for state in states:
-                # No penalty for <eps>
-                print(state, state, self.eps, self.eps, 0.0, file=text_fuzzy_fst_file)
+        The command writes to stdout unless an output path is added.
+        """
+        lang_dir = self.lang_dir(lang_type.value)
+        nonterminals_dir = self.nonterminals_dir(lang_type.value)
+        symbols_path = nonterminals_dir / "words.txt"
+        root_fst_path = nonterminals_dir / "root.fst"
+        self._write_binary_fst(root_fst_path, symbols_path, keep_symbols=keep_symbols)
+
+        label_ids: Dict[str, str] = {}
+        with open(symbols_path, "r", encoding="utf-8") as symbols_file:
+            for line in symbols_file:
+                if line.startswith(NONTERM_PREFIX):
+                    label, label_id = line.split()
+                    label_ids[label] = label_id
+
+        command = [
+            "fstreplace",
+            "--epsilon_on_replace",
+            str(root_fst_path),
+            label_ids[ROOT_NONTERMINAL],
+        ]
+        for label in sorted(self.fst_context.nonterminals):
+            command.extend(
+                [
+                    str(get_nonterminal_path(lang_dir, label).with_suffix("")),
+                    label_ids[label],
+                ]
+            )
+
+        return command
+
+    async def _create_fuzzy_fst(self, lang_type: LangSuffix) -> None:
+        """Write the text FST and word deletion costs for fuzzy matching.
+
+        Deletions are the same on every state, so they are written once
+        instead of as a self loop per state and word.
+        """
+        lang_dir = self.lang_dir(lang_type.value)
+        text_fuzzy_fst_path = lang_dir / FUZZY_FST_FILENAME
+        _LOGGER.debug("Creating fuzzy FST at %s", text_fuzzy_fst_path)
 
-                for word in self.fst_context.vocab:
-                    if word[0] in ("<", "_"):
-                        # Skip meta words
-                        continue
+        with open(text_fuzzy_fst_path, "w", encoding="utf-8") as text_fuzzy_fst_file:
+            self.fst_context.fst_file.seek(0)
+            shutil.copyfileobj(self.fst_context.fst_file, text_fuzzy_fst_file)
 
-                    # Penalty for word removal
-                    print(state, state, word, self.eps, 1.0, file=text_fuzzy_fst_file)
+        with open(
+            lang_dir / DELETIONS_FILENAME, "w", encoding="utf-8"
+        ) as deletions_file:
+            for word in sorted(self.fst_context.vocab):
+                if word[0] in ("<", "_"):
+                    # Skip meta words
+                    continue
 
-        await self.tools.async_run_pipeline(
-            [
-                "fstcompile",
-                shlex.quote(f"--isymbols={lang_dir}/words.txt"),
-                shlex.quote(f"--osymbols={lang_dir}/words.txt"),
-                "--keep_isymbols=true",
-                "--keep_osymbols=true",
-                shlex.quote(str(text_fuzzy_fst_path)),
-                "-",
-            ],
-            [
-                "fstarcsort",
-                "--sort_type=ilabel",
-                "-",
-                shlex.quote(str(fuzzy_fst_path)),
-            ],
-        )
+                # Penalty for word removal
+                print(word, 1.0, file=deletions_file)
 
     async def _mkgraph(self, lang_type: LangSuffix) -> None:
         lang_dir = self.lang_dir(lang_type.value)
@@ -450,3 +811,52 @@ class KaldiTrainer:
             ],
             cwd=self.train_dir,
         )
+
+
+# -----------------------------------------------------------------------------
+
+
+def get_phi_label(lang_dir: Union[str, Path]) -> int:
+    """Get id for #0 disambiguation state from words.txt."""
+    lang_dir = Path(lang_dir)
+    with open(lang_dir / "words.txt", "r", encoding="utf-8") as words_file:
+        for line in words_file:
+            if line.startswith("#0 "):
+                return int(line.strip().split(maxsplit=1)[1])
+
+    raise ValueError("No value for disambiguation state (#0)")
+
+
+async def create_ldet_fst(lang_dir: Union[str, Path], tools: KaldiTools) -> int:
+    """Create Ldet.fst for lattice rescoring and save the phi label id."""
+    lang_dir = Path(lang_dir)
+    phi = get_phi_label(lang_dir)
+
+    await tools.async_run_pipeline(
+        ["fstprint", str(lang_dir / "L_disambig.fst")],
+        ["awk", f"{{if($4 != {phi}){{print;}}}}"],
+        ["fstcompile"],
+        ["fstdeterminizestar"],
+        [
+            "fstrmsymbols",
+            str(lang_dir / "phones" / "disambig.int"),
+            "-",
+            str(lang_dir / "Ldet.fst"),
+        ],
+    )
+
+    (lang_dir / PHI_FILENAME).write_text(f"{phi}\n", encoding="utf-8")
+
+    return phi
+
+
+async def load_ldet_fst(lang_dir: Union[str, Path], tools: KaldiTools) -> int:
+    """Get the phi label id for Ldet.fst, creating it if training didn't."""
+    lang_dir = Path(lang_dir)
+    phi_path = lang_dir / PHI_FILENAME
+    if phi_path.exists() and (lang_dir / "Ldet.fst").exists():
+        return int(phi_path.read_text(encoding="utf-8").strip())
+
+    # Trained before Ldet.fst was created at training time
+    _LOGGER.debug("Creating Ldet.fst in %s", lang_dir)
+    return await create_ldet_fst(lang_dir, tools)
@@ -0,0 +1,412 @@
+"""Read Kaldi lattices and extract n-best paths."""
+
+import heapq
+import itertools
+import math
+import os
+import struct
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+FST_MAGIC = 2125659606
+BINARY_MARKER = b"\0B"
+
+ARC_TYPE_COMPACT_LATTICE = "compactlattice44"
+ARC_TYPE_LATTICE = "lattice4"
+
+_INT32 = struct.Struct("<i")
+_INT64 = struct.Struct("<q")
+_FLOAT2 = struct.Struct("<ff")
+_ARC_LABELS = struct.Struct("<ii")
+_HEADER_TAIL = struct.Struct("<iiQqqq")  # version, flags, props, start, states, arcs
+
+# path -> (mtime_ns, id -> word)
+_SYMBOL_TABLES: Dict[Path, Tuple[int, Dict[int, str]]] = {}
+
+
+@dataclass
+class LatticeArc:
+    word_id: int
+    next_state: int
+    graph_cost: float
+    acoustic_cost: float
+
+
+@dataclass
+class Lattice:
+    """Word lattice with (graph, acoustic) costs.
+
+    Compact lattices are word acceptors; for regular lattices the output
+    label is used. Transition ids are not kept.
+    """
+
+    start: int = -1
+    arcs: List[List[LatticeArc]] = field(default_factory=list)
+
+    # state -> (graph cost, acoustic cost)
+    final_costs: Dict[int, Tuple[float, float]] = field(default_factory=dict)
+
+    def add_state(self) -> int:
+        self.arcs.append([])
+        return len(self.arcs) - 1
+
+    def nbest(self, n: int = 1, acoustic_scale: float = 1.0) -> List["LatticePath"]:
+        """Get the n lowest-cost paths through the lattice.
+
+        Like lattice-to-nbest, cost is graph cost plus acoustic cost scaled by
+        acoustic_scale. Returned costs are unscaled.
+        """
+        if (n < 1) or (self.start < 0) or (not self.final_costs):
+            return []
+
+        def scaled(graph_cost: float, acoustic_cost: float) -> float:
+            return graph_cost + (acoustic_scale * acoustic_cost)
+
+        # Exact cost from each state to the end, used as A* heuristic
+        distance = [math.inf] * len(self.arcs)
+        for state in reversed(self._topological_order()):
+            best = math.inf
+            final_cost = self.final_costs.get(state)
+            if final_cost is not None:
+                best = scaled(*final_cost)
+
+            for arc in self.arcs[state]:
+                best = min(
+                    best,
+                    scaled(arc.graph_cost, arc.acoustic_cost)
+                    + distance[arc.next_state],
+                )
+
+            distance[state] = best
+
+        if math.isinf(distance[self.start]):
+            return []
+
+        paths: List[LatticePath] = []
+        counter = itertools.count()
+
+        # (total estimate, tie breaker, state, is_final, words, graph, acoustic)
+        queue: List[Tuple[float, int, int, bool, Tuple[int, ...], float, float]] = [
+            (distance[self.start], next(counter), self.start, False, (), 0.0, 0.0)
+        ]
+        while queue and (len(paths) < n):
+            _, _, state, is_final, words, graph_cost, acoustic_cost = heapq.heappop(
+                queue
+            )
+            if is_final:
+                paths.append(LatticePath(list(words), graph_cost, acoustic_cost))
+                continue
+
+            final_cost = self.final_costs.get(state)
+            if final_cost is not None:
+                final_graph = graph_cost + final_cost[0]
+                final_acoustic = acoustic_cost + final_cost[1]
+                heapq.heappush(
+                    queue,
+                    (
+                        scaled(final_graph, final_acoustic),
+                        next(counter),
+                        state,
+                        True,
+                        words,
+                        final_graph,
+                        final_acoustic,
+                    ),
+                )
+
+            for arc in self.arcs[state]:
+                next_distance = distance[arc.next_state]
+                if math.isinf(next_distance):
+                    # Dead end
+                    continue
+
+                next_graph = graph_cost + arc.graph_cost
+                next_acoustic = acoustic_cost + arc.acoustic_cost
+                heapq.heappush(
+                    queue,
+                    (
+                        scaled(next_graph, next_acoustic) + next_distance,
+                        next(counter),
+                        arc.next_state,
+                        False,
+                        (words + (arc.word_id,)) if arc.word_id != 0 else words,
+                        next_graph,
+                        next_acoustic,
+                    ),
+                )
+
+        return paths
+
+    def _topological_order(self) -> List[int]:
+        order: List[int] = []
+        visited = [0] * len(self.arcs)  # 0 = new, 1 = in progress, 2 = done
+        for root in range(len(self.arcs)):
+            if visited[root]:
+                continue
+
+            visited[root] = 1
+            stack: List[Tuple[int, Iterator[LatticeArc]]] = [
+                (root, iter(self.arcs[root]))
+            ]
+            while stack:
+                state, arc_iter = stack[-1]
+                arc = next(arc_iter, None)
+                if arc is None:
+                    stack.pop()
+                    visited[state] = 2
+                    order.append(state)
+                    continue
+
+                if visited[arc.next_state] == 1:
+                    raise ValueError("Lattice is not acyclic")
+
+                if visited[arc.next_state] == 0:
+                    visited[arc.next_state] = 1
+                    stack.append((arc.next_state, iter(self.arcs[arc.next_state])))
+
+        order.reverse()
+        return order
+
+
+@dataclass
+class LatticePath:
+    word_ids: List[int]
+    graph_cost: float
+    acoustic_cost: float
+
+    def cost(self, acoustic_scale: float = 1.0) -> float:
+        return self.graph_cost + (acoustic_scale * self.acoustic_cost)
+
+
+# -----------------------------------------------------------------------------
+
+
+def read_lattices(data: bytes) -> List[Tuple[str, Lattice]]:
+    """Read all lattices from a Kaldi archive (text or binary)."""
+    lattices: List[Tuple[str, Lattice]] = []
+    offset = 0
+    while True:
+        offset = _skip_whitespace(data, offset)
+        if offset >= len(data):
+            break
+
+        key, lattice, offset = read_lattice(data, offset)
+        lattices.append((key, lattice))
+
+    return lattices
+
+
+def read_lattice(data: bytes, offset: int = 0) -> Tuple[str, Lattice, int]:
+    """Read one (key, lattice) entry from a Kaldi archive.
+
+    Returns the offset just past the entry. Raises EOFError if data ends
+    before the entry is complete, so callers can wait for more bytes.
+    """
+    offset = _skip_whitespace(data, offset)
+    key_end = offset
+    while (key_end < len(data)) and (not data[key_end : key_end + 1].isspace()):
+        key_end += 1
+
+    if key_end >= len(data):
+        raise EOFError()
+
+    key = data[offset:key_end].decode("utf-8")
+    offset = key_end
+    if data[offset : offset + 1] == b" ":
+        # Single space after key
+        offset += 1
+
+    if len(data) < offset + len(BINARY_MARKER):
+        raise EOFError()
+
+    if data[offset : offset + len(BINARY_MARKER)] == BINARY_MARKER:
+        lattice, offset = _read_binary(data, offset + len(BINARY_MARKER))
+    else:
+        lattice, offset = _read_text(data, offset)
+
+    return key, lattice, offset
+
+
+def lattice_nbest(
+    data: bytes, n: int = 1, acoustic_scale: float = 1.0
+) -> List[LatticePath]:
+    """Get n-best paths of the first lattice in a Kaldi archive."""
+    lattices = read_lattices(data)
+    if not lattices:
+        return []
+
+    _key, lattice = lattices[0]
+    return lattice.nbest(n, acoustic_scale=acoustic_scale)
+
+
+def load_symbol_table(words_txt: Union[str, Path]) -> Dict[int, str]:
+    """Load id -> word mapping from words.txt (cached until the file changes)."""
+    words_txt = Path(words_txt).absolute()
+    mtime_ns = os.stat(words_txt).st_mtime_ns
+    cached = _SYMBOL_TABLES.get(words_txt)
+    if (cached is not None) and (cached[0] == mtime_ns):
+        return cached[1]
+
+    symbols: Dict[int, str] = {}
+    with open(words_txt, "r", encoding="utf-8") as words_file:
+        for line in words_file:
+            parts = line.split()
+            if len(parts) != 2:
+                continue
+
+            symbols[int(parts[1])] = parts[0]
+
+    _SYMBOL_TABLES[words_txt] = (mtime_ns, symbols)
+    return symbols
+
+
+def ids_to_words(word_ids: List[int], symbols: Dict[int, str]) -> List[str]:
+    return [symbols[word_id] for word_id in word_ids]
+
+
+# -----------------------------------------------------------------------------
+
+
+def _skip_whitespace(data: bytes, offset: int) -> int:
+    while (offset < len(data)) and data[offset : offset + 1].isspace():
+        offset += 1
+
+    return offset
+
+
+def _unpack(fmt: struct.Struct, data: bytes, offset: int) -> Tuple[tuple, int]:
+    end = offset + fmt.size
+    if end > len(data):
+        raise EOFError()
+
+    return fmt.unpack_from(data, offset), end
+
+
+def _read_string(data: bytes, offset: int) -> Tuple[str, int]:
+    (length,), offset = _unpack(_INT32, data, offset)
+    end = offset + length
+    if end > len(data):
+        raise EOFError()
+
+    return data[offset:end].decode("utf-8"), end
+
+
+def _read_binary(data: bytes, offset: int) -> Tuple[Lattice, int]:
+    (magic,), offset = _unpack(_INT32, data, offset)
+    if magic != FST_MAGIC:
+        raise ValueError(f"Not an FST (magic={magic})")
+
+    _fst_type, offset = _read_string(data, offset)
+    arc_type, offset = _read_string(data, offset)
+    if arc_type == ARC_TYPE_COMPACT_LATTICE:
+        is_compact = True
+    elif arc_type == ARC_TYPE_LATTICE:
+        is_compact = False
+    else:
+        raise ValueError(f"Unsupported arc type: {arc_type}")
+
+    (_version, flags, _props, start, num_states, _num_arcs), offset = _unpack(
+        _HEADER_TAIL, data, offset
+    )
+    if flags & 0x3:
+        # Lattices don't carry symbol tables
+        raise ValueError("FSTs with symbol tables are not supported")
+
+    def read_weight(offset: int) -> Tuple[float, float, int]:
+        (graph_cost, acoustic_cost), offset = _unpack(_FLOAT2, data, offset)
+        if is_compact:
+            # Skip transition ids
+            (num_ids,), offset = _unpack(_INT32, data, offset)
+            offset += num_ids * _INT32.size
+            if offset > len(data):
+                raise EOFError()
+
+        return graph_cost, acoustic_cost, offset
+
+    lattice = Lattice(start=start)
+    for state in range(num_states):
+        lattice.add_state()
+        final_graph, final_acoustic, offset = read_weight(offset)
+        if not math.isinf(final_graph):
+            lattice.final_costs[state] = (final_graph, final_acoustic)
+
+        (num_arcs,), offset = _unpack(_INT64, data, offset)
+        state_arcs = lattice.arcs[state]
+        for _ in range(num_arcs):
+            (_ilabel, olabel), offset = _unpack(_ARC_LABELS, data, offset)
+            graph_cost, acoustic_cost, offset = read_weight(offset)
+            (next_state,), offset = _unpack(_INT32, data, offset)
+            state_arcs.append(LatticeArc(olabel, next_state, graph_cost, acoustic_cost))
+
+    return lattice, offset
+
+
+def _read_text(data: bytes, offset: int) -> Tuple[Lattice, int]:
+    # Rest of key line
+    line_end = data.find(b"\n", offset)
+    if line_end < 0:
+        raise EOFError()
+
+    offset = line_end + 1
+    lines: List[List[str]] = []
+    while True:
+        line_end = data.find(b"\n", offset)
+        if line_end < 0:
+            raise EOFError()
+
+        line = data[offset:line_end].decode("utf-8").strip()
+        offset = line_end + 1
+        if not line:
+            # Empty line ends lattice
+            break
+
+        lines.append(line.split())
+
+    lattice = Lattice()
+
+    def ensure_state(state: int) -> None:
+        while len(lattice.arcs) <= state:
+            lattice.add_state()
+
+    for parts in lines:
+        from_state = int(parts[0])
+        ensure_state(from_state)
+        if lattice.start < 0:
+            # First state printed is the start state
+            lattice.start = from_state
+
+        if len(parts) <= 2:
+            # Final state with optional weight
+            weight = _parse_text_weight(parts[1] if len(parts) > 1 else None)
+            lattice.final_costs[from_state] = weight
+            continue
+
+        to_state = int(parts[1])
+        ensure_state(to_state)
+        if len(parts) == 3:
+            # Acceptor with weight One
+            word_id, weight_str = int(parts[2]), None
+        elif "," in parts[3]:
+            # Acceptor (compact lattice)
+            word_id, weight_str = int(parts[2]), parts[3]
+        else:
+            # Transducer (lattice): input, output, [weight]
+            word_id = int(parts[3])
+            weight_str = parts[4] if len(parts) > 4 else None
+
+        graph_cost, acoustic_cost = _parse_text_weight(weight_str)
+        lattice.arcs[from_state].append(
+            LatticeArc(word_id, to_state, graph_cost, acoustic_cost)
+        )
+
+    return lattice, offset
+
+
+def _parse_text_weight(weight_str: Optional[str]) -> Tuple[float, float]:
+    if not weight_str:
+        return (0.0, 0.0)
+
+    # graph,acoustic[,transition_ids]
+    parts = weight_str.split(",")
+    return (float(parts[0]), float(parts[1]))
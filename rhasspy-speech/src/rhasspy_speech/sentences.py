@@ -23,6 +23,8 @@ from hassil.intents import SlotList, TextSlotList, TextSlotValue
 from hassil.util import normalize_whitespace
 from unicode_rbnf import RbnfEngine
 
+from .hassil_fst import get_number_words
+
 _LOGGER = logging.getLogger()
 
 
@@ -65,10 +67,7 @@ def generate_sentences(
             slot_step = int(slot_range.get("step", 1))
             for i in range(slot_from, slot_to + 1, slot_step):
                 # Use all available words for a number (all genders, cases, etc.)
-                format_result = number_engine.format_number(i)
-                number_strs = {
-                    s.replace("-", " ") for s in format_result.text_by_ruleset.values()
-                }
+                number_strs = get_number_words(number_engine, i)
                 slot_list_values.extend(
                     (
                         TextSlotValue(
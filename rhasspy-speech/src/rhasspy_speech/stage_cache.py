@@ -0,0 +1,156 @@
+"""Manifest of training stages and hashes of their inputs."""
+
+import hashlib
+import json
+import logging
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterable, TextIO, Union
+
+_LOGGER = logging.getLogger(__name__)
+
+MANIFEST_NAME = "stages.json"
+
+_HASH_BLOCK_BYTES = 1024 * 1024
+
+
+class StageHash:
+    """Hash of everything that a stage's outputs depend on."""
+
+    def __init__(self, cache: "StageCache", stage: str) -> None:
+        self._cache = cache
+        self._hash = hashlib.sha256()
+        self.add(stage)
+
+    def add(self, *values: Any) -> "StageHash":
+        """Add values with a stable JSON representation."""
+        for value in values:
+            self._hash.update(json.dumps(value, sort_keys=True).encode("utf-8"))
+            self._hash.update(b"\n")
+
+        return self
+
+    def add_text(self, text: str) -> "StageHash":
+        self._hash.update(text.encode("utf-8"))
+        self._hash.update(b"\n")
+        return self
+
+    def add_text_file(self, text_file: TextIO) -> "StageHash":
+        """Add contents of a text file from the start, without reading it all."""
+        text_file.seek(0)
+        while chunk := text_file.read(_HASH_BLOCK_BYTES):
+            self._hash.update(chunk.encode("utf-8"))
+
+        self._hash.update(b"\n")
+        return self
+
+    def add_files(self, *paths: Union[str, Path]) -> "StageHash":
+        """Add file contents (recursively for directories)."""
+        for path in paths:
+            path = Path(path)
+            if path.is_dir():
+                self.add_files(*sorted(p for p in path.iterdir()))
+                continue
+
+            self.add(str(path), self._cache.hash_file(path))
+
+        return self
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class StageCache:
+    """Tracks which stages in a training directory are up to date.
+
+    A stage is reused if the hash of its inputs matches the one recorded when
+    it last completed and its outputs still exist.
+    """
+
+    def __init__(self, train_dir: Union[str, Path]) -> None:
+        self.manifest_path = Path(train_dir) / MANIFEST_NAME
+
+        # stage -> input hash
+        self._stages: Dict[str, str] = {}
+
+        # path -> [size, mtime_ns, content hash]
+        self._files: Dict[str, Any] = {}
+
+        if self.manifest_path.exists():
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as manifest_file:
+                    manifest = json.load(manifest_file)
+
+                self._stages = manifest.get("stages", {})
+                self._files = manifest.get("files", {})
+            except (OSError, ValueError):
+                _LOGGER.warning("Ignoring invalid manifest: %s", self.manifest_path)
+
+    def hash_stage(self, stage: str) -> StageHash:
+        return StageHash(self, stage)
+
+    def hash_file(self, path: Union[str, Path]) -> str:
+        """Content hash of a file, or empty if it doesn't exist.
+
+        Hashes are remembered by size and modification time, so large model
+        files are only read once.
+        """
+        path = Path(path).absolute()
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return ""
+
+        cached = self._files.get(str(path))
+        if cached and (cached[0] == stat.st_size) and (cached[1] == stat.st_mtime_ns):
+            return cached[2]
+
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as hash_file:
+            while chunk := hash_file.read(_HASH_BLOCK_BYTES):
+                file_hash.update(chunk)
+
+        content_hash = file_hash.hexdigest()
+        self._files[str(path)] = [stat.st_size, stat.st_mtime_ns, content_hash]
+        return content_hash
+
+    def is_current(
+        self, stage: str, stage_hash: StageHash, outputs: Iterable[Path]
+    ) -> bool:
+        return (self._stages.get(stage) == stage_hash.hexdigest()) and all(
+            output.exists() for output in outputs
+        )
+
+    def invalidate(self, stage: str) -> None:
+        """Forget a stage before its outputs are changed."""
+        if self._stages.pop(stage, None) is not None:
+            self.save()
+
+    def complete(self, stage: str, stage_hash: StageHash) -> None:
+        self._stages[stage] = stage_hash.hexdigest()
+        self.save()
+
+    def clear(self) -> None:
+        self._stages.clear()
+        self.save()
+
+    def save(self) -> None:
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.manifest_path.with_suffix(".json.tmp")
+        with open(temp_path, "w", encoding="utf-8") as manifest_file:
+            json.dump(
+                {"stages": self._stages, "files": self._files},
+                manifest_file,
+                indent=2,
+                sort_keys=True,
+            )
+
+        temp_path.replace(self.manifest_path)
+
+
+def remove_path(path: Path) -> None:
+    """Remove a file or directory if it exists."""
+    if path.is_dir() and (not path.is_symlink()):
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
@@ -0,0 +1,102 @@
+"""Runs training stages concurrently once their dependencies are done."""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable[[], Awaitable[Any]]
+
+    # Names of stages that must finish first
+    depends_on: List[str] = field(default_factory=list)
+
+
+async def run_stages(stages: Iterable[Stage], max_parallel: int = 1) -> None:
+    """Run stages in dependency order, at most max_parallel at a time.
+
+    If a stage fails, the other stages are cancelled and the error is raised.
+    """
+    stages_by_name: Dict[str, Stage] = {}
+    for stage in stages:
+        if stage.name in stages_by_name:
+            raise ValueError(f"Duplicate stage: {stage.name}")
+
+        stages_by_name[stage.name] = stage
+
+    _check_dependencies(stages_by_name)
+
+    semaphore = asyncio.Semaphore(max(1, max_parallel))
+    tasks: Dict[str, "asyncio.Task[None]"] = {}
+
+    async def run_stage(stage: Stage) -> None:
+        await asyncio.gather(*(tasks[name] for name in stage.depends_on))
+        async with semaphore:
+            _LOGGER.debug("Running stage: %s", stage.name)
+            await stage.run()
+
+    # Dependencies are created first, so their tasks exist for dependents
+    for stage_name in _get_order(stages_by_name):
+        tasks[stage_name] = asyncio.create_task(
+            run_stage(stages_by_name[stage_name]), name=stage_name
+        )
+
+    try:
+        # First error from any stage
+        error: Optional[BaseException] = None
+        pending: Set["asyncio.Task[None]"] = set(tasks.values())
+        while pending and (error is None):
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_EXCEPTION
+            )
+            for task in done:
+                if (error is None) and (not task.cancelled()):
+                    error = task.exception()
+
+        if error is not None:
+            raise error
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+
+def _check_dependencies(stages_by_name: Dict[str, Stage]) -> None:
+    for stage in stages_by_name.values():
+        for name in stage.depends_on:
+            if name not in stages_by_name:
+                raise ValueError(f"Stage {stage.name} depends on missing stage {name}")
+
+
+def _get_order(stages_by_name: Dict[str, Stage]) -> List[str]:
+    """Stage names with dependencies before dependents."""
+    order: List[str] = []
+    visited: Set[str] = set()
+    visiting: Set[str] = set()
+
+    def visit(name: str) -> None:
+        if name in visited:
+            return
+
+        if name in visiting:
+            raise ValueError(f"Dependency cycle at stage: {name}")
+
+        visiting.add(name)
+        for dependency in stages_by_name[name].depends_on:
+            visit(dependency)
+
+        visiting.remove(name)
+        visited.add(name)
+        order.append(name)
+
+    for name in stages_by_name:
+        visit(name)
+
+    return order
@@ -0,0 +1,133 @@
+"""Timing and resource usage of external tool runs."""
+
+import json
+import logging
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, TextIO, Union
+
+_LOGGER = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of wall time histogram buckets
+WALL_TIME_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, float("inf"))
+
+
+@dataclass
+class ProcessStats:
+    """Cost of a single tool run."""
+
+    program: str
+    command: str
+    wall_seconds: float
+    spawn_seconds: float
+    user_seconds: float
+    system_seconds: float
+
+    # Largest resident set size of the process or any of its children.
+    # None if it wasn't above our own peak RSS when the process started, since
+    # the kernel reports the parent's peak for a child that used less.
+    max_rss_kb: Optional[int]
+
+    returncode: int
+
+    # Unix timestamp
+    start_time: float
+
+
+@dataclass
+class ProgramStats:
+    """Aggregated costs of all runs of a program."""
+
+    count: int = 0
+    failures: int = 0
+    total_wall_seconds: float = 0.0
+    total_spawn_seconds: float = 0.0
+    total_user_seconds: float = 0.0
+    total_system_seconds: float = 0.0
+    max_wall_seconds: float = 0.0
+
+    # Largest known max_rss_kb of all runs (None if no run's RSS was known)
+    max_rss_kb: Optional[int] = None
+    wall_histogram: List[int] = field(
+        default_factory=lambda: [0 for _ in WALL_TIME_BUCKETS]
+    )
+
+    def add(self, stats: ProcessStats) -> None:
+        self.count += 1
+        if stats.returncode != 0:
+            self.failures += 1
+
+        self.total_wall_seconds += stats.wall_seconds
+        self.total_spawn_seconds += stats.spawn_seconds
+        self.total_user_seconds += stats.user_seconds
+        self.total_system_seconds += stats.system_seconds
+        self.max_wall_seconds = max(self.max_wall_seconds, stats.wall_seconds)
+        if stats.max_rss_kb is not None:
+            self.max_rss_kb = max(self.max_rss_kb or 0, stats.max_rss_kb)
+
+        for bucket_idx, max_seconds in enumerate(WALL_TIME_BUCKETS):
+            if stats.wall_seconds <= max_seconds:
+                self.wall_histogram[bucket_idx] += 1
+                break
+
+    def to_dict(self) -> Dict[str, Any]:
+        stats = asdict(self)
+        stats["wall_histogram"] = {
+            f"le_{max_seconds}": bucket_count
+            for max_seconds, bucket_count in zip(WALL_TIME_BUCKETS, self.wall_histogram)
+        }
+        stats["average_wall_seconds"] = (
+            self.total_wall_seconds / self.count if self.count > 0 else 0.0
+        )
+
+        return stats
+
+
+class ToolStats:
+    """Collects stats for tool runs, optionally tracing each run to JSONL."""
+
+    def __init__(self, trace_path: Optional[Union[str, Path]] = None) -> None:
+        self.trace_path = Path(trace_path) if trace_path else None
+        self._programs: Dict[str, ProgramStats] = {}
+        self._trace_file: Optional[TextIO] = None
+
+    def add(self, stats: ProcessStats) -> None:
+        self._programs.setdefault(stats.program, ProgramStats()).add(stats)
+        _LOGGER.debug(
+            "%s: wall=%0.3fs, user=%0.3fs, sys=%0.3fs, max_rss_kb=%s",
+            stats.program,
+            stats.wall_seconds,
+            stats.user_seconds,
+            stats.system_seconds,
+            stats.max_rss_kb,
+        )
+
+        if self.trace_path is None:
+            return
+
+        try:
+            if self._trace_file is None:
+                self.trace_path.parent.mkdir(parents=True, exist_ok=True)
+                self._trace_file = open(  # pylint: disable=consider-using-with
+                    self.trace_path, "a", encoding="utf-8"
+                )
+
+            print(json.dumps(asdict(stats)), file=self._trace_file, flush=True)
+        except OSError:
+            _LOGGER.exception("Failed to write tool trace: %s", self.trace_path)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get aggregated stats for each program.
+
+        max_rss_kb is None for programs that never used more memory than this
+        process (see ProcessStats).
+        """
+        return {
+            program: program_stats.to_dict()
+            for program, program_stats in list(self._programs.items())
+        }
+
+    def close(self) -> None:
+        if self._trace_file is not None:
+            self._trace_file.close()
+            self._trace_file = None
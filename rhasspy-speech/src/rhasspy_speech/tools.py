@@ -1,10 +1,16 @@
 import asyncio
 import logging
 import os
+import resource
 import shlex
-from dataclasses import dataclass
+import signal
+import subprocess
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import IO, Any, Dict, List, Optional, Tuple, Union
+
+from .tool_stats import ProcessStats, ToolStats
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -16,15 +22,19 @@ class KaldiTools:
     opengrm_dir: Path
     phonetisaurus_bin: Path
     _extended_env: Optional[Dict[str, Any]] = None
+    stats: ToolStats = field(default_factory=ToolStats)
 
     @staticmethod
-    def from_tools_dir(tools_dir: Union[str, Path]) -> "KaldiTools":
+    def from_tools_dir(
+        tools_dir: Union[str, Path], trace_path: Optional[Union[str, Path]] = None
+    ) -> "KaldiTools":
         tools_dir = Path(tools_dir).absolute()
         return KaldiTools(
             kaldi_dir=tools_dir / "kaldi",
             openfst_dir=tools_dir / "openfst",
             opengrm_dir=tools_dir / "opengrm",
             phonetisaurus_bin=tools_dir / "phonetisaurus",
+            stats=ToolStats(trace_path=trace_path),
         )
 
     @property
@@ -63,22 +73,28 @@ class KaldiTools:
 
         return self._extended_env
 
-    async def async_run(self, program: str, args: List[str], **kwargs):
+    async def async_run(
+        self, program: str, args: List[str], input: Optional[bytes] = None, **kwargs
+    ):
         if "env" not in kwargs:
             kwargs["env"] = self.extended_env
 
         if "stderr" not in kwargs:
             kwargs["stderr"] = asyncio.subprocess.PIPE
 
+        if input is not None:
+            kwargs["stdin"] = asyncio.subprocess.PIPE
+
         _LOGGER.debug("%s %s", program, args)
-        proc = await asyncio.create_subprocess_exec(
-            program,
-            *args,
-            stdout=asyncio.subprocess.PIPE,
-            **kwargs,
+        program_name = Path(program).name
+        if (program_name in ("bash", "sh")) and args:
+            # Name scripts by their file (e.g., mkgraph.sh)
+            program_name = Path(args[0]).name
+
+        returncode, stdout, stderr = await self._communicate(
+            program_name, [program, *args], input=input, **kwargs
         )
-        stdout, stderr = await proc.communicate()
-        if proc.returncode != 0:
+        if returncode != 0:
             error_text = f"Unexpected error running command {program} {args}"
             if stderr:
                 error_text += f": {stderr.decode()}"
@@ -97,13 +113,11 @@ class KaldiTools:
             kwargs["stderr"] = asyncio.subprocess.PIPE
 
         _LOGGER.debug(cmd)
-        proc = await asyncio.create_subprocess_shell(
-            cmd,
-            stdout=asyncio.subprocess.PIPE,
-            **kwargs,
+        cmd_words = cmd.split(maxsplit=1)
+        returncode, stdout, stderr = await self._communicate(
+            Path(cmd_words[0]).name if cmd_words else "sh", cmd, shell=True, **kwargs
         )
-        stdout, stderr = await proc.communicate()
-        if proc.returncode != 0:
+        if returncode != 0:
             error_text = f"Unexpected error running command {cmd}"
             if stderr:
                 error_text += f": {stderr.decode()}"
@@ -117,6 +131,11 @@ class KaldiTools:
     async def async_run_pipeline(
         self, *commands: List[str], input: Optional[bytes] = None, **kwargs
     ) -> bytes:
+        """Run commands with each one's stdout connected to the next one's stdin.
+
+        Commands are executed directly (no shell), so arguments must not be
+        quoted.
+        """
         if "env" not in kwargs:
             kwargs["env"] = self.extended_env
 
@@ -126,22 +145,255 @@ class KaldiTools:
         if input is not None:
             kwargs["stdin"] = asyncio.subprocess.PIPE
 
-        command_str = " | ".join((shlex.join(c) for c in commands))
-        _LOGGER.debug(command_str)
+        _LOGGER.debug(" | ".join((shlex.join(c) for c in commands)))
 
-        proc = await asyncio.create_subprocess_shell(
-            command_str,
-            stdout=asyncio.subprocess.PIPE,
+        returncodes, stdout, stderrs = await self._run_stages(
+            [(Path(command[0]).name, command) for command in commands],
+            input=input,
             **kwargs,
         )
-        stdout, stderr = await proc.communicate(input=input)
-        if proc.returncode != 0:
-            error_text = f"Unexpected error running command {command_str}"
-            if stderr:
-                error_text += f": {stderr.decode()}"
+        failed_idx = _get_failed_stage(returncodes)
+        if failed_idx is not None:
+            error_text = (
+                f"Unexpected error running command {shlex.join(commands[failed_idx])} "
+                f"(exit code {returncodes[failed_idx]})"
+            )
+            if stderrs[failed_idx]:
+                error_text += f": {stderrs[failed_idx].decode()}"
             elif stdout:
                 error_text += f": {stdout.decode()}"
 
             raise RuntimeError(error_text)
 
         return stdout
+
+    async def _communicate(
+        self,
+        program_name: str,
+        command: Union[str, List[str]],
+        input: Optional[bytes] = None,
+        **kwargs,
+    ) -> Tuple[int, bytes, bytes]:
+        """Run a single process to completion."""
+        returncodes, stdout, stderrs = await self._run_stages(
+            [(program_name, command)], input=input, **kwargs
+        )
+        return returncodes[0], stdout, stderrs[0]
+
+    async def _run_stages(
+        self,
+        stages: List[Tuple[str, Union[str, List[str]]]],
+        input: Optional[bytes] = None,
+        stdin: Any = None,
+        **kwargs,
+    ) -> Tuple[List[int], bytes, List[bytes]]:
+        """Run (program name, command) stages connected by pipes.
+
+        Returns the exit codes, stdout of the last stage, and stderr of each.
+
+        All stages are put in a new process group, which is killed if the run
+        is cancelled. Processes are reaped with wait4 so their CPU time and
+        peak memory (including children, such as a shell's) are recorded.
+        """
+        loop = asyncio.get_running_loop()
+        start_timestamp = time.time()
+        procs: List[subprocess.Popen] = []
+        start_times: List[float] = []
+        spawn_seconds: List[float] = []
+
+        # Our peak RSS once each process was started (see _get_max_rss_kb)
+        parent_rss_kb: List[int] = []
+        end_times: Dict[int, float] = {}
+
+        # Read end of the previous stage's stdout
+        pipe_read_fd: Optional[int] = None
+
+        async def wait_proc(proc: subprocess.Popen) -> Any:
+            status, rusage = await _wait4(proc.pid)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            end_times[proc.pid] = time.monotonic()
+            return rusage
+
+        try:
+            for stage_idx, (_, command) in enumerate(stages):
+                is_last_stage = stage_idx == (len(stages) - 1)
+                stage_stdin = stdin if stage_idx == 0 else pipe_read_fd
+                pipe_read_fd = None
+                if is_last_stage:
+                    stage_stdout: Any = subprocess.PIPE
+                else:
+                    pipe_read_fd, stage_stdout = os.pipe()
+
+                start_times.append(time.monotonic())
+                try:
+                    # Popen uses vfork here, so launch cost doesn't grow with
+                    # our memory use (a forkserver-style spawn helper measured slower)
+                    procs.append(
+                        subprocess.Popen(  # pylint: disable=consider-using-with
+                            command,
+                            stdin=stage_stdin,
+                            stdout=stage_stdout,
+                            process_group=procs[0].pid if procs else 0,
+                            **kwargs,
+                        )
+                    )
+                finally:
+                    # Child processes have their own copies
+                    if stage_idx > 0:
+                        os.close(stage_stdin)
+
+                    if not is_last_stage:
+                        os.close(stage_stdout)
+
+                spawn_seconds.append(time.monotonic() - start_times[-1])
+                parent_rss_kb.append(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+            if procs[0].stdin is not None:
+                input_future = loop.run_in_executor(
+                    None, _write_input, procs[0].stdin, input or bytes()
+                )
+            else:
+                input_future = loop.create_future()
+                input_future.set_result(None)
+
+            stdout, *stderrs = await asyncio.gather(
+                _read_pipe(procs[-1].stdout),
+                *(_read_pipe(proc.stderr) for proc in procs),
+            )
+            await input_future
+            rusages = await asyncio.gather(*(wait_proc(proc) for proc in procs))
+        except BaseException:
+            if pipe_read_fd is not None:
+                # Failed to start the next stage
+                os.close(pipe_read_fd)
+
+            _kill_group(procs)
+            raise
+
+        for stage_idx, ((program_name, command), proc, rusage) in enumerate(
+            zip(stages, procs, rusages)
+        ):
+            self.stats.add(
+                ProcessStats(
+                    program=program_name,
+                    command=(
+                        command if isinstance(command, str) else shlex.join(command)
+                    ),
+                    wall_seconds=end_times[proc.pid] - start_times[stage_idx],
+                    spawn_seconds=spawn_seconds[stage_idx],
+                    user_seconds=rusage.ru_utime,
+                    system_seconds=rusage.ru_stime,
+                    max_rss_kb=_get_max_rss_kb(
+                        rusage.ru_maxrss, parent_rss_kb[stage_idx]
+                    ),
+                    returncode=proc.returncode,
+                    start_time=start_timestamp,
+                )
+            )
+
+        return [proc.returncode for proc in procs], stdout, stderrs
+
+
+# -----------------------------------------------------------------------------
+
+
+async def _read_pipe(pipe: Optional[IO[bytes]]) -> bytes:
+    if pipe is None:
+        return bytes()
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe
+    )
+    try:
+        return await reader.read()
+    finally:
+        transport.close()
+
+
+def _write_input(stdin: IO[bytes], input: bytes) -> None:
+    try:
+        stdin.write(input)
+        stdin.close()
+    except BrokenPipeError:
+        # Process exited without reading all of its input
+        pass
+
+
+async def _wait4(pid: int) -> Tuple[int, Any]:
+    """Wait for a process to exit and get (status, rusage)."""
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        # No pidfd support, so block a thread instead
+        _, status, rusage = await loop.run_in_executor(None, os.wait4, pid, 0)
+        return status, rusage
+
+    try:
+        exited: "asyncio.Future[None]" = loop.create_future()
+
+        def set_exited() -> None:
+            if not exited.done():
+                exited.set_result(None)
+
+        loop.add_reader(pidfd, set_exited)
+        try:
+            await exited
+        finally:
+            loop.remove_reader(pidfd)
+    finally:
+        os.close(pidfd)
+
+    _, status, rusage = os.wait4(pid, 0)
+    return status, rusage
+
+
+def _kill_group(procs: List[subprocess.Popen]) -> None:
+    """Kill a process group and reap its processes in the background."""
+    if not procs:
+        return
+
+    try:
+        os.killpg(procs[0].pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+    loop = asyncio.get_running_loop()
+    for proc in procs:
+        if proc.returncode is None:
+            loop.run_in_executor(None, _reap, proc.pid)
+            proc.returncode = -signal.SIGKILL
+
+
+def _reap(pid: int) -> None:
+    try:
+        os.waitpid(pid, 0)
+    except ChildProcessError:
+        pass
+
+
+def _get_max_rss_kb(child_rss_kb: int, parent_rss_kb: int) -> Optional[int]:
+    """Peak RSS of a child process, or None if it's unknown.
+
+    Linux carries the parent's peak RSS over to the child when it execs, so a
+    child reports max(parent peak, its own peak). Only values above our own
+    peak when the child was started are the child's.
+    """
+    if child_rss_kb > parent_rss_kb:
+        return child_rss_kb
+
+    return None
+
+
+def _get_failed_stage(returncodes: List[int]) -> Optional[int]:
+    """Index of the first failed stage, or None if all succeeded.
+
+    Stages killed by SIGPIPE are ignored, since a later stage stopped reading.
+    """
+    for stage_idx, returncode in enumerate(returncodes):
+        if returncode not in (0, -signal.SIGPIPE):
+            return stage_idx
+
+    return None
@@ -1,8 +1,8 @@
 """Methods to train a custom Kaldi model."""
 
-import io
 import json
 import os
+import tempfile
 from collections.abc import Collection
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Union
@@ -26,8 +26,14 @@ async def train_model(
     words: Optional[Dict[str, Union[str, List[str]]]] = None,
     lang_suffixes: Optional[Collection[LangSuffix]] = None,
     rescore_order: Optional[int] = None,
+    max_parallel_stages: Optional[int] = None,
+    dynamic_lists: Optional[Collection[str]] = None,
 ):
-    """Train a model on YAML sentences."""
+    """Train a model on YAML sentences.
+
+    Lists in dynamic_lists are compiled separately from the sentences, so
+    changing their values only recompiles them (Kaldi models only).
+    """
     model_config: Dict[str, Any] = {}
     model_config_path = os.path.join(model_dir, "config.json")
     if os.path.exists(model_config_path):
@@ -52,13 +58,15 @@ async def train_model(
         # coqui
         lexicon = LexiconDatabase()
 
-    with io.StringIO() as fst_file:
+    # Text FST is kept on disk instead of in memory
+    with tempfile.TemporaryFile(mode="w+", encoding="utf-8") as fst_file:
         fst_context = intents_to_fst(
             intents=intents,
             fst_file=fst_file,
             lexicon=lexicon,
             number_language=language,
             word_casing=word_casing,
+            nonterminal_lists=dynamic_lists if model_type == "kaldi" else None,
         )
 
         if model_type == "kaldi":
@@ -81,6 +89,9 @@ async def train_model(
             if rescore_order is not None:
                 train_args["rescore_order"] = rescore_order
 
+            if max_parallel_stages is not None:
+                train_args["max_parallel_stages"] = max_parallel_stages
+
             await trainer.train(lang_suffixes=lang_suffixes, **train_args)
         else:
             # coqui
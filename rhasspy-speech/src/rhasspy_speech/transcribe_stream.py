@@ -2,16 +2,24 @@
 
 import asyncio
 import logging
-import shlex
-import tempfile
-from collections.abc import AsyncIterable
+import re
+from collections.abc import AsyncIterable, Callable
 from pathlib import Path
 from typing import List, Optional, Union
 
+from .decoder_pool import KaldiDecoderPool, KaldiDecoderProcess
 from .hassil_fst import decode_meta
+from .kaldi import load_ldet_fst
+from .lattice import ids_to_words, lattice_nbest, load_symbol_table
 from .tools import KaldiTools
 from .transcribe_util import get_fuzzy_text
 
+# Called with the decoder's current best path while audio is streaming
+PartialCallback = Callable[[str], None]
+
+# 100 ms of 16kHz 16-bit mono audio
+AUDIO_WRITE_BYTES = 3200
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -25,6 +33,7 @@ class KaldiNnet3StreamTranscriber:
         lattice_beam: float = 8.0,
         acoustic_scale: float = 1.0,
         beam: float = 24.0,
+        decoder_pool: Optional[KaldiDecoderPool] = None,
     ):
         self.model_dir = Path(model_dir)
         self.graph_dir = Path(graph_dir)
@@ -35,6 +44,75 @@ class KaldiNnet3StreamTranscriber:
         self.acoustic_scale = acoustic_scale
         self.beam = beam
 
+        self.decoder_pool = decoder_pool
+
+    async def _start_decoder(self) -> KaldiDecoderProcess:
+        model_file = self.model_dir / "model" / "model" / "final.mdl"
+        hclg_fst = self.graph_dir / "HCLG.fst"
+        words_txt = self.graph_dir / "words.txt"
+        online_conf = self.model_dir / "model" / "online" / "conf" / "online.conf"
+
+        program = "online2-cli-nnet3-decode-faster"
+        args = [
+            f"--config={online_conf}",
+            f"--max-active={self.max_active}",
+            f"--lattice-beam={self.lattice_beam}",
+            "--acoustic-scale=1.0",
+            f"--beam={self.beam}",
+            str(model_file),
+            str(hclg_fst),
+            str(words_txt),
+        ]
+        watch_paths = (model_file, hclg_fst, words_txt)
+
+        if self.decoder_pool is not None:
+            # Model and graph are already loaded
+            return await self.decoder_pool.acquire(program, args, watch_paths)
+
+        return await KaldiDecoderProcess.start(self.tools, program, args, watch_paths)
+
+    async def _decode_stream(
+        self,
+        decoder: KaldiDecoderProcess,
+        audio_stream: AsyncIterable[Optional[bytes]],
+        partial_callback: Optional[PartialCallback] = None,
+    ) -> bytes:
+        """Stream audio into decoder and return its lattice archive."""
+        proc = decoder.proc
+        assert proc.stdin is not None
+        assert proc.stdout is not None
+
+        # Read partial results and lattice while audio is still being decoded
+        partials_task = asyncio.create_task(
+            _read_partials(proc.stdout, partial_callback)
+        )
+        lattice_task = asyncio.create_task(decoder.read_lattice())
+        try:
+            audio_buffer = bytes()
+            async for chunk in audio_stream:
+                if not chunk:
+                    continue
+
+                audio_buffer += chunk
+                if len(audio_buffer) >= AUDIO_WRITE_BYTES:
+                    proc.stdin.write(audio_buffer)
+                    audio_buffer = bytes()
+                    await proc.stdin.drain()
+
+            if audio_buffer:
+                proc.stdin.write(audio_buffer)
+
+            _LOGGER.debug("Stream ended")
+            proc.stdin.write_eof()
+            lattice_bytes = await lattice_task
+            await partials_task
+            await proc.wait()
+
+            return lattice_bytes
+        finally:
+            partials_task.cancel()
+            lattice_task.cancel()
+
     async def async_transcribe(
         self,
         audio_stream: AsyncIterable[Optional[bytes]],
@@ -42,74 +120,31 @@ class KaldiNnet3StreamTranscriber:
         nbest: int = 1,
         max_fuzzy_cost: Optional[float] = None,
         require_fuzzy: bool = False,
+        partial_callback: Optional[PartialCallback] = None,
     ) -> List[str]:
         lang_dir = Path(lang_dir)
-        model_file = self.model_dir / "model" / "model" / "final.mdl"
         words_txt = self.graph_dir / "words.txt"
-        online_conf = self.model_dir / "model" / "online" / "conf" / "online.conf"
 
-        with tempfile.NamedTemporaryFile("wb+") as lattice_file:
-            lattice_path = lattice_file.name
-            program = "online2-cli-nnet3-decode-faster"
-            args = [
-                f"--config={online_conf}",
-                f"--max-active={self.max_active}",
-                f"--lattice-beam={self.lattice_beam}",
-                "--acoustic-scale=1.0",
-                f"--beam={self.beam}",
-                str(model_file),
-                str(self.graph_dir / "HCLG.fst"),
-                str(words_txt),
-                f"ark:{lattice_path}",
-            ]
-            _LOGGER.debug("%s %s", program, args)
-            proc = await asyncio.create_subprocess_exec(
-                program,
-                *args,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                env=self.tools.extended_env,
+        decoder = await self._start_decoder()
+        try:
+            lattice_bytes = await self._decode_stream(
+                decoder, audio_stream, partial_callback
             )
-            assert proc.stdin is not None
-            assert proc.stdout is not None
-
-            async for chunk in audio_stream:
-                proc.stdin.write(chunk)
-                await proc.stdin.drain()
-
-            _LOGGER.debug("Stream ended")
-            proc.stdin.write_eof()
-            await proc.communicate()
 
             # Transcripts
-            nbest_stdout = await self.tools.async_run_pipeline(
-                [
-                    "lattice-to-nbest",
-                    f"--n={nbest}",
-                    f"--acoustic-scale={self.acoustic_scale}",
-                    f"ark:{lattice_path}",
-                    "ark:-",
-                ],
-                [
-                    "nbest-to-linear",
-                    "ark:-",
-                    "ark:/dev/null",  # alignments
-                    "ark,t:-",  # transcriptions
-                ],
+            nbest_paths = lattice_nbest(
+                lattice_bytes, nbest, acoustic_scale=self.acoustic_scale
             )
 
-            int2sym_stdout = await self.tools.async_run_pipeline(
-                [
-                    str(self.tools.egs_utils_dir / "int2sym.pl"),
-                    "-f",
-                    "2-",
-                    str(words_txt),
-                ],
-                input=nbest_stdout,
-            )
-            _LOGGER.debug("nbest: %s", int2sym_stdout.decode(encoding="utf-8"))
+            symbols = load_symbol_table(words_txt)
+            nbest_texts = [
+                " ".join(ids_to_words(path.word_ids, symbols)) for path in nbest_paths
+            ]
+            _LOGGER.debug("nbest: %s", nbest_texts)
 
-            fuzzy_result = await get_fuzzy_text(nbest_stdout, lang_dir, self.tools)
+            fuzzy_result = get_fuzzy_text(
+                [path.word_ids for path in nbest_paths], Path(lang_dir)
+            )
             if fuzzy_result is not None:
                 text, cost = fuzzy_result
                 _LOGGER.debug("Fuzzy cost: %s", cost)
@@ -119,14 +154,9 @@ class KaldiNnet3StreamTranscriber:
             if require_fuzzy:
                 return []
 
-            texts: List[str] = []
-            for line in int2sym_stdout.decode().splitlines():
-                if line.startswith("utt-"):
-                    parts = line.strip().split(maxsplit=1)
-                    if len(parts) > 1:
-                        texts.append(decode_meta(parts[1]))
-
-            return texts
+            return [decode_meta(text) for text in nbest_texts if text]
+        finally:
+            decoder.close()
 
     async def async_transcribe_rescore(
         self,
@@ -136,74 +166,24 @@ class KaldiNnet3StreamTranscriber:
         nbest: int = 1,
         max_fuzzy_cost: Optional[float] = None,
         require_fuzzy: bool = False,
+        partial_callback: Optional[PartialCallback] = None,
     ) -> List[str]:
         old_lang_dir = Path(old_lang_dir)
         new_lang_dir = Path(new_lang_dir)
 
-        # Get id for #0 disambiguation state
-        phi: Optional[int] = None
-        with open(str(new_lang_dir / "words.txt"), "r", encoding="utf-8") as words_file:
-            for line in words_file:
-                if line.startswith("#0 "):
-                    phi = int(line.strip().split(maxsplit=1)[1])
-                    break
-
-        if phi is None:
-            raise ValueError("No value for disambiguation state (#0)")
-
-        # Create Ldet.fst
-        await self.tools.async_run_pipeline(
-            ["fstprint", str(new_lang_dir / "L_disambig.fst")],
-            ["awk", f"{{if($4 != {phi}){{print;}}}}"],
-            ["fstcompile"],
-            ["fstdeterminizestar"],
-            [
-                "fstrmsymbols",
-                str(new_lang_dir / "phones" / "disambig.int"),
-                "-",
-                shlex.quote(str(new_lang_dir / "Ldet.fst")),
-            ],
-        )
+        # Ldet.fst is created during training
+        phi = await load_ldet_fst(new_lang_dir, self.tools)
 
         model_file = self.model_dir / "model" / "model" / "final.mdl"
-        words_txt = self.graph_dir / "words.txt"
-        online_conf = self.model_dir / "model" / "online" / "conf" / "online.conf"
 
-        with tempfile.NamedTemporaryFile("wb+") as lattice_file:
-            lattice_path = lattice_file.name
-            program = "online2-cli-nnet3-decode-faster"
-            args = [
-                f"--config={online_conf}",
-                f"--max-active={self.max_active}",
-                f"--lattice-beam={self.lattice_beam}",
-                "--acoustic-scale=1.0",
-                f"--beam={self.beam}",
-                str(model_file),
-                str(self.graph_dir / "HCLG.fst"),
-                str(words_txt),
-                f"ark:{lattice_path}",
-            ]
-            _LOGGER.debug("%s %s", program, args)
-            proc = await asyncio.create_subprocess_exec(
-                program,
-                *args,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                env=self.tools.extended_env,
+        decoder = await self._start_decoder()
+        try:
+            lattice_bytes = await self._decode_stream(
+                decoder, audio_stream, partial_callback
             )
-            assert proc.stdin is not None
-            assert proc.stdout is not None
-
-            async for chunk in audio_stream:
-                proc.stdin.write(chunk)
-                await proc.stdin.drain()
 
-            _LOGGER.debug("Stream ended")
-            proc.stdin.write_eof()
-            await proc.communicate()
-
-            nbest_stdout = await self.tools.async_run_pipeline(
-                ["lattice-scale", "--lm-scale=0.0", f"ark:{lattice_path}", "ark:-"],
+            lattice_stdout = await self.tools.async_run_pipeline(
+                ["lattice-scale", "--lm-scale=0.0", "ark:-", "ark:-"],
                 ["lattice-to-phone-lattice", str(model_file), "ark:-", "ark:-"],
                 [
                     "lattice-compose",
@@ -227,33 +207,21 @@ class KaldiNnet3StreamTranscriber:
                     "ark:-",
                     "ark:-",
                 ],
-                [
-                    "lattice-to-nbest",
-                    f"--n={nbest}",
-                    f"--acoustic-scale={self.acoustic_scale}",
-                    "ark:-",
-                    "ark:-",
-                ],
-                [
-                    "nbest-to-linear",
-                    "ark:-",
-                    "ark:/dev/null",  # alignments
-                    "ark,t:-",  # transcriptions
-                ],
+                input=lattice_bytes,
             )
-
-            int2sym_stdout = await self.tools.async_run_pipeline(
-                [
-                    str(self.tools.egs_utils_dir / "int2sym.pl"),
-                    "-f",
-                    "2-",
-                    str(new_lang_dir / "words.txt"),
-                ],
-                input=nbest_stdout,
+            nbest_paths = lattice_nbest(
+                lattice_stdout, nbest, acoustic_scale=self.acoustic_scale
             )
-            _LOGGER.debug("nbest: %s", int2sym_stdout.decode(encoding="utf-8"))
 
-            fuzzy_result = await get_fuzzy_text(nbest_stdout, old_lang_dir, self.tools)
+            symbols = load_symbol_table(new_lang_dir / "words.txt")
+            nbest_texts = [
+                " ".join(ids_to_words(path.word_ids, symbols)) for path in nbest_paths
+            ]
+            _LOGGER.debug("nbest: %s", nbest_texts)
+
+            fuzzy_result = get_fuzzy_text(
+                [path.word_ids for path in nbest_paths], Path(old_lang_dir)
+            )
             if fuzzy_result is not None:
                 text, cost = fuzzy_result
                 _LOGGER.debug("Fuzzy cost: %s", cost)
@@ -263,12 +231,35 @@ class KaldiNnet3StreamTranscriber:
             if require_fuzzy:
                 return []
 
-            # Gather nbest transcriptions
-            texts: List[str] = []
-            for line in int2sym_stdout.decode().splitlines():
-                if line.startswith("utt-"):
-                    parts = line.strip().split(maxsplit=1)
-                    if len(parts) > 1:
-                        texts.append(decode_meta(parts[1]))
+            return [decode_meta(text) for text in nbest_texts if text]
+        finally:
+            decoder.close()
+
+
+async def _read_partials(
+    stdout: asyncio.StreamReader, partial_callback: Optional[PartialCallback]
+) -> None:
+    """Read best path text lines until the decoder exits.
+
+    Partial results may be separated by carriage returns or newlines.
+    """
+    buffer = bytes()
+    last_text = ""
+    while True:
+        data = await stdout.read(1024)
+        if not data:
+            break
+
+        if partial_callback is None:
+            # Drain output so the decoder doesn't block
+            continue
+
+        buffer += data
+        *lines, buffer = re.split(rb"[\r\n]", buffer)
+        for line in lines:
+            text = line.decode("utf-8", errors="ignore").strip()
+            if (not text) or (text == last_text):
+                continue
 
-            return texts
+            last_text = text
+            partial_callback(text)
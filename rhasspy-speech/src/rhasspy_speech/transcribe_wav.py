@@ -1,11 +1,15 @@
 """Transcribe WAV files."""
 
+import io
 import logging
-import shlex
+import os
+import wave
 from pathlib import Path
 from typing import List, Optional, Union
 
 from .hassil_fst import decode_meta
+from .kaldi import load_ldet_fst
+from .lattice import ids_to_words, lattice_nbest, load_symbol_table
 from .tools import KaldiTools
 from .transcribe_util import get_fuzzy_text
 
@@ -32,60 +36,65 @@ class KaldiNnet3WavTranscriber:
         self.acoustic_scale = acoustic_scale
         self.beam = beam
 
+    def get_decode_args(
+        self,
+        spk2utt_rspecifier: str,
+        wav_rspecifier: str = "ark:-",
+        lattice_wspecifier: str = "ark:-",
+    ) -> List[str]:
+        """Get arguments for online2-wav-nnet3-latgen-faster."""
+        words_txt = self.graph_dir / "words.txt"
+        online_conf = self.model_dir / "model" / "online" / "conf" / "online.conf"
+
+        return [
+            "--online=false",
+            "--do-endpointing=false",
+            f"--word-symbol-table={words_txt}",
+            f"--config={online_conf}",
+            f"--max-active={self.max_active}",
+            f"--lattice-beam={self.lattice_beam}",
+            "--acoustic-scale=1.0",
+            f"--beam={self.beam}",
+            str(self.model_dir / "model" / "model" / "final.mdl"),
+            str(self.graph_dir / "HCLG.fst"),
+            spk2utt_rspecifier,
+            wav_rspecifier,
+            lattice_wspecifier,
+        ]
+
     async def async_transcribe(
         self,
-        wav_path: Union[str, Path],
+        audio: Union[str, Path, bytes],
         lang_dir: Union[str, Path],
         nbest: int = 1,
         max_fuzzy_cost: Optional[float] = None,
         require_fuzzy: bool = False,
     ) -> List[str]:
         words_txt = self.graph_dir / "words.txt"
-        online_conf = self.model_dir / "model" / "online" / "conf" / "online.conf"
-        nbest_stdout = await self.tools.async_run_pipeline(
-            [
+        spk2utt_fd = _get_spk2utt_fd()
+        try:
+            lattice_stdout = await self.tools.async_run(
                 "online2-wav-nnet3-latgen-faster",
-                "--online=false",
-                "--do-endpointing=false",
-                f"--word-symbol-table={words_txt}",
-                f"--config={online_conf}",
-                f"--max-active={self.max_active}",
-                f"--lattice-beam={self.lattice_beam}",
-                "--acoustic-scale=1.0",
-                f"--beam={self.beam}",
-                str(self.model_dir / "model" / "model" / "final.mdl"),
-                str(self.graph_dir / "HCLG.fst"),
-                "ark:echo utt utt|",
-                f"scp:echo utt {wav_path}|",
-                "ark:-",
-            ],
-            [
-                "lattice-to-nbest",
-                f"--n={nbest}",
-                f"--acoustic-scale={self.acoustic_scale}",
-                "ark:-",
-                "ark:-",
-            ],
-            [
-                "nbest-to-linear",
-                "ark:-",
-                "ark:/dev/null",  # alignments
-                "ark,t:-",  # transcriptions
-            ],
+                self.get_decode_args(f"ark:/dev/fd/{spk2utt_fd}"),
+                input=_get_wav_ark(audio),
+                pass_fds=(spk2utt_fd,),
+            )
+        finally:
+            os.close(spk2utt_fd)
+
+        nbest_paths = lattice_nbest(
+            lattice_stdout, nbest, acoustic_scale=self.acoustic_scale
         )
 
-        int2sym_stdout = await self.tools.async_run_pipeline(
-            [
-                str(self.tools.egs_utils_dir / "int2sym.pl"),
-                "-f",
-                "2-",
-                str(words_txt),
-            ],
-            input=nbest_stdout,
-        )
-        _LOGGER.debug("nbest: %s", int2sym_stdout.decode(encoding="utf-8"))
+        symbols = load_symbol_table(words_txt)
+        nbest_texts = [
+            " ".join(ids_to_words(path.word_ids, symbols)) for path in nbest_paths
+        ]
+        _LOGGER.debug("nbest: %s", nbest_texts)
 
-        fuzzy_result = await get_fuzzy_text(nbest_stdout, lang_dir, self.tools)
+        fuzzy_result = get_fuzzy_text(
+            [path.word_ids for path in nbest_paths], Path(lang_dir)
+        )
         if fuzzy_result is not None:
             text, cost = fuzzy_result
             _LOGGER.debug("Fuzzy cost: %s", cost)
@@ -95,18 +104,11 @@ class KaldiNnet3WavTranscriber:
         if require_fuzzy:
             return []
 
-        texts: List[str] = []
-        for line in int2sym_stdout.decode().splitlines():
-            if line.startswith("utt-"):
-                parts = line.strip().split(maxsplit=1)
-                if len(parts) > 1:
-                    texts.append(decode_meta(parts[1]))
-
-        return texts
+        return [decode_meta(text) for text in nbest_texts if text]
 
     async def async_transcribe_rescore(
         self,
-        wav_path: Union[str, Path],
+        audio: Union[str, Path, bytes],
         old_lang_dir: Union[str, Path],
         new_lang_dir: Union[str, Path],
         nbest: int = 1,
@@ -116,103 +118,61 @@ class KaldiNnet3WavTranscriber:
         old_lang_dir = Path(old_lang_dir)
         new_lang_dir = Path(new_lang_dir)
 
-        # Get id for #0 disambiguation state
-        phi: Optional[int] = None
-        with open(str(new_lang_dir / "words.txt"), "r", encoding="utf-8") as words_file:
-            for line in words_file:
-                if line.startswith("#0 "):
-                    phi = int(line.strip().split(maxsplit=1)[1])
-                    break
-
-        if phi is None:
-            raise ValueError("No value for disambiguation state (#0)")
-
-        # Create Ldet.fst
-        await self.tools.async_run_pipeline(
-            ["fstprint", str(new_lang_dir / "L_disambig.fst")],
-            ["awk", f"{{if($4 != {phi}){{print;}}}}"],
-            ["fstcompile"],
-            ["fstdeterminizestar"],
-            [
-                "fstrmsymbols",
-                str(new_lang_dir / "phones" / "disambig.int"),
-                "-",
-                shlex.quote(str(new_lang_dir / "Ldet.fst")),
-            ],
-        )
+        # Ldet.fst is created during training
+        phi = await load_ldet_fst(new_lang_dir, self.tools)
 
         model_file = self.model_dir / "model" / "model" / "final.mdl"
-        words_txt = self.graph_dir / "words.txt"
-        online_conf = self.model_dir / "model" / "online" / "conf" / "online.conf"
 
-        nbest_stdout = await self.tools.async_run_pipeline(
-            [
-                "online2-wav-nnet3-latgen-faster",
-                "--online=false",
-                "--do-endpointing=false",
-                f"--word-symbol-table={words_txt}",
-                f"--config={online_conf}",
-                f"--max-active={self.max_active}",
-                f"--lattice-beam={self.lattice_beam}",
-                "--acoustic-scale=1.0",
-                f"--beam={self.beam}",
-                str(model_file),
-                str(self.graph_dir / "HCLG.fst"),
-                "ark:echo utt utt|",
-                f"scp:echo utt {wav_path}|",
-                "ark:-",
-            ],
-            ["lattice-scale", "--lm-scale=0.0", "ark:-", "ark:-"],
-            ["lattice-to-phone-lattice", str(model_file), "ark:-", "ark:-"],
-            [
-                "lattice-compose",
-                "ark:-",
-                str(new_lang_dir / "Ldet.fst"),
-                "ark:-",
-            ],
-            ["lattice-determinize", "ark:-", "ark:-"],
-            [
-                "lattice-compose",
-                f"--phi-label={phi}",
-                "ark:-",
-                str(new_lang_dir / "G.fst"),
-                "ark:-",
-            ],
-            [
-                "lattice-add-trans-probs",
-                "--transition-scale=1.0",
-                "--self-loop-scale=0.1",
-                str(model_file),
-                "ark:-",
-                "ark:-",
-            ],
-            [
-                "lattice-to-nbest",
-                f"--n={nbest}",
-                f"--acoustic-scale={self.acoustic_scale}",
-                "ark:-",
-                "ark:-",
-            ],
-            [
-                "nbest-to-linear",
-                "ark:-",
-                "ark:/dev/null",  # alignments
-                "ark,t:-",  # transcriptions
-            ],
+        spk2utt_fd = _get_spk2utt_fd()
+        try:
+            lattice_stdout = await self.tools.async_run_pipeline(
+                [
+                    "online2-wav-nnet3-latgen-faster",
+                    *self.get_decode_args(f"ark:/dev/fd/{spk2utt_fd}"),
+                ],
+                ["lattice-scale", "--lm-scale=0.0", "ark:-", "ark:-"],
+                ["lattice-to-phone-lattice", str(model_file), "ark:-", "ark:-"],
+                [
+                    "lattice-compose",
+                    "ark:-",
+                    str(new_lang_dir / "Ldet.fst"),
+                    "ark:-",
+                ],
+                ["lattice-determinize", "ark:-", "ark:-"],
+                [
+                    "lattice-compose",
+                    f"--phi-label={phi}",
+                    "ark:-",
+                    str(new_lang_dir / "G.fst"),
+                    "ark:-",
+                ],
+                [
+                    "lattice-add-trans-probs",
+                    "--transition-scale=1.0",
+                    "--self-loop-scale=0.1",
+                    str(model_file),
+                    "ark:-",
+                    "ark:-",
+                ],
+                input=_get_wav_ark(audio),
+                pass_fds=(spk2utt_fd,),
+            )
+        finally:
+            os.close(spk2utt_fd)
+
+        nbest_paths = lattice_nbest(
+            lattice_stdout, nbest, acoustic_scale=self.acoustic_scale
         )
 
-        int2sym_stdout = await self.tools.async_run_pipeline(
-            [
-                str(self.tools.egs_utils_dir / "int2sym.pl"),
-                "-f",
-                "2-",
-                str(new_lang_dir / "words.txt"),
-            ],
-            input=nbest_stdout,
-        )
-        _LOGGER.debug("nbest: %s", int2sym_stdout.decode(encoding="utf-8"))
+        symbols = load_symbol_table(new_lang_dir / "words.txt")
+        nbest_texts = [
+            " ".join(ids_to_words(path.word_ids, symbols)) for path in nbest_paths
+        ]
+        _LOGGER.debug("nbest: %s", nbest_texts)
 
-        fuzzy_result = await get_fuzzy_text(nbest_stdout, old_lang_dir, self.tools)
+        fuzzy_result = get_fuzzy_text(
+            [path.word_ids for path in nbest_paths], Path(old_lang_dir)
+        )
         if fuzzy_result is not None:
             text, cost = fuzzy_result
             _LOGGER.debug("Fuzzy cost: %s", cost)
@@ -222,14 +182,37 @@ class KaldiNnet3WavTranscriber:
         if require_fuzzy:
             return []
 
-        texts: List[str] = []
-        for line in int2sym_stdout.decode().splitlines():
-            if line.startswith("utt-"):
-                parts = line.strip().split(maxsplit=1)
-                if len(parts) > 1:
-                    texts.append(decode_meta(parts[1]))
+        return [decode_meta(text) for text in nbest_texts if text]
+
+
+def _get_wav_ark(audio: Union[str, Path, bytes]) -> bytes:
+    """Create a single-utterance WAV archive.
+
+    Bytes are 16kHz 16-bit mono PCM. Paths are WAV files.
+    """
+    if isinstance(audio, bytes):
+        with io.BytesIO() as wav_io:
+            wav_writer: wave.Wave_write = wave.open(wav_io, "wb")
+            with wav_writer:
+                wav_writer.setframerate(16000)
+                wav_writer.setsampwidth(2)
+                wav_writer.setnchannels(1)
+                wav_writer.writeframes(audio)
+
+            wav_bytes = wav_io.getvalue()
+    else:
+        wav_bytes = Path(audio).read_bytes()
+
+    return b"utt " + wav_bytes
+
+
+def _get_spk2utt_fd() -> int:
+    """Get a pipe to read spk2utt for a single utterance from."""
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(write_fd, "wb") as spk2utt_file:
+        spk2utt_file.write(b"utt utt\n")
 
-        return texts
+    return read_fd
 
 
 # -----------------------------------------------------------------------------
@@ -3,12 +3,13 @@ import argparse
 import array
 import asyncio
 import logging
+import os
 import shutil
 import tarfile
 import tempfile
 import time
-import wave
 from collections import defaultdict
+from collections.abc import Awaitable
 from functools import partial
 from pathlib import Path
 from threading import Thread
@@ -20,16 +21,19 @@ from pysilero_vad import SileroVoiceActivityDetector
 from pyspeex_noise import AudioProcessor as SpeexAudioProcessor
 from rhasspy_speech.const import LangSuffix
 from rhasspy_speech.coqui_stt import CoquiSttTranscriber
+from rhasspy_speech.decoder_pool import KaldiDecoderPool
 from rhasspy_speech.tools import KaldiTools
 from rhasspy_speech.transcribe_stream import KaldiNnet3StreamTranscriber
 from rhasspy_speech.transcribe_wav import KaldiNnet3WavTranscriber
 from wyoming.asr import Transcribe, Transcript
 from wyoming.audio import AudioChunk, AudioChunkConverter, AudioStart, AudioStop
+from wyoming.error import Error
 from wyoming.event import Event
 from wyoming.info import AsrModel, AsrProgram, Attribution, Describe, Info
 from wyoming.server import AsyncEventHandler, AsyncServer
 
 from .models import MODELS, Model
+from .scheduler import DecodeScheduler
 from .shared import AppSettings, AppState
 from .web_server import get_app, load_responses, train_model, write_exposed
 
@@ -100,6 +104,12 @@ async def main() -> None:
         default=0.7,
         help="Seconds of audio to keep before speech is detected (default: 0.7)",
     )
+    parser.add_argument(
+        "--end-of-speech-seconds",
+        type=float,
+        default=0.0,
+        help="Finish transcript after this many seconds of silence (default: disabled)",
+    )
     # Speex
     parser.add_argument(
         "--speex", action="store_true", help="Enable audio cleaning with Speex"
@@ -125,6 +135,24 @@ async def main() -> None:
     parser.add_argument("--beam", type=float, default=24.0)
     parser.add_argument("--nbest", type=int, default=3)
     parser.add_argument("--streaming", action="store_true")
+    parser.add_argument(
+        "--max-concurrent-decodes",
+        type=int,
+        help="Maximum number of decodes at once per model (default: CPU count)",
+    )
+    parser.add_argument(
+        "--max-decode-queue-seconds",
+        type=float,
+        default=5.0,
+        help="Seconds a decode may wait for a free slot before it's rejected "
+        "(0: reject when all slots are busy, negative: no limit, default: 5)",
+    )
+    parser.add_argument(
+        "--decoder-pool-size",
+        type=int,
+        default=1,
+        help="Number of pre-started decoders per model when streaming (0 to disable)",
+    )
     #
     parser.add_argument(
         "--decode-mode",
@@ -132,6 +160,17 @@ async def main() -> None:
         default="arpa",
     )
     parser.add_argument("--arpa-rescore-order", type=int, default=5)
+    parser.add_argument(
+        "--max-parallel-training-stages",
+        type=int,
+        help="Maximum number of training stages at once (default: CPU count)",
+    )
+    parser.add_argument(
+        "--dynamic-list",
+        action="append",
+        default=[],
+        help="Name of slot list to compile separately, so changes to it retrain faster",
+    )
     #
     parser.add_argument(
         "--auto-train", help="Model id to automatically download and train"
@@ -146,6 +185,10 @@ async def main() -> None:
         help="Set model id for language (e.g., en_US en_US-zamia)",
     )
     #
+    parser.add_argument(
+        "--tool-trace",
+        help="Append timing and resource usage of each tool run to JSONL",
+    )
     parser.add_argument("--debug", action="store_true", help="Log DEBUG messages")
     args = parser.parse_args()
 
@@ -163,6 +206,7 @@ async def main() -> None:
             vad_enabled=(not args.no_vad),
             vad_threshold=args.vad_threshold,
             before_speech_seconds=args.before_speech_seconds,
+            end_of_speech_seconds=args.end_of_speech_seconds,
             # Speex
             speex_enabled=args.speex,
             speex_noise_suppression=args.speex_noise_suppression,
@@ -179,6 +223,9 @@ async def main() -> None:
             #
             decode_mode=LangSuffix(args.decode_mode),
             arpa_rescore_order=args.arpa_rescore_order,
+            # Training
+            max_parallel_training_stages=args.max_parallel_training_stages,
+            dynamic_lists=args.dynamic_list,
             # Home Assistant
             hass_token=args.hass_token,
             hass_websocket_uri=args.hass_websocket_uri,
@@ -187,9 +234,18 @@ async def main() -> None:
             hass_builtin_intents=(not args.no_hass_builtin_intents),
             # Misc
             model_id_for_language=dict(args.model_for_language),
-        )
+        ),
+        tools=KaldiTools.from_tools_dir(args.tools_dir, trace_path=args.tool_trace),
+    )
+
+    state.decode_scheduler = DecodeScheduler(
+        max_concurrent=args.max_concurrent_decodes or os.cpu_count() or 1,
+        max_queue_seconds=args.max_decode_queue_seconds,
     )
 
+    if args.streaming and (args.decoder_pool_size > 0):
+        state.decoder_pool = KaldiDecoderPool(state.tools, size=args.decoder_pool_size)
+
     # Add default models for languages
     for model in MODELS.values():
         if model.language_code not in state.settings.model_id_for_language:
@@ -302,6 +358,11 @@ async def main() -> None:
         await wyoming_server.run(partial(RhasspySpeechEventHandler, args, state))
     except KeyboardInterrupt:
         pass
+    finally:
+        if state.decoder_pool is not None:
+            state.decoder_pool.close()
+
+        state.tools.stats.close()
 
 
 # -----------------------------------------------------------------------------
@@ -329,6 +390,7 @@ class RhasspySpeechEventHandler(AsyncEventHandler):
         self.model_data_dir: Optional[Path] = None
         self.state = state
         self.transcriber: Optional[KaldiNnet3WavTranscriber] = None
+        self.stream_transcriber: Optional[KaldiNnet3StreamTranscriber] = None
         self.transcribe_task: Optional[asyncio.Task] = None
         self.coqui_transcriber: Optional[CoquiSttTranscriber] = None
 
@@ -368,6 +430,12 @@ class RhasspySpeechEventHandler(AsyncEventHandler):
             )
         self.is_speech_started = False
 
+        # End of speech
+        self.end_of_speech_seconds = settings.end_of_speech_seconds
+        self.end_of_speech_buffer = bytes()
+        self.silence_seconds = 0.0
+        self.is_finalized = False
+
         # Speex
         self.speex: Optional[SpeexAudioProcessor] = None
         self.speex_audio_buffer = bytes()
@@ -391,61 +459,29 @@ class RhasspySpeechEventHandler(AsyncEventHandler):
             )
             self.model_data_dir = self.state.settings.model_data_dir(self.model_id)
 
+            # Stream from a previous AudioStart that never stopped
+            self.cancel_stream_decode()
+
             # Empty queue
             self.audio_queue = asyncio.Queue()
 
             if self.coqui_transcriber is not None:
                 await self.coqui_transcriber.start_stream()
             elif self.is_streaming:
-                # Streaming audio
-                transcriber = KaldiNnet3StreamTranscriber(
+                # Decoding starts with the first audio to transcribe
+                self.stream_transcriber = KaldiNnet3StreamTranscriber(
                     model_dir=self.model_data_dir,
                     graph_dir=self.model_train_dir / self.graph_dir_name,
-                    tools=KaldiTools.from_tools_dir(self.state.settings.tools_dir),
+                    tools=self.state.tools,
                     max_active=self.state.settings.max_active,
                     lattice_beam=self.state.settings.lattice_beam,
                     acoustic_scale=self.state.settings.acoustic_scale,
                     beam=self.state.settings.beam,
+                    decoder_pool=self.state.decoder_pool,
                 )
-
-                if self.state.settings.decode_mode == LangSuffix.ARPA_RESCORE:
-                    # Streaming with rescoring
-                    self.transcribe_task = asyncio.create_task(
-                        transcriber.async_transcribe_rescore(
-                            self.audio_stream(),
-                            old_lang_dir=self.model_train_dir / "data" / "lang_arpa",
-                            new_lang_dir=self.model_train_dir
-                            / "data"
-                            / "lang_arpa_rescore",
-                            nbest=self.state.settings.nbest,
-                            max_fuzzy_cost=self.state.settings.max_fuzzy_cost,
-                            require_fuzzy=True,
-                        )
-                    )
-                else:
-                    # Streaming without rescoring
-                    self.transcribe_task = asyncio.create_task(
-                        transcriber.async_transcribe(
-                            self.audio_stream(),
-                            lang_dir=self.model_train_dir
-                            / "data"
-                            / f"lang_{self.state.settings.decode_mode.value}",
-                            nbest=self.state.settings.nbest,
-                            max_fuzzy_cost=self.state.settings.max_fuzzy_cost,
-                            require_fuzzy=True,
-                        )
-                    )
             else:
                 # Non-streaming
-                self.transcriber = KaldiNnet3WavTranscriber(
-                    model_dir=self.model_data_dir,
-                    graph_dir=self.model_train_dir / self.graph_dir_name,
-                    tools=KaldiTools.from_tools_dir(self.state.settings.tools_dir),
-                    max_active=self.state.settings.max_active,
-                    lattice_beam=self.state.settings.lattice_beam,
-                    acoustic_scale=self.state.settings.acoustic_scale,
-                    beam=self.state.settings.beam,
-                )
+                self.transcriber = self.make_wav_transcriber()
 
             if self.vad is not None:
                 # Reset VAD
@@ -458,8 +494,15 @@ class RhasspySpeechEventHandler(AsyncEventHandler):
                 self.speex_audio_buffer = bytes()
 
             self.audio_buffer = bytes()
+            self.end_of_speech_buffer = bytes()
+            self.silence_seconds = 0.0
+            self.is_finalized = False
 
         elif AudioChunk.is_type(event.type):
+            if self.is_finalized:
+                # Transcript was already sent at end of speech
+                return True
+
             chunk = AudioChunk.from_event(event)
             chunk = self.converter.convert(chunk)
 
@@ -491,9 +534,16 @@ class RhasspySpeechEventHandler(AsyncEventHandler):
                     if self.coqui_transcriber is not None:
                         await self.coqui_transcriber.process_chunk(audio_to_transcribe)
                     elif self.is_streaming:
-                        self.audio_queue.put_nowait(audio_to_transcribe)
+                        await self.stream_audio(audio_to_transcribe)
                     else:
                         self.audio_buffer += audio_to_transcribe
+
+                if self.is_end_of_speech(chunk.audio):
+                    _LOGGER.debug(
+                        "End of speech after %s second(s) of silence",
+                        self.silence_seconds,
+                    )
+                    await self.finish_transcript()
             else:
                 # VAD
                 if self.before_speech_buffer is not None:
@@ -518,97 +568,12 @@ class RhasspySpeechEventHandler(AsyncEventHandler):
                     self.vad_buffer = self.vad_buffer[self.vad_bytes_per_chunk :]
 
         elif AudioStop.is_type(event.type):
-            assert self.model_id
-            assert self.model_train_dir is not None
-            assert self.model_data_dir is not None
-
-            start_time = time.monotonic()
-            texts: List[str] = []
-
-            try:
-                if self.coqui_transcriber is not None:
-                    probs = await self.coqui_transcriber.finish_stream()
-                    texts = [
-                        await self.coqui_transcriber.decode_probs(
-                            probs, self.model_train_dir
-                        )
-                    ]
-                elif self.is_streaming:
-                    assert self.transcribe_task is not None
-
-                    # End stream and get transcript(s)
-                    self.audio_queue.put_nowait(None)
-                    texts = await self.transcribe_task
-                else:
-                    assert self.transcriber is not None
-
-                    with tempfile.NamedTemporaryFile("wb+", suffix=".wav") as temp_file:
-                        wav_path = temp_file.name
-                        wav_writer: wave.Wave_write = wave.open(wav_path, "wb")
-                        with wav_writer:
-                            wav_writer.setframerate(16000)
-                            wav_writer.setsampwidth(2)
-                            wav_writer.setnchannels(1)
-                            wav_writer.writeframes(self.audio_buffer)
-
-                        if self.state.settings.decode_mode == LangSuffix.ARPA_RESCORE:
-                            texts = await self.transcriber.async_transcribe_rescore(
-                                wav_path,
-                                old_lang_dir=self.model_train_dir
-                                / "data"
-                                / "lang_arpa",
-                                new_lang_dir=self.model_train_dir
-                                / "data"
-                                / "lang_arpa_rescore",
-                                nbest=self.state.settings.nbest,
-                                max_fuzzy_cost=self.state.settings.max_fuzzy_cost,
-                                require_fuzzy=True,
-                            )
-                        else:
-                            texts = await self.transcriber.async_transcribe(
-                                wav_path,
-                                self.model_train_dir
-                                / "data"
-                                / f"lang_{self.state.settings.decode_mode.value}",
-                                nbest=self.state.settings.nbest,
-                                max_fuzzy_cost=self.state.settings.max_fuzzy_cost,
-                                require_fuzzy=True,
-                            )
-            except Exception:
-                _LOGGER.exception("Unexpected error getting transcripts")
-            finally:
-                self.transcribe_task = None
-                self.transcriber = None
-
-            _LOGGER.debug(
-                "Transcripts for client %s in %s second(s): %s",
-                self.client_id,
-                time.monotonic() - start_time,
-                texts,
-            )
-
-            text = ""
-            if texts:
-                text = texts[0].strip()
-
-            if not text:
-                # Use custom response if available
-                if self.model_id not in self.state.unknown_sentence_responses:
-                    try:
-                        # Reload responses
-                        load_responses(self.state, self.model_id)
-                    except Exception:
-                        _LOGGER.exception("Unexpected error loading responses")
-
-                text = self.state.unknown_sentence_responses.get(self.model_id, "")
-
-            _LOGGER.debug("Final text: %s", text)
-            await self.write_event(Transcript(text=text).event())
-
-            if self.coqui_transcriber is not None:
-                await self.coqui_transcriber.stop()
-                self.coqui_transcriber = None
+            if self.is_finalized:
+                # Transcript was already sent at end of speech
+                _LOGGER.debug("Ignoring audio after end of speech")
+                return True
 
+            await self.finish_transcript()
             return True
         elif Transcribe.is_type(event.type):
             self.model_id, self.model_suffix = None, None
@@ -651,13 +616,240 @@ class RhasspySpeechEventHandler(AsyncEventHandler):
                 self.coqui_transcriber = CoquiSttTranscriber(
                     model_dir=self.state.settings.model_data_dir(self.model_id),
                     exe_path=self.state.settings.tools_dir / "stt_onlyprobs",
-                    tools=KaldiTools.from_tools_dir(self.state.settings.tools_dir),
+                    tools=self.state.tools,
                 )
         else:
             _LOGGER.debug("Unexpected event: type=%s, data=%s", event.type, event.data)
 
         return True
 
+    async def finish_transcript(self) -> None:
+        """Transcribe audio and send transcript to client."""
+        self.is_finalized = True
+
+        assert self.model_id
+        assert self.model_train_dir is not None
+        assert self.model_data_dir is not None
+
+        start_time = time.monotonic()
+        texts: Optional[List[str]] = []
+
+        try:
+            if self.coqui_transcriber is not None:
+                probs = await self.coqui_transcriber.finish_stream()
+                texts = [
+                    await self.coqui_transcriber.decode_probs(
+                        probs, self.model_train_dir
+                    )
+                ]
+            elif self.transcribe_task is not None:
+                # End stream and get transcript(s)
+                self.audio_queue.put_nowait(None)
+                texts = await self.transcribe_task
+            elif self.transcriber is not None:
+                # Raw audio is sent to the decoder over stdin
+                if self.state.settings.decode_mode == LangSuffix.ARPA_RESCORE:
+                    texts = await self.run_decode(
+                        self.transcriber.async_transcribe_rescore(
+                            self.audio_buffer,
+                            old_lang_dir=self.model_train_dir / "data" / "lang_arpa",
+                            new_lang_dir=self.model_train_dir
+                            / "data"
+                            / "lang_arpa_rescore",
+                            nbest=self.state.settings.nbest,
+                            max_fuzzy_cost=self.state.settings.max_fuzzy_cost,
+                            require_fuzzy=True,
+                        )
+                    )
+                else:
+                    texts = await self.run_decode(
+                        self.transcriber.async_transcribe(
+                            self.audio_buffer,
+                            self.model_train_dir
+                            / "data"
+                            / f"lang_{self.state.settings.decode_mode.value}",
+                            nbest=self.state.settings.nbest,
+                            max_fuzzy_cost=self.state.settings.max_fuzzy_cost,
+                            require_fuzzy=True,
+                        )
+                    )
+        except Exception:
+            _LOGGER.exception("Unexpected error getting transcripts")
+        finally:
+            self.transcribe_task = None
+            self.transcriber = None
+            self.stream_transcriber = None
+
+        if texts is None:
+            _LOGGER.warning(
+                "Too many decodes at once for %s, client %s gets no transcript",
+                self.get_model_key(),
+                self.client_id,
+            )
+            await self.write_event(
+                Error(
+                    text="Too many decodes at once, try again later",
+                    code="decode-rejected",
+                ).event()
+            )
+            texts = []
+
+        _LOGGER.debug(
+            "Transcripts for client %s in %s second(s): %s",
+            self.client_id,
+            time.monotonic() - start_time,
+            texts,
+        )
+
+        text = ""
+        if texts:
+            text = texts[0].strip()
+
+        if not text:
+            # Use custom response if available
+            if self.model_id not in self.state.unknown_sentence_responses:
+                try:
+                    # Reload responses
+                    load_responses(self.state, self.model_id)
+                except Exception:
+                    _LOGGER.exception("Unexpected error loading responses")
+
+            text = self.state.unknown_sentence_responses.get(self.model_id, "")
+
+        _LOGGER.debug("Final text: %s", text)
+        await self.write_event(Transcript(text=text).event())
+
+        if self.coqui_transcriber is not None:
+            await self.coqui_transcriber.stop()
+            self.coqui_transcriber = None
+
+    async def run_decode(self, decode: Awaitable[List[str]]) -> Optional[List[str]]:
+        """Run decode when the scheduler admits it.
+
+        Returns None if the decode was rejected.
+        """
+        if self.state.decode_scheduler is None:
+            return await decode
+
+        return await self.state.decode_scheduler.run(self.get_model_key(), decode)
+
+    async def stream_audio(self, audio: bytes) -> None:
+        """Send audio to the streaming decoder, starting it if needed."""
+        if self.stream_transcriber is not None:
+            # First audio of the stream
+            await self.start_stream_decode(self.stream_transcriber)
+            self.stream_transcriber = None
+
+        if self.transcribe_task is not None:
+            self.audio_queue.put_nowait(audio)
+        else:
+            # Decoded after the stream ends
+            self.audio_buffer += audio
+
+    async def start_stream_decode(
+        self, transcriber: KaldiNnet3StreamTranscriber
+    ) -> None:
+        """Start streaming decode if there's a free slot.
+
+        A streaming decode holds its slot until the stream ends, so it doesn't
+        wait for one. Without a free slot, audio is buffered and decoded in the
+        scheduler's queue after the stream ends.
+        """
+        assert self.model_train_dir is not None
+
+        model_key = self.get_model_key()
+        scheduler = self.state.decode_scheduler
+        if (scheduler is not None) and (
+            not await scheduler.acquire(model_key, max_queue_seconds=0)
+        ):
+            _LOGGER.warning(
+                "No free decoder for streaming, decoding after stream ends: %s",
+                model_key,
+            )
+            self.transcriber = self.make_wav_transcriber()
+            return
+
+        if self.state.settings.decode_mode == LangSuffix.ARPA_RESCORE:
+            # Streaming with rescoring
+            decode = transcriber.async_transcribe_rescore(
+                self.audio_stream(),
+                old_lang_dir=self.model_train_dir / "data" / "lang_arpa",
+                new_lang_dir=self.model_train_dir / "data" / "lang_arpa_rescore",
+                nbest=self.state.settings.nbest,
+                max_fuzzy_cost=self.state.settings.max_fuzzy_cost,
+                require_fuzzy=True,
+                partial_callback=self.log_partial_transcript,
+            )
+        else:
+            # Streaming without rescoring
+            decode = transcriber.async_transcribe(
+                self.audio_stream(),
+                lang_dir=self.model_train_dir
+                / "data"
+                / f"lang_{self.state.settings.decode_mode.value}",
+                nbest=self.state.settings.nbest,
+                max_fuzzy_cost=self.state.settings.max_fuzzy_cost,
+                require_fuzzy=True,
+                partial_callback=self.log_partial_transcript,
+            )
+
+        self.transcribe_task = asyncio.create_task(decode)
+        if scheduler is not None:
+            # Also runs if the task is cancelled before it starts
+            self.transcribe_task.add_done_callback(
+                lambda _task: scheduler.release(model_key)
+            )
+
+    def cancel_stream_decode(self) -> None:
+        if self.transcribe_task is not None:
+            self.transcribe_task.cancel()
+            self.transcribe_task = None
+
+    def make_wav_transcriber(self) -> KaldiNnet3WavTranscriber:
+        assert self.model_data_dir is not None
+        assert self.model_train_dir is not None
+
+        return KaldiNnet3WavTranscriber(
+            model_dir=self.model_data_dir,
+            graph_dir=self.model_train_dir / self.graph_dir_name,
+            tools=self.state.tools,
+            max_active=self.state.settings.max_active,
+            lattice_beam=self.state.settings.lattice_beam,
+            acoustic_scale=self.state.settings.acoustic_scale,
+            beam=self.state.settings.beam,
+        )
+
+    def get_model_key(self) -> str:
+        model_key = self.model_id or ""
+        if self.model_suffix:
+            model_key = f"{model_key}/{self.model_suffix}"
+
+        return model_key
+
+    def is_end_of_speech(self, audio: bytes) -> bool:
+        """True if speech has been followed by enough silence."""
+        if (self.vad is None) or (self.end_of_speech_seconds <= 0):
+            return False
+
+        self.end_of_speech_buffer += audio
+        while len(self.end_of_speech_buffer) >= self.vad_bytes_per_chunk:
+            vad_chunk = self.end_of_speech_buffer[: self.vad_bytes_per_chunk]
+            self.end_of_speech_buffer = self.end_of_speech_buffer[
+                self.vad_bytes_per_chunk :
+            ]
+
+            speech_prob = self.vad.process_chunk(vad_chunk)
+            if speech_prob > self.vad_threshold:
+                self.silence_seconds = 0.0
+            else:
+                self.silence_seconds += len(vad_chunk) / (RATE * WIDTH * CHANNELS)
+
+        return self.silence_seconds >= self.end_of_speech_seconds
+
+    def log_partial_transcript(self, text: str) -> None:
+        # Wyoming has no event for partial transcripts yet
+        _LOGGER.debug("Partial transcript for client %s: %s", self.client_id, text)
+
     async def audio_stream(self):
         while True:
             chunk = await self.audio_queue.get()
@@ -667,7 +859,7 @@ class RhasspySpeechEventHandler(AsyncEventHandler):
             yield chunk
 
     async def disconnect(self) -> None:
-        pass
+        self.cancel_stream_decode()
 
     def get_info(self) -> Info:
         # [(model_id, suffix)]
@@ -0,0 +1,137 @@
+"""Admission control for concurrent decodes."""
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional, TypeVar
+
+_LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class DecodeStats:
+    active: int = 0
+    queued: int = 0
+    completed: int = 0
+    rejected: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        stats = asdict(self)
+        admitted = self.completed + self.active
+        stats["average_wait_seconds"] = (
+            self.total_wait_seconds / admitted if admitted > 0 else 0.0
+        )
+
+        return stats
+
+
+class DecodeScheduler:
+    """Limits concurrent decodes per model and queues the rest.
+
+    Decodes that wait longer than max_queue_seconds for a slot are rejected.
+    With 0, decodes are rejected as soon as every slot is busy; with a negative
+    value, they wait as long as it takes.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue_seconds: float) -> None:
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue_seconds = max_queue_seconds
+
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._stats: Dict[str, DecodeStats] = {}
+
+    async def run(self, model_key: str, decode: Awaitable[T]) -> Optional[T]:
+        """Run decode once a slot is free for the model.
+
+        Returns None if the decode was rejected.
+        """
+        try:
+            is_admitted = await self.acquire(model_key)
+        except asyncio.CancelledError:
+            _close_unstarted(decode)
+            raise
+
+        if not is_admitted:
+            _close_unstarted(decode)
+            return None
+
+        try:
+            return await decode
+        finally:
+            self.release(model_key)
+
+    async def acquire(
+        self, model_key: str, max_queue_seconds: Optional[float] = None
+    ) -> bool:
+        """Wait for a decode slot for the model.
+
+        Returns False if the decode was rejected. Call release when an admitted
+        decode is finished.
+        """
+        if max_queue_seconds is None:
+            max_queue_seconds = self.max_queue_seconds
+
+        semaphore = self._semaphores.get(model_key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrent)
+            self._semaphores[model_key] = semaphore
+
+        stats = self._stats.setdefault(model_key, DecodeStats())
+        start_time = time.monotonic()
+
+        if not semaphore.locked():
+            # Free slot (doesn't block)
+            await semaphore.acquire()
+        elif max_queue_seconds == 0:
+            stats.rejected += 1
+            _LOGGER.warning("Rejected decode for %s: no free slot", model_key)
+            return False
+        else:
+            stats.queued += 1
+            try:
+                await asyncio.wait_for(
+                    semaphore.acquire(),
+                    timeout=max_queue_seconds if max_queue_seconds > 0 else None,
+                )
+            except asyncio.TimeoutError:
+                stats.rejected += 1
+                _LOGGER.warning(
+                    "Rejected decode for %s after waiting %s second(s)",
+                    model_key,
+                    max_queue_seconds,
+                )
+                return False
+            finally:
+                stats.queued -= 1
+
+        wait_seconds = time.monotonic() - start_time
+        stats.total_wait_seconds += wait_seconds
+        stats.max_wait_seconds = max(stats.max_wait_seconds, wait_seconds)
+        stats.active += 1
+
+        return True
+
+    def release(self, model_key: str) -> None:
+        """Free the slot of an admitted decode."""
+        stats = self._stats[model_key]
+        stats.active -= 1
+        stats.completed += 1
+        self._semaphores[model_key].release()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get queue depth and wait times for each model."""
+        return {
+            model_key: stats.to_dict() for model_key, stats in list(self._stats.items())
+        }
+
+
+def _close_unstarted(decode: Awaitable[Any]) -> None:
+    if asyncio.iscoroutine(decode):
+        # Avoid "never awaited" warning
+        decode.close()
@@ -4,6 +4,10 @@ from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 from rhasspy_speech.const import LangSuffix
+from rhasspy_speech.decoder_pool import KaldiDecoderPool
+from rhasspy_speech.tools import KaldiTools
+
+from .scheduler import DecodeScheduler
 
 
 @dataclass
@@ -18,6 +22,7 @@ class AppSettings:
     vad_enabled: bool
     vad_threshold: float
     before_speech_seconds: float
+    end_of_speech_seconds: float
 
     # Speex
     speex_enabled: bool
@@ -48,6 +53,10 @@ class AppSettings:
     # Web server
     auto_train_model_id: Optional[str] = None
 
+    # Training
+    max_parallel_training_stages: Optional[int] = None
+    dynamic_lists: List[str] = field(default_factory=list)
+
     # Misc
     model_id_for_language: Dict[str, str] = field(default_factory=dict)
 
@@ -105,6 +114,15 @@ class AppSettings:
 class AppState:
     settings: AppSettings
 
+    # Shared so tool stats are collected in one place
+    tools: KaldiTools
+
     # Responses for unknown sentences
     # model_id -> response
     unknown_sentence_responses: Dict[str, str] = field(default_factory=dict)
+
+    # Warm decoders for streaming transcription
+    decoder_pool: Optional[KaldiDecoderPool] = None
+
+    # Limits concurrent decodes
+    decode_scheduler: Optional[DecodeScheduler] = None
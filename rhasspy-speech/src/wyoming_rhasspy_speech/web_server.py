@@ -20,7 +20,6 @@ from flask import Flask, Response, redirect, render_template, request
 from flask import url_for as flask_url_for
 from rhasspy_speech.const import LangSuffix
 from rhasspy_speech.g2p import LexiconDatabase, get_sounds_like, guess_pronunciations
-from rhasspy_speech.tools import KaldiTools
 from rhasspy_speech.train import train_model as rhasspy_train_model
 from werkzeug.middleware.proxy_fix import ProxyFix
 from yaml import SafeDumper, safe_dump, safe_load
@@ -250,6 +249,18 @@ def get_app(state: AppState) -> Flask:
             await write_exposed(state, hass_exposed_file)
             return hass_exposed_file.getvalue()
 
+    @app.route("/api/decode_stats")
+    def api_decode_stats() -> Dict[str, Any]:
+        if state.decode_scheduler is None:
+            return {}
+
+        return state.decode_scheduler.get_stats()
+
+    @app.route("/api/tool_stats")
+    def api_tool_stats() -> Dict[str, Any]:
+        # max_rss_kb is null for tools that never used more memory than the server
+        return state.tools.stats.get_stats()
+
     @app.route("/words", methods=["GET", "POST"])
     def words():
         model_id = request.args["id"]
@@ -479,9 +490,11 @@ async def train_model(
             model_dir=state.settings.models_dir / model_id,
             train_dir=model_train_dir,
             words=words,
-            tools=KaldiTools.from_tools_dir(state.settings.tools_dir),
+            tools=state.tools,
             lang_suffixes=lang_suffixes,
             rescore_order=state.settings.arpa_rescore_order,
+            max_parallel_stages=state.settings.max_parallel_training_stages,
+            dynamic_lists=state.settings.dynamic_lists,
         )
         _LOGGER.debug(
             "Training completed in %s second(s)", time.monotonic() - start_time
@@ -0,0 +1,212 @@
+"""Round-trip check of Fst.write_binary against the text writer.
+
+The reader below follows OpenFST's VectorFst/SymbolTable binary layout with its
+own constants, so changes to the writer's format constants are caught here.
+"""
+
+import io
+import math
+import struct
+from collections import Counter, defaultdict
+from typing import BinaryIO, Dict, List, Tuple
+
+import pytest
+from hassil.intents import Intents
+
+from rhasspy_speech.hassil_fst import EPS, Fst, intents_to_fst
+
+# From OpenFST (fst.h, vector-fst.h, symbol-table.cc, properties.h)
+OPENFST_FST_MAGIC = 2125659606
+OPENFST_SYMBOL_TABLE_MAGIC = 2125658996
+OPENFST_VECTOR_VERSION = 2
+OPENFST_HAS_ISYMBOLS = 0x1
+OPENFST_HAS_OSYMBOLS = 0x2
+OPENFST_EXPANDED_MUTABLE = 0x3
+
+# (input labels, output labels, rounded weight)
+Path = Tuple[Tuple[str, ...], Tuple[str, ...], float]
+
+# state -> [(to state, input label, output label, weight)]
+Arcs = Dict[int, List[Tuple[int, str, str, float]]]
+
+
+def _read(fst_file: BinaryIO, fmt: str) -> Tuple:
+    return struct.unpack(fmt, fst_file.read(struct.calcsize(fmt)))
+
+
+def _read_string(fst_file: BinaryIO) -> str:
+    (length,) = _read(fst_file, "<i")
+    return fst_file.read(length).decode("utf-8")
+
+
+def _read_symbols(fst_file: BinaryIO) -> Tuple[str, Dict[str, int]]:
+    assert _read(fst_file, "<i")[0] == OPENFST_SYMBOL_TABLE_MAGIC
+    name = _read_string(fst_file)
+    available_key, num_symbols = _read(fst_file, "<qq")
+    symbol_ids = {
+        _read_string(fst_file): _read(fst_file, "<q")[0] for _ in range(num_symbols)
+    }
+    assert available_key == max(symbol_ids.values()) + 1
+
+    return name, symbol_ids
+
+
+def _read_binary(fst_bytes: bytes, symbol_ids: Dict[str, int], symbols_name: str):
+    """Parse a binary FST into (start, arcs, final states)."""
+    fst_file = io.BytesIO(fst_bytes)
+    assert _read(fst_file, "<i")[0] == OPENFST_FST_MAGIC
+    assert _read_string(fst_file) == "vector"
+    assert _read_string(fst_file) == "standard"
+
+    version, flags, properties, start, num_states, num_arcs = _read(fst_file, "<iiQqqq")
+    assert version == OPENFST_VECTOR_VERSION
+    assert flags == OPENFST_HAS_ISYMBOLS | OPENFST_HAS_OSYMBOLS
+    assert properties == OPENFST_EXPANDED_MUTABLE
+
+    # Input and output symbol tables
+    for _ in range(2):
+        assert _read_symbols(fst_file) == (symbols_name, symbol_ids)
+
+    id_to_symbol = {symbol_id: symbol for symbol, symbol_id in symbol_ids.items()}
+    arcs: Arcs = defaultdict(list)
+    final_states = set()
+    total_arcs = 0
+    for state in range(num_states):
+        (final_weight,) = _read(fst_file, "<f")
+        if final_weight != math.inf:
+            assert final_weight == 0.0
+            final_states.add(state)
+
+        (num_state_arcs,) = _read(fst_file, "<q")
+        for _ in range(num_state_arcs):
+            in_id, out_id, weight, to_state = _read(fst_file, "<iifi")
+            assert 0 <= to_state < num_states
+            arcs[state].append(
+                (to_state, id_to_symbol[in_id], id_to_symbol[out_id], weight)
+            )
+
+        total_arcs += num_state_arcs
+
+    assert fst_file.read() == b""
+    assert total_arcs == num_arcs
+
+    return start, arcs, final_states
+
+
+def _read_text(fst_text: str):
+    """Parse a text FST into (start, arcs, final states)."""
+    start = None
+    arcs: Arcs = defaultdict(list)
+    final_states = set()
+    for line in fst_text.splitlines():
+        parts = line.split()
+        if start is None:
+            start = int(parts[0])
+
+        if len(parts) == 1:
+            final_states.add(int(parts[0]))
+            continue
+
+        weight = float(parts[4]) if len(parts) > 4 else 0.0
+        arcs[int(parts[0])].append((int(parts[1]), parts[2], parts[3], weight))
+
+    return start, arcs, final_states
+
+
+def _paths(start: int, arcs: Arcs, final_states) -> "Counter[Path]":
+    paths: "Counter[Path]" = Counter()
+    stack = [(start, (), (), 0.0)]
+    while stack:
+        state, in_labels, out_labels, weight = stack.pop()
+        if state in final_states:
+            paths[(in_labels, out_labels, round(weight, 4))] += 1
+
+        for to_state, in_label, out_label, arc_weight in arcs[state]:
+            stack.append(
+                (
+                    to_state,
+                    in_labels + ((in_label,) if in_label != EPS else ()),
+                    out_labels + ((out_label,) if out_label != EPS else ()),
+                    weight + arc_weight,
+                )
+            )
+
+    return paths
+
+
+def _check_round_trip(fst: Fst) -> None:
+    fst_text = io.StringIO()
+    symbols_text = io.StringIO()
+    fst.write(fst_text, symbols_text)
+
+    symbol_ids: Dict[str, int] = {}
+    for line in symbols_text.getvalue().splitlines():
+        symbol, symbol_id = line.split()
+        symbol_ids[symbol] = int(symbol_id)
+
+    fst_bytes = io.BytesIO()
+    fst.write_binary(fst_bytes, symbol_ids, symbols_name="words.txt")
+
+    text_paths = _paths(*_read_text(fst_text.getvalue()))
+    binary_paths = _paths(*_read_binary(fst_bytes.getvalue(), symbol_ids, "words.txt"))
+    assert text_paths
+    assert binary_paths == text_paths
+
+
+def test_weights_and_subgraph() -> None:
+    subgraph = Fst()
+    sub_state = subgraph.next_edge(subgraph.start, "red", "red", log_prob=0.5)
+    subgraph.final_states.add(sub_state)
+    sub_state = subgraph.next_edge(subgraph.start, "green", "green")
+    subgraph.final_states.add(sub_state)
+
+    fst = Fst()
+    fst.subgraphs["#subgraph:color"] = subgraph
+    state = fst.next_edge(fst.start, "turn", "turn", log_prob=1.25)
+    state = fst.next_edge(state, "#subgraph:color", EPS)
+    state = fst.next_edge(state, "light", "light")
+    fst.final_states.add(state)
+    state = fst.next_edge(fst.start, "#subgraph:color", EPS, log_prob=2.0)
+    fst.final_states.add(state)
+
+    _check_round_trip(fst)
+
+
+@pytest.mark.parametrize("share_subgraphs", [False, True])
+def test_intents(share_subgraphs: bool) -> None:
+    intents = Intents.from_dict(
+        {
+            "language": "en",
+            "intents": {
+                "HassTurnOn": {
+                    "data": [{"sentences": ["(turn | switch) on [the] {name}"]}]
+                },
+                "HassLightSet": {
+                    "data": [
+                        {"sentences": ["set [the] {name} [brightness] to {brightness}"]}
+                    ]
+                },
+            },
+            "lists": {
+                "name": {"values": ["kitchen light", "living room lamp", "fan"]},
+                "brightness": {"range": {"from": 0, "to": 100}},
+            },
+        }
+    )
+    fst = intents_to_fst(
+        intents, number_language="en", share_subgraphs=share_subgraphs
+    ).remove_spaces()
+    fst.prune()
+    fst.minimize()
+    assert bool(fst.subgraphs) == share_subgraphs
+
+    _check_round_trip(fst)
+
+
+def test_missing_symbol() -> None:
+    fst = Fst()
+    state = fst.next_edge(fst.start, "word", "word")
+    fst.final_states.add(state)
+
+    with pytest.raises(ValueError):
+        fst.write_binary(io.BytesIO(), {EPS: 0})
@@ -0,0 +1,100 @@
+"""Fuzzy matching of transcripts against G.fuzzy.
+
+lang_fuzzy has a text FST for "turn on [the] (kitchen lamp | tv) [please]",
+where "tv" is output as "television" with a cost of 0.5. Deletion costs are
+1 for every word except "please" (0.25).
+"""
+
+import shutil
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import pytest
+
+from rhasspy_speech.fuzzy import (
+    DELETIONS_FILENAME,
+    FUZZY_FST_FILENAME,
+    NBEST_PENALTY,
+    get_fuzzy_matcher,
+)
+
+LANG_DIR = Path(__file__).parent / "data" / "lang_fuzzy"
+
+
+def _match(lang_dir: Path, *nbest_texts: str) -> Optional[Tuple[str, float]]:
+    matcher = get_fuzzy_matcher(lang_dir)
+    assert matcher is not None
+
+    nbest_words: List[List[str]] = [text.split() for text in nbest_texts]
+    return matcher.match(nbest_words)
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        # Exact
+        ("turn on the kitchen lamp", ("turn on the kitchen lamp", 0.0)),
+        ("turn on kitchen lamp please", ("turn on kitchen lamp please", 0.0)),
+        ("turn on tv", ("turn on television", 0.5)),
+        # Deletion (costs from G.fuzzy.deletions.txt)
+        ("turn on on the kitchen lamp", ("turn on the kitchen lamp", 1.0)),
+        ("please turn on the tv", ("turn on the television", 0.75)),
+        (
+            "turn on the kitchen lamp please please",
+            ("turn on the kitchen lamp please", 0.25),
+        ),
+        ("turn on the kitchen lamp tv", ("turn on the kitchen lamp", 1.0)),
+        # Words outside the vocabulary can't be deleted
+        ("turn on the kitchen lump", None),
+        ("turn on", None),
+    ],
+)
+def test_match(text: str, expected: Optional[Tuple[str, float]]) -> None:
+    assert _match(LANG_DIR, text) == expected
+
+
+def test_substitution() -> None:
+    # Best candidate has a wrong word, so the next one is used
+    assert _match(LANG_DIR, "turn on the kitchen lump", "turn on the kitchen lamp") == (
+        "turn on the kitchen lamp",
+        pytest.approx(5 * NBEST_PENALTY),
+    )
+
+    # Deleting the wrong word from the best candidate costs less
+    assert _match(
+        LANG_DIR, "please turn on the kitchen lamp", "turn on the kitchen lamp"
+    ) == ("turn on the kitchen lamp", 0.25)
+
+    # Otherwise the next candidate is cheaper
+    assert _match(LANG_DIR, "turn on the tv tv", "turn on the kitchen lamp") == (
+        "turn on the kitchen lamp",
+        pytest.approx(5 * NBEST_PENALTY),
+    )
+
+
+def test_deletion_loops(tmp_path: Path) -> None:
+    """Lang dirs from older versions have deletion loops in the FST."""
+    fst_text = (LANG_DIR / FUZZY_FST_FILENAME).read_text(encoding="utf-8")
+    states = {line.split()[0] for line in fst_text.splitlines()}
+    with open(tmp_path / FUZZY_FST_FILENAME, "w", encoding="utf-8") as fst_file:
+        fst_file.write(fst_text)
+        for line in (LANG_DIR / DELETIONS_FILENAME).read_text().splitlines():
+            word, cost = line.split()
+            for state in sorted(states):
+                print(state, state, word, "<eps>", cost, file=fst_file)
+                print(state, state, "<eps>", "<eps>", file=fst_file)
+
+    assert not (tmp_path / DELETIONS_FILENAME).exists()
+    assert _match(tmp_path, "please turn on the tv") == ("turn on the television", 0.75)
+    assert _match(tmp_path, "turn on on the kitchen lamp") == (
+        "turn on the kitchen lamp",
+        1.0,
+    )
+
+
+def test_reload_on_change(tmp_path: Path) -> None:
+    shutil.copytree(LANG_DIR, tmp_path, dirs_exist_ok=True)
+    assert _match(tmp_path, "please turn on tv") == ("turn on television", 0.75)
+
+    (tmp_path / DELETIONS_FILENAME).write_text("please 2.0\n", encoding="utf-8")
+    assert _match(tmp_path, "please turn on tv") == ("turn on television", 2.5)
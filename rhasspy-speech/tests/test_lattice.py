@@ -0,0 +1,91 @@
+"""N-best paths of Kaldi lattices in text and binary archives.
+
+lattice.txt is a compact lattice (as written by lattice-copy --write-compact
+in text mode) for "turn (on | off) the (light | lights)". lattice.ark is a
+binary lattice for "turn (on | off)" with word-epsilon arcs and two final
+states.
+"""
+
+from pathlib import Path
+from typing import List, Tuple
+
+import pytest
+
+from rhasspy_speech.lattice import (
+    ids_to_words,
+    lattice_nbest,
+    load_symbol_table,
+    read_lattice,
+    read_lattices,
+)
+
+DATA_DIR = Path(__file__).parent / "data"
+
+# (words, graph cost, acoustic cost)
+NBestPath = Tuple[str, float, float]
+
+
+def _nbest(
+    lattice_name: str, n: int, acoustic_scale: float
+) -> Tuple[str, List[NBestPath]]:
+    symbols = load_symbol_table(DATA_DIR / "words.txt")
+    lattices = read_lattices((DATA_DIR / lattice_name).read_bytes())
+    assert len(lattices) == 1
+
+    key, lattice = lattices[0]
+    return key, [
+        (
+            " ".join(ids_to_words(path.word_ids, symbols)),
+            path.graph_cost,
+            path.acoustic_cost,
+        )
+        for path in lattice.nbest(n, acoustic_scale=acoustic_scale)
+    ]
+
+
+def test_text_compact_lattice() -> None:
+    assert _nbest("lattice.txt", 10, 1.0) == (
+        "utt1",
+        [
+            ("turn off the lights", 5.25, 45.0),
+            ("turn off the light", 4.75, 46.0),
+            ("turn on the lights", 4.75, 47.0),
+            ("turn on the light", 4.25, 48.0),
+        ],
+    )
+
+    # Acoustic scale changes the order
+    assert _nbest("lattice.txt", 2, 0.1) == (
+        "utt1",
+        [("turn on the light", 4.25, 48.0), ("turn off the light", 4.75, 46.0)],
+    )
+
+
+def test_binary_lattice() -> None:
+    # One path per final state
+    assert _nbest("lattice.ark", 10, 1.0) == (
+        "utt2",
+        [
+            ("turn off", 3.5, 10.0),
+            ("turn off", 6.0, 9.0),
+            ("turn on", 2.0, 14.0),
+            ("turn on", 4.5, 13.0),
+        ],
+    )
+
+    paths = lattice_nbest((DATA_DIR / "lattice.ark").read_bytes(), 1, 0.1)
+    assert [(path.word_ids, path.cost(0.1)) for path in paths] == [
+        ([1, 2], pytest.approx(3.4))
+    ]
+
+
+@pytest.mark.parametrize("lattice_name", ["lattice.txt", "lattice.ark"])
+def test_incomplete_lattice(lattice_name: str) -> None:
+    data = (DATA_DIR / lattice_name).read_bytes()
+    _key, _lattice, offset = read_lattice(data)
+    assert offset == len(data)
+
+    # Readers wait for more bytes on EOFError
+    for end in range(len(data)):
+        with pytest.raises(EOFError):
+            read_lattice(data[:end])
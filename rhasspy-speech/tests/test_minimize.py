@@ -0,0 +1,202 @@
+"""Fst.minimize keeps every path's labels and weight."""
+
+import io
+import random
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from hassil.intents import Intents
+
+from rhasspy_speech.hassil_fst import EPS, Fst, intents_to_fst
+
+# (input labels, output labels) -> minimum weight
+PathWeights = Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], float]
+
+
+def _path_weights(fst: Fst, subgraphs: Optional[Dict[str, Fst]] = None) -> PathWeights:
+    """Enumerate paths of an acyclic FST.
+
+    Subgraph labels are kept as labels unless subgraphs are given.
+    """
+    fst_text = io.StringIO()
+    fst.write(fst_text, subgraphs=subgraphs if subgraphs is not None else {})
+
+    start = None
+    arcs: Dict[int, List[Tuple[int, str, str, float]]] = defaultdict(list)
+    final_states = set()
+    for line in fst_text.getvalue().splitlines():
+        parts = line.split()
+        if start is None:
+            start = int(parts[0])
+
+        if len(parts) == 1:
+            final_states.add(int(parts[0]))
+            continue
+
+        weight = float(parts[4]) if len(parts) > 4 else 0.0
+        arcs[int(parts[0])].append((int(parts[1]), parts[2], parts[3], weight))
+
+    path_weights: PathWeights = {}
+    stack = [(start, (), (), 0.0)]
+    while stack:
+        state, in_labels, out_labels, weight = stack.pop()
+        if state in final_states:
+            key = (in_labels, out_labels)
+            path_weight = round(weight, 6)
+            path_weights[key] = min(path_weights.get(key, path_weight), path_weight)
+
+        for to_state, in_label, out_label, arc_weight in arcs[state]:
+            stack.append(
+                (
+                    to_state,
+                    in_labels + ((in_label,) if in_label != EPS else ()),
+                    out_labels + ((out_label,) if out_label != EPS else ()),
+                    weight + arc_weight,
+                )
+            )
+
+    return path_weights
+
+
+def _build(intents_dict, **kwargs) -> Fst:
+    fst = intents_to_fst(
+        Intents.from_dict(intents_dict), number_language="en", **kwargs
+    ).remove_spaces()
+    fst.prune()
+
+    return fst
+
+
+INTENTS = {
+    "language": "en",
+    "intents": {
+        "HassTurnOn": {
+            "data": [
+                {
+                    "sentences": [
+                        "(turn | switch) on [the] {name} [please]",
+                        "<lights> on",
+                        "(turn | switch) on the <lights> [in the {area}]",
+                    ]
+                }
+            ]
+        },
+        "HassTurnOff": {
+            "data": [
+                {
+                    "sentences": [
+                        "(turn | switch) off [the] {name} [please]",
+                        "<lights> off",
+                        "(turn | switch) off the <lights> [in the {area}]",
+                    ]
+                }
+            ]
+        },
+        "HassLightSet": {
+            "data": [{"sentences": ["set [the] {name} [brightness] to {brightness}"]}]
+        },
+    },
+    "lists": {
+        "name": {"values": ["kitchen light", "kitchen lamp", "living room lamp"]},
+        "area": {"values": ["kitchen", "living room"]},
+        "brightness": {"range": {"from": 0, "to": 100, "step": 10}},
+    },
+    "expansion_rules": {"lights": "[all] [the] lights"},
+}
+
+
+def test_optional_parts_and_shared_affixes() -> None:
+    fst = _build(INTENTS, share_subgraphs=False)
+    assert not fst.subgraphs
+
+    path_weights = _path_weights(fst)
+    num_arcs = fst.num_arcs
+    fst.minimize()
+
+    assert _path_weights(fst) == path_weights
+    assert fst.num_arcs < num_arcs
+
+
+def test_subgraphs_and_nonterminals() -> None:
+    fst = _build(INTENTS, share_subgraphs=True, nonterminal_lists=["name"])
+    assert fst.subgraphs
+    assert fst.nonterminals
+
+    path_weights = _path_weights(fst)
+    spliced_path_weights = _path_weights(fst, fst.subgraphs)
+    subgraph_path_weights = {
+        label: _path_weights(subgraph) for label, subgraph in fst.subgraphs.items()
+    }
+    nonterminal_path_weights = {
+        label: _path_weights(nonterminal, fst.subgraphs)
+        for label, nonterminal in fst.nonterminals.items()
+    }
+    fst.minimize()
+
+    # Subgraph and nonterminal labels are kept
+    assert _path_weights(fst) == path_weights
+    assert _path_weights(fst, fst.subgraphs) == spliced_path_weights
+    for label, subgraph in fst.subgraphs.items():
+        assert _path_weights(subgraph) == subgraph_path_weights[label]
+
+    for label, nonterminal in fst.nonterminals.items():
+        assert _path_weights(nonterminal, fst.subgraphs) == (
+            nonterminal_path_weights[label]
+        )
+
+
+def test_same_labels_different_weights() -> None:
+    fst = Fst()
+    state = fst.next_edge(fst.start, "turn", "turn", log_prob=0.5)
+    fst.accept(fst.next_edge(state, "on", "on"))
+    state = fst.next_edge(fst.start, "turn", "turn", log_prob=1.0)
+    fst.accept(fst.next_edge(state, "off", "off"))
+    state = fst.next_edge(fst.start, "set", "set")
+    fst.accept(fst.next_edge(state, "on", "on", log_prob=0.5))
+    state = fst.next_edge(fst.start, "stop", "stop")
+    fst.accept(fst.next_edge(state, "on", "on", log_prob=1.0))
+
+    path_weights = _path_weights(fst)
+    fst.minimize()
+
+    assert _path_weights(fst) == path_weights
+
+
+def _random_fst(rng: random.Random) -> Fst:
+    """Random acyclic FST that is mostly a tree, so states share prefixes."""
+    num_states = rng.randint(2, 12)
+    fst = Fst()
+
+    def add_random_edge(from_state: int, to_state: int) -> None:
+        fst.add_edge(
+            from_state,
+            to_state,
+            rng.choice(["a", "b", "#subgraph:c", EPS]),
+            rng.choice(["a", "x", EPS]),
+            rng.choice([None, None, 0.5, 1.0]),
+        )
+
+    for to_state in range(1, num_states):
+        add_random_edge(rng.randrange(to_state), to_state)
+
+    for _ in range(rng.randint(0, num_states)):
+        from_state = rng.randrange(num_states - 1)
+        add_random_edge(from_state, rng.randint(from_state + 1, num_states - 1))
+
+    for state in rng.sample(
+        range(1, num_states), min(num_states - 1, rng.randint(1, 3))
+    ):
+        fst.accept(state)
+
+    fst.prune()
+
+    return fst
+
+
+def test_random_acyclic() -> None:
+    for seed in range(500):
+        fst = _random_fst(random.Random(seed))
+        path_weights = _path_weights(fst)
+        fst.minimize()
+
+        assert _path_weights(fst) == path_weights, seed
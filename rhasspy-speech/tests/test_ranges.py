@@ -0,0 +1,102 @@
+"""Slot values of range lists decoded from the sentence FST."""
+
+import io
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+import pytest
+from hassil.intents import Intents
+
+from rhasspy_speech import hassil_fst
+from rhasspy_speech.hassil_fst import EPS, decode_meta, intents_to_fst
+
+NUM_STOP = 130
+PCT_STOP = 5
+COLORS = ("red", "green")
+
+
+def _decode_sentences(sentences: List[str]) -> Dict[str, Set[str]]:
+    """Get decoded outputs for each input text of the FST."""
+    intents = Intents.from_dict(
+        {
+            "language": "en",
+            "intents": {"Test": {"data": [{"sentences": sentences}]}},
+            "lists": {
+                "num": {"range": {"from": 0, "to": NUM_STOP}},
+                "pct": {"range": {"from": 0, "to": PCT_STOP}},
+                "color": {"values": list(COLORS)},
+            },
+        }
+    )
+    fst = intents_to_fst(intents, number_language="en").remove_spaces()
+    fst.prune()
+
+    fst_text = io.StringIO()
+    fst.write(fst_text)
+
+    start = None
+    arcs: Dict[int, List[Tuple[int, str, str]]] = defaultdict(list)
+    final_states = set()
+    for line in fst_text.getvalue().splitlines():
+        parts = line.split()
+        if start is None:
+            start = int(parts[0])
+
+        if len(parts) == 1:
+            final_states.add(int(parts[0]))
+        else:
+            arcs[int(parts[0])].append((int(parts[1]), parts[2], parts[3]))
+
+    outputs: Dict[str, Set[str]] = defaultdict(set)
+    stack = [(start, (), ())]
+    while stack:
+        state, in_words, out_words = stack.pop()
+        if state in final_states:
+            outputs[" ".join(in_words)].add(decode_meta(" ".join(out_words)))
+
+        for to_state, in_label, out_label in arcs[state]:
+            stack.append(
+                (
+                    to_state,
+                    in_words + ((in_label,) if in_label != EPS else ()),
+                    out_words + ((out_label,) if out_label != EPS else ()),
+                )
+            )
+
+    return outputs
+
+
+@pytest.mark.parametrize(
+    "template",
+    [
+        # Separate words
+        "d {num} {color}",
+        "e {num}",
+        # Glued to the next list, range, or text
+        "b {num}{color}",
+        "a {num}{pct}",
+        "c {num}-{color}",
+        "f {num}x",
+        # Glued to the list before
+        "g {color}{num}",
+    ],
+)
+def test_range_slot_values(template: str, monkeypatch) -> None:
+    outputs = _decode_sentences([template])
+
+    # Every number spelled out as a whole (no shared head/tail alternatives)
+    monkeypatch.setattr(hassil_fst, "_split_number", lambda engine, number: None)
+    expected_outputs = _decode_sentences([template])
+
+    assert outputs == expected_outputs
+
+
+def test_glued_number_tails() -> None:
+    outputs = _decode_sentences(
+        ["b {num}{color}", "a {num}{pct}", "c {num}-{color}", "d {num} {color}"]
+    )
+
+    assert outputs["b ninety twored"] == {"b 92 red"}
+    assert outputs["a one hundred twenty fivethree"] == {"a 125 3"}
+    assert outputs["c ninety two-red"] == {"c 92 red"}
+    assert outputs["d ninety two red"] == {"d 92 red"}
@@ -0,0 +1,140 @@
+"""Admission control of DecodeScheduler."""
+
+import asyncio
+from typing import List
+
+from wyoming_rhasspy_speech.scheduler import DecodeScheduler
+
+
+class Decodes:
+    """Decodes that finish when released, tracking how many run at once."""
+
+    def __init__(self) -> None:
+        self.running = 0
+        self.max_running = 0
+        self.release = asyncio.Event()
+
+    async def decode(self, text: str) -> List[str]:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await self.release.wait()
+        finally:
+            self.running -= 1
+
+        return [text]
+
+
+def test_max_concurrent() -> None:
+    async def run_test() -> None:
+        scheduler = DecodeScheduler(max_concurrent=2, max_queue_seconds=-1)
+        decodes = Decodes()
+        tasks = [
+            asyncio.create_task(scheduler.run("model", decodes.decode(str(i))))
+            for i in range(5)
+        ]
+        await asyncio.sleep(0.1)
+
+        stats = scheduler.get_stats()["model"]
+        assert decodes.running == 2
+        assert (stats["active"], stats["queued"]) == (2, 3)
+
+        decodes.release.set()
+        assert await asyncio.gather(*tasks) == [[str(i)] for i in range(5)]
+        assert decodes.max_running == 2
+
+        stats = scheduler.get_stats()["model"]
+        assert (stats["active"], stats["queued"]) == (0, 0)
+        assert (stats["completed"], stats["rejected"]) == (5, 0)
+        assert stats["max_wait_seconds"] >= 0.1
+        assert 0 < stats["average_wait_seconds"] < stats["max_wait_seconds"]
+
+    asyncio.run(run_test())
+
+
+def test_models_have_separate_slots() -> None:
+    async def run_test() -> None:
+        scheduler = DecodeScheduler(max_concurrent=1, max_queue_seconds=0)
+        decodes = Decodes()
+        tasks = [
+            asyncio.create_task(scheduler.run(model_key, decodes.decode(model_key)))
+            for model_key in ("model_a", "model_b")
+        ]
+        await asyncio.sleep(0)
+        assert decodes.running == 2
+
+        decodes.release.set()
+        assert await asyncio.gather(*tasks) == [["model_a"], ["model_b"]]
+
+    asyncio.run(run_test())
+
+
+def test_zero_timeout() -> None:
+    async def run_test() -> None:
+        scheduler = DecodeScheduler(max_concurrent=1, max_queue_seconds=0)
+        decodes = Decodes()
+
+        # Free slot is taken without waiting
+        task = asyncio.create_task(scheduler.run("model", decodes.decode("first")))
+        await asyncio.sleep(0)
+        assert decodes.running == 1
+
+        # No queueing when every slot is busy
+        assert await scheduler.run("model", decodes.decode("second")) is None
+
+        decodes.release.set()
+        assert await task == ["first"]
+        assert await scheduler.run("model", decodes.decode("third")) == ["third"]
+
+        stats = scheduler.get_stats()["model"]
+        assert (stats["completed"], stats["rejected"]) == (2, 1)
+
+    asyncio.run(run_test())
+
+
+def test_timeout() -> None:
+    async def run_test() -> None:
+        scheduler = DecodeScheduler(max_concurrent=1, max_queue_seconds=0.1)
+        decodes = Decodes()
+        task = asyncio.create_task(scheduler.run("model", decodes.decode("first")))
+        await asyncio.sleep(0)
+
+        # Rejected after waiting
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        assert await scheduler.run("model", decodes.decode("second")) is None
+        assert loop.time() - start_time >= 0.1
+
+        # Admitted while waiting
+        waiting_task = asyncio.create_task(
+            scheduler.run("model", decodes.decode("third"))
+        )
+        await asyncio.sleep(0.05)
+        assert scheduler.get_stats()["model"]["queued"] == 1
+
+        decodes.release.set()
+        assert await task == ["first"]
+        assert await waiting_task == ["third"]
+
+        stats = scheduler.get_stats()["model"]
+        assert (stats["queued"], stats["completed"], stats["rejected"]) == (0, 2, 1)
+
+    asyncio.run(run_test())
+
+
+def test_acquire_and_release() -> None:
+    async def run_test() -> None:
+        scheduler = DecodeScheduler(max_concurrent=1, max_queue_seconds=5)
+        assert await scheduler.acquire("model")
+
+        # Streaming decodes don't wait for a slot
+        assert not await scheduler.acquire("model", max_queue_seconds=0)
+
+        scheduler.release("model")
+        assert await scheduler.acquire("model", max_queue_seconds=0)
+        scheduler.release("model")
+
+        stats = scheduler.get_stats()["model"]
+        assert (stats["active"], stats["completed"], stats["rejected"]) == (0, 2, 1)
+
+    asyncio.run(run_test())
@@ -0,0 +1,109 @@
+"""Concurrent training stages with dependencies."""
+
+import asyncio
+from typing import Dict, List
+
+import pytest
+
+from rhasspy_speech.stage_scheduler import Stage, run_stages
+
+
+class StageRecorder:
+    """Stages that record when they start and finish."""
+
+    def __init__(self) -> None:
+        self.events: List[str] = []
+        self.running = 0
+        self.max_running = 0
+
+    def stage(self, name: str, *depends_on: str, fail: bool = False) -> Stage:
+        async def run() -> None:
+            self.events.append(f"start {name}")
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            try:
+                await asyncio.sleep(0.01)
+                if fail:
+                    raise RuntimeError(name)
+            finally:
+                self.running -= 1
+
+            self.events.append(f"end {name}")
+
+        return Stage(name, run, depends_on=list(depends_on))
+
+    def finished(self) -> List[str]:
+        return [event[4:] for event in self.events if event.startswith("end ")]
+
+
+def _diamond(recorder: StageRecorder) -> List[Stage]:
+    # Listed out of order on purpose
+    return [
+        recorder.stage("graph", "grammar", "fuzzy"),
+        recorder.stage("grammar", "lang"),
+        recorder.stage("fuzzy", "lang"),
+        recorder.stage("lang"),
+        recorder.stage("online", "lang"),
+    ]
+
+
+@pytest.mark.parametrize("max_parallel", [1, 2, 4])
+def test_dependencies_and_limit(max_parallel: int) -> None:
+    recorder = StageRecorder()
+    asyncio.run(run_stages(_diamond(recorder), max_parallel=max_parallel))
+
+    assert sorted(recorder.finished()) == [
+        "fuzzy",
+        "grammar",
+        "graph",
+        "lang",
+        "online",
+    ]
+
+    # Every stage starts after its dependencies end
+    positions: Dict[str, int] = {
+        event: idx for idx, event in enumerate(recorder.events)
+    }
+    for stage in _diamond(StageRecorder()):
+        for dependency in stage.depends_on:
+            assert positions[f"end {dependency}"] < positions[f"start {stage.name}"]
+
+    # grammar, fuzzy, and online can run together after lang
+    assert recorder.max_running == min(max_parallel, 3)
+
+
+def test_failure_cancels_other_stages() -> None:
+    recorder = StageRecorder()
+    stages = [
+        recorder.stage("lang"),
+        recorder.stage("grammar", "lang", fail=True),
+        recorder.stage("graph", "grammar"),
+        recorder.stage("slow", "lang"),
+    ]
+
+    async def slow() -> None:
+        recorder.events.append("start slow")
+        await asyncio.sleep(10)
+        recorder.events.append("end slow")
+
+    stages[-1].run = slow
+
+    with pytest.raises(RuntimeError, match="grammar"):
+        asyncio.run(run_stages(stages, max_parallel=2))
+
+    assert "start slow" in recorder.events
+    assert recorder.finished() == ["lang"]
+
+
+def test_invalid_stages() -> None:
+    recorder = StageRecorder()
+    with pytest.raises(ValueError, match="missing"):
+        asyncio.run(run_stages([recorder.stage("graph", "missing")]))
+
+    with pytest.raises(ValueError, match="cycle"):
+        asyncio.run(run_stages([recorder.stage("a", "b"), recorder.stage("b", "a")]))
+
+    with pytest.raises(ValueError, match="Duplicate"):
+        asyncio.run(run_stages([recorder.stage("a"), recorder.stage("a")]))
+
+    assert recorder.events == []
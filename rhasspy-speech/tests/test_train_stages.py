@@ -0,0 +1,254 @@
+"""Training reruns only the stages whose inputs changed.
+
+Stages that run Kaldi tools are replaced with ones that only write their
+outputs, so the real stage graph and StageCache decide what runs.
+"""
+
+import asyncio
+import io
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, List, Optional
+
+import pytest
+from hassil.intents import Intents
+
+from rhasspy_speech.const import LangSuffix
+from rhasspy_speech.g2p import LexiconDatabase
+from rhasspy_speech.intent_fst import intents_to_fst
+from rhasspy_speech.kaldi import KaldiTrainer
+from rhasspy_speech.stage_cache import MANIFEST_NAME, StageCache, StageHash
+
+SENTENCES = ["turn on [the] {name} [in {area}]"]
+NAMES = ["kitchen lamp", "tv"]
+AREAS = ["kitchen", "living room"]
+
+ALL_STAGES = [
+    "lexicon",
+    "prepare_lang_grammar",
+    "grammar_grammar",
+    "fuzzy_grammar",
+    "mkgraph_grammar",
+    "online_grammar",
+]
+
+
+def _touch(*paths: Path) -> None:
+    for path in paths:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+
+
+class FakeTrainer:
+    """Trains in a temporary directory and records which stages ran."""
+
+    def __init__(self, root: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        self.root = root
+        self.model_dir = root / "model"
+        for model_subdir in ("conf", "phones", "model", "extractor"):
+            (self.model_dir / model_subdir).mkdir(parents=True)
+            (self.model_dir / model_subdir / "file.txt").write_text(model_subdir)
+
+        (root / "utils").mkdir()
+        self.tools = SimpleNamespace(egs_utils_dir=root / "utils")
+
+        # Stages in the order they ran
+        self.stages_run: List[str] = []
+
+        async def create_lexicon(trainer: KaldiTrainer, *_args: Any) -> None:
+            self.stages_run.append("lexicon")
+            _touch(
+                trainer.dict_local_dir / "lexicon.txt",
+                trainer.dict_local_dir / "lexiconp.txt",
+            )
+
+        async def prepare_lang(trainer: KaldiTrainer, lang_type: LangSuffix) -> None:
+            self.stages_run.append(f"prepare_lang_{lang_type.value}")
+            lang_dir = trainer.lang_dir(lang_type.value)
+            _touch(lang_dir / "L_disambig.fst", lang_dir / "words.txt")
+
+        async def create_grammar(trainer: KaldiTrainer, lang_type: LangSuffix) -> None:
+            self.stages_run.append(f"grammar_{lang_type.value}")
+            _touch(trainer.lang_dir(lang_type.value) / "G.fst")
+
+        async def create_nonterminal_symbols(
+            trainer: KaldiTrainer, lang_type: LangSuffix
+        ) -> None:
+            self.stages_run.append(f"nonterm_symbols_{lang_type.value}")
+            _touch(trainer.nonterminals_dir(lang_type.value) / "words.txt")
+
+        async def compile_nonterminal(
+            trainer: KaldiTrainer, symbols_path: Path, text_fst_path: Path, text: str
+        ) -> None:
+            self.stages_run.append(f"nonterm_{text_fst_path.name.split('.')[0]}")
+            _touch(text_fst_path, text_fst_path.with_suffix(""))
+
+        # Written in-process
+        create_fuzzy_fst = KaldiTrainer._create_fuzzy_fst
+
+        async def record_fuzzy_fst(
+            trainer: KaldiTrainer, lang_type: LangSuffix
+        ) -> None:
+            self.stages_run.append(f"fuzzy_{lang_type.value}")
+            await create_fuzzy_fst(trainer, lang_type)
+
+        async def mkgraph(trainer: KaldiTrainer, lang_type: LangSuffix) -> None:
+            self.stages_run.append(f"mkgraph_{lang_type.value}")
+            _touch(trainer.graph_dir(lang_type.value) / "HCLG.fst")
+
+        async def prepare_online_decoding(
+            trainer: KaldiTrainer, lang_type: LangSuffix
+        ) -> None:
+            self.stages_run.append(f"online_{lang_type.value}")
+            _touch(trainer.model_dir / "online" / "conf" / "online.conf")
+
+        monkeypatch.setattr(KaldiTrainer, "_create_lexicon", create_lexicon)
+        monkeypatch.setattr(KaldiTrainer, "_prepare_lang", prepare_lang)
+        monkeypatch.setattr(KaldiTrainer, "_create_grammar", create_grammar)
+        monkeypatch.setattr(
+            KaldiTrainer, "_create_nonterminal_symbols", create_nonterminal_symbols
+        )
+        monkeypatch.setattr(KaldiTrainer, "_compile_nonterminal", compile_nonterminal)
+        monkeypatch.setattr(KaldiTrainer, "_create_fuzzy_fst", record_fuzzy_fst)
+        monkeypatch.setattr(KaldiTrainer, "_mkgraph", mkgraph)
+        monkeypatch.setattr(
+            KaldiTrainer, "_prepare_online_decoding", prepare_online_decoding
+        )
+
+    def train(
+        self,
+        sentences: Optional[List[str]] = None,
+        names: Optional[List[str]] = None,
+        nonterminal_lists: Optional[List[str]] = None,
+    ) -> List[str]:
+        """Train and return the names of the stages that ran."""
+        intents = Intents.from_dict(
+            {
+                "language": "en",
+                "intents": {
+                    "HassTurnOn": {"data": [{"sentences": sentences or SENTENCES}]}
+                },
+                "lists": {
+                    "name": {"values": names or NAMES},
+                    "area": {"values": AREAS},
+                },
+            }
+        )
+        fst_context = intents_to_fst(
+            intents,
+            io.StringIO(),
+            LexiconDatabase(),
+            number_language="en",
+            nonterminal_lists=nonterminal_lists,
+        )
+        trainer = KaldiTrainer(
+            self.root / "train",
+            self.model_dir,
+            self.tools,  # type: ignore[arg-type]
+            fst_context,
+        )
+
+        self.stages_run.clear()
+        asyncio.run(trainer.train(lang_suffixes=[LangSuffix.GRAMMAR]))
+
+        return list(self.stages_run)
+
+
+@pytest.fixture(name="trainer")
+def trainer_fixture(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> FakeTrainer:
+    return FakeTrainer(tmp_path, monkeypatch)
+
+
+def test_unchanged_retrain_skips_stages(trainer: FakeTrainer) -> None:
+    stages = trainer.train()
+    assert sorted(stages) == sorted(ALL_STAGES)
+
+    # Dependencies ran first
+    assert stages.index("lexicon") < stages.index("prepare_lang_grammar")
+    assert stages.index("prepare_lang_grammar") < stages.index("grammar_grammar")
+    assert stages.index("grammar_grammar") < stages.index("fuzzy_grammar")
+    assert stages.index("grammar_grammar") < stages.index("mkgraph_grammar")
+
+    assert trainer.train() == []
+
+    # Missing output reruns its stage
+    (trainer.root / "train" / "graph_grammar" / "HCLG.fst").unlink()
+    assert trainer.train() == ["mkgraph_grammar"]
+
+
+def test_changed_sentences(trainer: FakeTrainer) -> None:
+    trainer.train()
+
+    # Same words and slot values, so lexicon and lang dir are kept
+    stages = trainer.train(sentences=SENTENCES + ["turn {name} on"])
+    assert sorted(stages) == ["fuzzy_grammar", "grammar_grammar", "mkgraph_grammar"]
+
+
+def test_changed_words(trainer: FakeTrainer) -> None:
+    trainer.train()
+
+    # New words and slot values change the lexicon, which everything uses
+    assert sorted(trainer.train(names=NAMES + ["radio"])) == sorted(ALL_STAGES)
+
+
+def test_changed_model_file(trainer: FakeTrainer) -> None:
+    trainer.train()
+
+    (trainer.model_dir / "model" / "file.txt").write_text("changed")
+    assert sorted(trainer.train()) == ["mkgraph_grammar", "online_grammar"]
+
+
+def test_nonterminals(trainer: FakeTrainer) -> None:
+    stages = trainer.train(nonterminal_lists=["name", "area"])
+    assert sorted(stages) == sorted(
+        ALL_STAGES + ["nonterm_symbols_grammar", "nonterm_name", "nonterm_area"]
+    )
+    assert stages.index("nonterm_name") < stages.index("grammar_grammar")
+    assert stages.index("nonterm_area") < stages.index("grammar_grammar")
+
+    # Lists aren't recompiled when only the sentences change
+    stages = trainer.train(
+        sentences=SENTENCES + ["turn {name} on"], nonterminal_lists=["name", "area"]
+    )
+    assert sorted(stages) == ["fuzzy_grammar", "grammar_grammar", "mkgraph_grammar"]
+
+    # Compiled lists are removed when there are none
+    stages = trainer.train(sentences=SENTENCES + ["turn {name} on"])
+    assert sorted(stages) == ["fuzzy_grammar", "grammar_grammar", "mkgraph_grammar"]
+    assert not trainer.root.joinpath(
+        "train", "data", "lang_grammar", "nonterm"
+    ).exists()
+
+
+def test_manifest(tmp_path: Path) -> None:
+    input_path = tmp_path / "input.txt"
+    input_path.write_text("input")
+    output_path = tmp_path / "output.txt"
+    output_path.write_text("output")
+
+    def stage_hash(cache: StageCache, value: Any) -> StageHash:
+        return cache.hash_stage("stage").add(value).add_files(input_path)
+
+    cache = StageCache(tmp_path)
+    assert not cache.is_current("stage", stage_hash(cache, 1), [output_path])
+    cache.complete("stage", stage_hash(cache, 1))
+
+    # Reloaded from the manifest
+    cache = StageCache(tmp_path)
+    assert cache.is_current("stage", stage_hash(cache, 1), [output_path])
+    assert not cache.is_current("stage", stage_hash(cache, 2), [output_path])
+    assert not cache.is_current("stage", stage_hash(cache, 1), [tmp_path / "missing"])
+
+    input_path.write_text("changed")
+    assert not cache.is_current("stage", stage_hash(cache, 1), [output_path])
+
+    cache.complete("stage", stage_hash(cache, 1))
+    cache.invalidate("stage")
+    assert not StageCache(tmp_path).is_current(
+        "stage", stage_hash(cache, 1), [output_path]
+    )
+
+    # Invalid manifest is ignored
+    (tmp_path / MANIFEST_NAME).write_text("{")
+    cache = StageCache(tmp_path)
+    assert not cache.is_current("stage", stage_hash(cache, 1), [output_path])